@@ -16,6 +16,10 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'shared'))
 from shared.models import db, User, Customer, Restaurant, MenuItem, Order, Driver, OrderItem, Address, OrderStatusHistory
+from shared.models import DriverPosition
+from shared.models import OrderArchive, OrderItemArchive, OrderStatusHistoryArchive
+from shared.password_pool import PasswordVerifier, VerifierSaturated
+from shared.telemetry import Metrics
 
 
 # Create API blueprint
@@ -25,6 +29,20 @@ api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# bcrypt runs on a bounded pool so a login burst cannot take every worker thread
+passwords = PasswordVerifier()
+
+@api_bp.record_once
+def init_password_pool(state):
+    passwords.init_app(state.app)
+
+# Prometheus metrics on /metrics (see shared/telemetry.py)
+metrics = Metrics()
+
+@api_bp.record_once
+def init_metrics(state):
+    metrics.init_app(state.app)
+
 def json_response(data=None, message="", status=200):
     """Standard JSON response format"""
     response = {
@@ -35,6 +53,14 @@ def json_response(data=None, message="", status=200):
     }
     return jsonify(response), status
 
+def driver_locations(drivers):
+    """driver_id -> "lat,lng" from driver_positions, falling back to drivers.current_location
+    (no longer written since GPS pings moved to driver_positions)"""
+    driver_ids = [driver.driver_id for driver in drivers]
+    positions = {position.driver_id: f"{float(position.latitude)},{float(position.longitude)}"
+                 for position in DriverPosition.query.filter(DriverPosition.driver_id.in_(driver_ids))} if driver_ids else {}
+    return {driver.driver_id: positions.get(driver.driver_id, driver.current_location) for driver in drivers}
+
 # ============================================
 # AUTHENTICATION ENDPOINTS
 # ============================================
@@ -50,13 +76,13 @@ def login():
         
         user = User.query.filter_by(username=data['username']).first()
         
-        if not user or not user.verify_password(data['password']):
+        if not user or not passwords.verify_user(user, data['password']):
             return json_response(message="Invalid credentials", status=401)
         
         if not user.is_active:
             return json_response(message="Account is disabled", status=403)
         
-        # Update last login
+        # Update last login (also saves a rehashed password)
         user.last_login = datetime.now()
         db.session.commit()
         
@@ -81,6 +107,13 @@ def login():
             }
         }, "Login successful")
         
+    except VerifierSaturated as e:
+        db.session.rollback()
+        logger.warning("Login rejected: password verification pool saturated")
+        response, status = json_response(message="Too many logins in progress, retry shortly", status=429)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, status
+        
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         return json_response(message="Internal server error", status=500)
@@ -249,6 +282,7 @@ def create_order():
         for item in order_items:
             order_item = OrderItem(
                 order_id=order_id,
+                order_created_at=order.created_at,
                 item_id=item['menu_item'].item_id,
                 quantity=item['quantity'],
                 unit_price=item['menu_item'].price
@@ -258,6 +292,7 @@ def create_order():
         # Add to order status history
         status_history = OrderStatusHistory(
             order_id=order_id,
+            order_created_at=order.created_at,
             old_status=None,
             new_status='pending',
             actor_type='customer',
@@ -266,6 +301,7 @@ def create_order():
         db.session.add(status_history)
         
         db.session.commit()
+        metrics.order_created('mobile_api')
         
         logger.info(f"Order created: {order_id} by customer {data['customer_id']}")
         
@@ -281,22 +317,29 @@ def create_order():
         logger.error(f"Create order error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
+def find_order(order_id):
+    """``(order, item model, history model)`` from the live tables, else from the archive"""
+    order = Order.query.filter_by(order_id=order_id).first()
+    if order is not None:
+        return order, OrderItem, OrderStatusHistory
+    return OrderArchive.query.get(order_id), OrderItemArchive, OrderStatusHistoryArchive
+
 @api_bp.route('/orders/<order_id>', methods=['GET'])
 @jwt_required()
 def get_order(order_id):
     """Get order details"""
     try:
-        order = Order.query.filter_by(order_id=order_id).first()
+        order, item_model, history_model = find_order(order_id)
         
         if not order:
             return json_response(message="Order not found", status=404)
         
         # Get order items
-        order_items = OrderItem.query.filter_by(order_id=order_id).all()
+        order_items = item_model.query.filter_by(order_id=order_id).all()
         
         # Get status history
-        status_history = OrderStatusHistory.query.filter_by(order_id=order_id)\
-            .order_by(OrderStatusHistory.changed_at.desc()).all()
+        status_history = history_model.query.filter_by(order_id=order_id)\
+            .order_by(history_model.changed_at.desc()).all()
         
         return json_response({
             "order": {
@@ -345,7 +388,7 @@ def get_order(order_id):
 def track_order(order_id):
     """Get real-time order tracking information"""
     try:
-        order = Order.query.filter_by(order_id=order_id).first()
+        order, _, history_model = find_order(order_id)
         
         if not order:
             return json_response(message="Order not found", status=404)
@@ -362,7 +405,7 @@ def track_order(order_id):
                     "vehicle_type": driver.vehicle_type,
                     "phone_number": user.phone_number if user else None,
                     "rating": float(driver.rating) if driver.rating else 0,
-                    "current_location": driver.current_location
+                    "current_location": driver_locations([driver])[driver.driver_id]
                 }
         
         return json_response({
@@ -376,8 +419,8 @@ def track_order(order_id):
                     "timestamp": history.changed_at.isoformat() if history.changed_at else None,
                     "notes": history.public_notes
                 }
-                for history in OrderStatusHistory.query.filter_by(order_id=order_id)
-                .order_by(OrderStatusHistory.changed_at.asc()).all()
+                for history in history_model.query.filter_by(order_id=order_id)
+                .order_by(history_model.changed_at.asc()).all()
             ]
         })
         
@@ -396,6 +439,7 @@ def get_available_drivers():
     try:
         drivers = Driver.query.filter_by(is_available=True, is_on_shift=True)\
             .order_by(Driver.rating.desc()).all()
+        current_locations = driver_locations(drivers)
         
         available_drivers = []
         for driver in drivers:
@@ -407,7 +451,7 @@ def get_available_drivers():
                     "vehicle_type": driver.vehicle_type,
                     "vehicle_model": driver.vehicle_model,
                     "rating": float(driver.rating) if driver.rating else 0,
-                    "current_location": driver.current_location,
+                    "current_location": current_locations[driver.driver_id],
                     "avg_delivery_time": driver.avg_delivery_time
                 })
         
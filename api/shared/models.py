@@ -117,6 +117,23 @@ class Driver(db.Model):
         return f'<Driver {self.driver_id}>'
 
 
+class DriverPosition(db.Model):
+    """Latest GPS fix per driver, written by the web app's batched flusher"""
+    __tablename__ = 'driver_positions'
+    
+    driver_id = db.Column(db.Integer, primary_key=True)
+    latitude = db.Column(db.Numeric(9, 6), nullable=False)
+    longitude = db.Column(db.Numeric(9, 6), nullable=False)
+    accuracy = db.Column(db.Float)
+    speed = db.Column(db.Float)
+    heading = db.Column(db.SmallInteger)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DriverPosition {self.driver_id} {self.latitude},{self.longitude}>'
+
+
 class MenuItem(db.Model):
     __tablename__ = 'menu_items'
     
@@ -197,6 +214,8 @@ class OrderItem(db.Model):
     
     order_item_id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(30), db.ForeignKey('orders.order_id'), nullable=False)
+    # Partition key of the parent order (orders are partitioned by created_at)
+    order_created_at = db.Column(db.DateTime)
     item_id = db.Column(db.String(20), db.ForeignKey('menu_items.item_id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
@@ -215,6 +234,7 @@ class OrderStatusHistory(db.Model):
     
     history_id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(30), db.ForeignKey('orders.order_id'), nullable=False)
+    order_created_at = db.Column(db.DateTime)
     old_status = db.Column(db.String(20))
     new_status = db.Column(db.String(20), nullable=False)
     changed_by = db.Column(db.Integer, db.ForeignKey('users.user_id'))
@@ -226,13 +246,10 @@ class OrderStatusHistory(db.Model):
     customer_notified = db.Column(db.Boolean, default=False)
     notification_method = db.Column(db.String(20))
     public_notes = db.Column(db.Text)
-    internal_notes = db.Column(db.Text)
     reason_code = db.Column(db.String(50))
     changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     effective_from = db.Column(db.DateTime, default=datetime.utcnow)
     effective_until = db.Column(db.DateTime)
-    ip_address = db.Column(db.String(45))
-    user_agent = db.Column(db.Text)
     source = db.Column(db.String(50), default='web')
     time_in_previous_status = db.Column(db.Integer)
     predicted_time_in_status = db.Column(db.Integer)
@@ -243,3 +260,23 @@ class OrderStatusHistory(db.Model):
     
     def __repr__(self):
         return f'<OrderStatusHistory {self.history_id} for {self.order_id}>'
+
+
+# Closed orders moved out of the live tables by the web app's archiver
+# (app/archive.py); read-only here
+def _archive_table(live, name):
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False)
+               for column in live.columns]
+    return db.Table(name, *columns, db.Column('archived_at', db.DateTime))
+
+
+class OrderArchive(db.Model):
+    __table__ = _archive_table(Order.__table__, 'orders_archive')
+
+
+class OrderItemArchive(db.Model):
+    __table__ = _archive_table(OrderItem.__table__, 'order_items_archive')
+
+
+class OrderStatusHistoryArchive(db.Model):
+    __table__ = _archive_table(OrderStatusHistory.__table__, 'order_status_history_archive')
@@ -0,0 +1,157 @@
+# api/shared/password_pool.py
+"""
+Bounded password verification.
+
+bcrypt at cost 12 takes a few hundred milliseconds of CPU. Running it inline
+lets a login burst occupy every request thread, so logins go through a small
+dedicated pool instead: at most ``PASSWORD_VERIFY_WORKERS`` hashes run at
+once, at most ``PASSWORD_VERIFY_QUEUE`` more may wait, and anything beyond
+that is refused immediately (the login endpoints answer 429). The rest of the
+request threads stay free for order traffic.
+
+Hashes that were not produced with the configured cost and prefix (the
+pgcrypto ``crypt()`` seeds in db/init.sql are ``$2a$``) are rehashed on the
+next successful login.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt as bcrypt_lib
+
+logger = logging.getLogger(__name__)
+
+HASH_PREFIX = '2b'
+
+
+class VerifierSaturated(Exception):
+    """Raised when the verification pool and its queue are full"""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Password verification capacity exhausted")
+        self.retry_after = retry_after
+
+
+# Module-level so they can run in a process pool
+def check_password(password_hash, password):
+    try:
+        return bcrypt_lib.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash (or an over-long password)
+        return False
+
+
+def hash_password(password, rounds):
+    salt = bcrypt_lib.gensalt(rounds, prefix=HASH_PREFIX.encode())
+    return bcrypt_lib.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+class PasswordVerifier:
+    """Flask extension running bcrypt on a bounded executor"""
+
+    def __init__(self, app=None):
+        self.workers = 2
+        self.queue_size = 8
+        self.timeout = 5.0
+        self.rounds = 12
+        self.use_processes = False
+        self._slots = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self.counters = {'verified': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0, 'rehashed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_VERIFY_WORKERS', 2)
+        app.config.setdefault('PASSWORD_VERIFY_QUEUE', 8)
+        app.config.setdefault('PASSWORD_VERIFY_TIMEOUT', 5.0)
+        app.config.setdefault('PASSWORD_VERIFY_EXECUTOR', 'thread')
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+
+        self.workers = app.config['PASSWORD_VERIFY_WORKERS']
+        self.queue_size = app.config['PASSWORD_VERIFY_QUEUE']
+        self.timeout = app.config['PASSWORD_VERIFY_TIMEOUT']
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.use_processes = app.config['PASSWORD_VERIFY_EXECUTOR'] == 'process'
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+
+        app.extensions['password_verifier'] = self
+
+    def _pool(self):
+        # Executors do not survive a fork, build one per worker process
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    if self.use_processes:
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.counters['rejected'] += 1
+            raise VerifierSaturated()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self.counters['timeouts'] += 1
+            raise VerifierSaturated()
+
+    def verify(self, password_hash, password):
+        if not password_hash or password is None:
+            return False
+        ok = self._run(check_password, password_hash, password)
+        self.counters['verified' if ok else 'failed'] += 1
+        return ok
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def needs_rehash(self, password_hash):
+        """True for hashes with another prefix (pgcrypto's $2a$) or cost"""
+        parts = password_hash.split('$')
+        if len(parts) < 4 or parts[1] != HASH_PREFIX:
+            return True
+        try:
+            return int(parts[2]) != self.rounds
+        except ValueError:
+            return True
+
+    def verify_user(self, user, password):
+        """
+        Verify ``user``'s password, upgrading a legacy hash on success.
+
+        The new hash is only assigned; it is saved with the caller's commit.
+        """
+        if not self.verify(user.password_hash, password):
+            return False
+
+        if self.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = self.hash(password)
+                self.counters['rehashed'] += 1
+            except VerifierSaturated:
+                # Upgrade on a later login rather than failing this one
+                pass
+        return True
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'executor': 'process' if self.use_processes else 'thread',
+            **self.counters
+        }
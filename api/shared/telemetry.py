@@ -0,0 +1,485 @@
+# api/shared/telemetry.py
+"""
+Prometheus metrics without a client library.
+
+Counters, gauges and histograms live in process memory and are rendered in
+the text exposition format on ``/metrics``. Histograms use HDR-style
+log-linear buckets (each power of two split into a few linear steps), so
+latencies from a millisecond to tens of seconds keep about the same
+relative precision, and recording one is a ``bisect`` plus an increment.
+
+Under gunicorn each worker only sees its own requests. With ``METRICS_DIR``
+(or ``PROMETHEUS_MULTIPROC_DIR``) set, every worker writes a snapshot of its
+metrics to ``<dir>/metrics_<pid>.json`` every ``METRICS_FLUSH_SECONDS`` and
+the worker answering the scrape merges them: counters and histograms are
+summed over all files (so they never go backwards when a worker restarts),
+gauges only over workers that are still alive. Empty the directory when the
+service is redeployed.
+
+``/metrics`` requires ``Authorization: Bearer <METRICS_TOKEN>`` when a token
+is configured. Without one it only answers scrapes from the loopback
+interface that did not come through a proxy (no ``X-Forwarded-For`` or
+``Forwarded`` header).
+
+The module lives here so the mobile API service, whose build context is
+api/, can import it; the web app re-exports it as app/telemetry.py.
+"""
+import atexit
+import glob
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from flask import Response, g, request
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def hdr_buckets(lowest, highest, steps=4):
+    """Bucket bounds from ``lowest`` to ``highest``: ``steps`` linear steps per power of two"""
+    bounds = []
+    base = lowest
+    while base < highest:
+        bounds.extend(round(base * (1 + i / steps), 9) for i in range(steps))
+        base *= 2
+    return tuple(bound for bound in bounds if bound < highest) + (highest,)
+
+
+# 1ms .. 30s, ~19% relative error
+LATENCY_BUCKETS = hdr_buckets(0.001, 30.0)
+
+
+# ============================================
+# METRIC TYPES
+# ============================================
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), mode='sum'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.mode = mode
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, labelvalues):
+        return tuple(zip(self.labelnames, map(str, labelvalues)))
+
+    def family(self):
+        with self._lock:
+            samples = [(labels, self._copy(value)) for labels, value in self._values.items()]
+        return {'name': self.name, 'type': self.kind, 'help': self.documentation,
+                'mode': self.mode, 'samples': samples}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._labels(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), mode='livesum'):
+        super().__init__(name, documentation, labelnames, mode)
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._labels(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        key = self._labels(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.bounds, value)
+        key = self._labels(labelvalues)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (not cumulative) counts, the last one is +Inf
+                entry = self._values[key] = [[0] * (len(self.bounds) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def family(self):
+        family = super().family()
+        family['bounds'] = self.bounds
+        return family
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+
+# ============================================
+# REGISTRY
+# ============================================
+class MetricsRegistry:
+    """Metrics of this process plus collectors evaluated at snapshot time"""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._collectors = []
+
+    def _add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), mode='livesum'):
+        return self._add(Gauge(name, documentation, labelnames, mode))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """``collector()`` returns extra families (same shape as ``_Metric.family()``)"""
+        self._collectors.append(collector)
+
+    def collect(self):
+        families = [metric.family() for metric in self._metrics.values()]
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        return families
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge(snapshots):
+    """Merge ``(pid, alive, families)`` snapshots into one list of families"""
+    merged = OrderedDict()
+    for pid, alive, families in snapshots:
+        for family in families:
+            target = merged.get(family['name'])
+            if target is None:
+                target = merged[family['name']] = {**family, 'samples': OrderedDict()}
+            if family['type'] == 'gauge' and family['mode'] == 'livesum' and not alive:
+                continue
+            samples = target['samples']
+            for labels, value in family['samples']:
+                labels = tuple(tuple(pair) for pair in labels)
+                current = samples.get(labels)
+                if current is None:
+                    samples[labels] = [list(value[0]), value[1]] if family['type'] == 'histogram' else value
+                elif family['type'] == 'histogram':
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                elif family['mode'] == 'max':
+                    samples[labels] = max(current, value)
+                else:
+                    samples[labels] = current + value
+    for family in merged.values():
+        family['samples'] = list(family['samples'].items())
+    return list(merged.values())
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def exposition(families):
+    """Text exposition format (version 0.0.4)"""
+    lines = []
+    for family in families:
+        name = family['name']
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in family['samples']:
+            if family['type'] == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(family['bounds']) + [float('inf')], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(float(bound))))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# ============================================
+# COLLECTORS
+# ============================================
+def pool_collector(app):
+    """Occupancy of every SQLAlchemy engine's pool, plus checkout waits where instrumented"""
+    def collect():
+        extension = app.extensions.get('sqlalchemy')
+        if extension is None:
+            return []
+        with app.app_context():
+            engines = dict(extension.engines)
+
+        gauges = {name: {'name': f'db_pool_{name}', 'type': 'gauge', 'mode': 'livesum', 'samples': [],
+                         'help': documentation}
+                  for name, documentation in (('size', 'Configured pool size'),
+                                              ('checked_out', 'Connections in use'),
+                                              ('overflow', 'Connections opened beyond the pool size'))}
+        families = list(gauges.values())
+        for key, engine in engines.items():
+            pool = engine.pool
+            labels = (('bind', key or 'primary'),)
+            if not hasattr(pool, 'checkedout'):
+                continue
+            gauges['size']['samples'].append((labels, pool.size()))
+            gauges['checked_out']['samples'].append((labels, pool.checkedout()))
+            gauges['overflow']['samples'].append((labels, max(pool.overflow(), 0)))
+
+            pool_metrics = getattr(pool, 'metrics', None)
+            if pool_metrics is not None:
+                families.append({
+                    'name': 'db_pool_checkout_wait_seconds', 'type': 'histogram', 'mode': 'sum',
+                    'help': 'Time spent waiting for a pooled connection',
+                    'bounds': tuple(bound / 1000.0 for bound in pool_metrics.bounds_ms),
+                    'samples': [(labels, [list(pool_metrics.wait_buckets), pool_metrics.wait_total_ms / 1000.0])]
+                })
+                families.append({
+                    'name': 'db_pool_checkout_timeouts_total', 'type': 'counter', 'mode': 'sum',
+                    'help': 'Checkouts that gave up waiting for a connection',
+                    'samples': [(labels, pool_metrics.timeouts)]
+                })
+        return families
+    return collect
+
+
+CACHE_RESULTS = {'hits': 'hit', 'stale_hits': 'stale_hit', 'negative_hits': 'negative_hit', 'misses': 'miss'}
+
+
+def cache_collector(cache):
+    """Lookups per cache namespace and result, and entries held locally"""
+    def collect():
+        stats = cache.stats()
+        lookups = {'name': 'cache_lookups_total', 'type': 'counter', 'mode': 'sum',
+                   'help': 'Cache lookups by namespace and result', 'samples': []}
+        entries = {'name': 'cache_entries', 'type': 'gauge', 'mode': 'livesum',
+                   'help': 'Entries in the in-process cache tier', 'samples': []}
+        for namespace, values in stats.items():
+            for counter, result in CACHE_RESULTS.items():
+                lookups['samples'].append(((('namespace', namespace), ('result', result)), values[counter]))
+            entries['samples'].append(((('namespace', namespace),), values['size']))
+        return [lookups, entries]
+    return collect
+
+
+def cache_hit_ratio(families):
+    """Hit ratio per namespace, computed after merging so it covers every worker"""
+    lookups = next((family for family in families if family['name'] == 'cache_lookups_total'), None)
+    if lookups is None:
+        return []
+    totals = {}
+    for labels, value in lookups['samples']:
+        namespace = dict(labels)['namespace']
+        total, misses = totals.get(namespace, (0, 0))
+        totals[namespace] = (total + value, misses + (value if dict(labels)['result'] == 'miss' else 0))
+    return [{
+        'name': 'cache_hit_ratio', 'type': 'gauge', 'mode': 'max',
+        'help': 'Share of cache lookups answered without loading',
+        'samples': [((('namespace', namespace),), round((total - misses) / total, 4) if total else 0.0)
+                    for namespace, (total, misses) in totals.items()]
+    }]
+
+
+# ============================================
+# FLASK EXTENSION
+# ============================================
+class Metrics:
+    """Flask extension: request metrics, the snapshot writer and the ``/metrics`` view"""
+
+    def __init__(self, app=None):
+        self.registry = MetricsRegistry()
+        self.enabled = True
+        self.directory = None
+        self.flush_interval = 5
+        self.token = None
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.request_latency = self.registry.histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint, method and status',
+            ('endpoint', 'method', 'status'))
+        self.in_flight = self.registry.gauge('http_requests_in_flight', 'Requests being handled')
+        self.orders_created = self.registry.counter('orders_created_total', 'Orders created', ('source',))
+        self.order_transitions = self.registry.counter(
+            'order_transitions_total', 'Order status changes by new status and source', ('status', 'source'))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+        app.config.setdefault('METRICS_FLUSH_SECONDS', 5)
+        app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+
+        self.app = app
+        self.enabled = app.config['METRICS_ENABLED']
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_SECONDS']
+        self.token = app.config['METRICS_TOKEN']
+
+        if 'sqlalchemy' in app.extensions:
+            self.registry.register_collector(pool_collector(app))
+        if 'cache' in app.extensions:
+            self.registry.register_collector(cache_collector(app.extensions['cache']))
+
+        if self.enabled:
+            app.before_request(self._start_request)
+            app.after_request(self._finish_request)
+            app.teardown_request(self._teardown_request)
+            app.add_url_rule('/metrics', 'metrics', self.view)
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+                atexit.register(self.write_snapshot)
+
+        app.extensions['metrics'] = self
+
+    # ----- request hooks -----
+
+    def _start_request(self):
+        self._ensure_writer()
+        g._metrics_started = time.perf_counter()
+        self.in_flight.inc()
+
+    def _finish_request(self, response):
+        started = g.get('_metrics_started')
+        if started is not None:
+            self.request_latency.observe(time.perf_counter() - started,
+                                         request.endpoint or 'unmatched', request.method, response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        if g.pop('_metrics_started', None) is not None:
+            self.in_flight.dec()
+
+    def order_created(self, source):
+        self.orders_created.inc(source)
+
+    def orders_transitioned(self, status, source, count=1):
+        self.order_transitions.inc(status, source, amount=count)
+
+    # ----- multi-process snapshots -----
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.directory, f'metrics_{pid or os.getpid()}.json')
+
+    def write_snapshot(self):
+        if not self.directory:
+            return
+        path = self._snapshot_path()
+        try:
+            with open(f'{path}.tmp', 'w') as fh:
+                json.dump({'pid': os.getpid(), 'families': self.registry.collect()}, fh)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning(f"Writing metrics snapshot {path} failed: {e}")
+
+    def _ensure_writer(self):
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run_writer, name='metrics-writer', daemon=True).start()
+
+    def _run_writer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.write_snapshot()
+
+    def collect(self):
+        """Families for every worker (or just this process without a metrics directory)"""
+        own = self.registry.collect()
+        if not self.directory:
+            families = merge([(os.getpid(), True, own)])
+        else:
+            snapshots = [(os.getpid(), True, own)]
+            for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                try:
+                    with open(path) as fh:
+                        snapshot = json.load(fh)
+                except (OSError, ValueError):
+                    continue
+                pid = snapshot.get('pid')
+                if pid == os.getpid():
+                    continue
+                snapshots.append((pid, _pid_alive(pid), snapshot['families']))
+            families = merge(snapshots)
+        return families + cache_hit_ratio(families)
+
+    def _allowed(self):
+        if self.token:
+            return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {self.token}')
+        if 'X-Forwarded-For' in request.headers or 'Forwarded' in request.headers:
+            return False
+        try:
+            return ipaddress.ip_address(request.remote_addr or '').is_loopback
+        except ValueError:
+            return False
+
+    def view(self):
+        if not self._allowed():
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(exposition(self.collect()), content_type=CONTENT_TYPE)
@@ -8,13 +8,39 @@ from flask_cors import CORS
 from datetime import timedelta
 import os
 import base64
+from .caching import Cache
+from .password_pool import PasswordVerifier
+from .login_throttle import LoginGuard
+from .jwt_sessions import SessionRegistry
+from .database import configure_pool, init_pool, RoutingSession, ReplicaRouter
+from .query_stats import QueryTracker
+from .telemetry import Metrics
+from .profiling import Profiler
+from .slow_queries import SlowQueryLog
+from .partitions import PartitionMaintainer
+from .order_history import OrderHistoryStore
+from .dispatch import Dispatcher
+from .location_ingest import LocationIngestor
 
 # Create extensions first (but don't import from app yet)
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 jwt = JWTManager()
 cors = CORS()
+cache = Cache()
+passwords = PasswordVerifier()
+login_guard = LoginGuard()
+session_registry = SessionRegistry()
+replica_router = ReplicaRouter()
+query_tracker = QueryTracker()
+metrics = Metrics()
+profiler = Profiler()
+slow_query_log = SlowQueryLog()
+partition_maintainer = PartitionMaintainer()
+order_history = OrderHistoryStore()
+dispatcher = Dispatcher()
+locations = LocationIngestor()
 
 def create_app():
     app = Flask(__name__)
@@ -36,12 +62,93 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['DEBUG'] = os.environ.get('FLASK_ENV') != 'production'
     
+    # Opening hours are local to the restaurants (same zone as the database)
+    app.config['BUSINESS_TIMEZONE'] = os.environ.get('BUSINESS_TIMEZONE', 'Africa/Algiers')
+    
+    # Cache configuration (Redis is optional, without it only the in-process tier is used)
+    app.config['CACHE_REDIS_URL'] = os.environ.get('REDIS_URL')
+    app.config['CACHE_ENABLED'] = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+    app.config['IDENTITY_CACHE_ENABLED'] = os.environ.get('IDENTITY_CACHE_ENABLED', 'true').lower() == 'true'
+    
+    # Password hashing: bcrypt runs on a small bounded pool (see api/shared/password_pool.py)
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['PASSWORD_VERIFY_WORKERS'] = int(os.environ.get('PASSWORD_VERIFY_WORKERS', 2))
+    app.config['PASSWORD_VERIFY_QUEUE'] = int(os.environ.get('PASSWORD_VERIFY_QUEUE', 8))
+    
+    # Failed-login throttling per username and per IP (see app/login_throttle.py)
+    app.config['LOGIN_GUARD_WINDOW'] = int(os.environ.get('LOGIN_GUARD_WINDOW', 300))
+    app.config['LOGIN_GUARD_USER_LIMIT'] = int(os.environ.get('LOGIN_GUARD_USER_LIMIT', 5))
+    app.config['LOGIN_GUARD_IP_LIMIT'] = int(os.environ.get('LOGIN_GUARD_IP_LIMIT', 20))
+    
+    # Optional streaming replica for read-only handlers and reports
+    app.config['DATABASE_REPLICA_URL'] = os.environ.get('DATABASE_REPLICA_URL')
+    app.config['DB_REPLICA_MAX_LAG'] = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+    
+    # Per-request query counting and N+1 detection (see app/query_stats.py)
+    if os.environ.get('QUERY_N_PLUS_ONE'):
+        app.config['QUERY_N_PLUS_ONE'] = os.environ['QUERY_N_PLUS_ONE']
+    app.config['QUERY_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('QUERY_N_PLUS_ONE_THRESHOLD', 10))
+    
+    # Slow-query log with sampled EXPLAIN ANALYZE (see app/slow_queries.py)
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+    app.config['SLOW_QUERY_EXPLAIN_SAMPLE'] = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', 0.1))
+    
+    # Monthly order partitions created ahead of time (see app/partitions.py)
+    app.config['ORDER_PARTITIONS_ENABLED'] = os.environ.get('ORDER_PARTITIONS_ENABLED', 'true').lower() == 'true'
+    app.config['ORDER_PARTITIONS_AHEAD'] = int(os.environ.get('ORDER_PARTITIONS_AHEAD', 3))
+    # Look up ids whose timestamp does not match created_at (imports) in every partition
+    app.config['ORDER_LOOKUP_ALL_PARTITIONS'] = os.environ.get('ORDER_LOOKUP_ALL_PARTITIONS', 'false').lower() == 'true'
+    
+    # Closed orders older than this move to the archive tables (see app/archive.py)
+    app.config['ORDER_ARCHIVE_DAYS'] = int(os.environ.get('ORDER_ARCHIVE_DAYS', 30))
+    
+    # Status-change audit text goes to a side table, in the same transaction
+    # unless write-behind is enabled (see app/order_history.py)
+    app.config['ORDER_AUDIT_WRITE_BEHIND'] = os.environ.get('ORDER_AUDIT_WRITE_BEHIND', 'false').lower() == 'true'
+    app.config['ORDER_AUDIT_FLUSH_MS'] = int(os.environ.get('ORDER_AUDIT_FLUSH_MS', 500))
+    
+    # Batched driver assignment of ready orders (see app/dispatch.py)
+    app.config['DISPATCH_ENABLED'] = os.environ.get('DISPATCH_ENABLED', 'false').lower() == 'true'
+    app.config['DISPATCH_INTERVAL'] = int(os.environ.get('DISPATCH_INTERVAL', 15))
+    app.config['DISPATCH_MAX_PICKUP_KM'] = float(os.environ.get('DISPATCH_MAX_PICKUP_KM', 10))
+    
+    # Ready orders sharing a restaurant and neighbourhood go out as one trip (see app/route_batching.py)
+    app.config['ROUTE_BATCHING_ENABLED'] = os.environ.get('ROUTE_BATCHING_ENABLED', 'true').lower() == 'true'
+    app.config['ROUTE_BATCH_MAX_ORDERS'] = int(os.environ.get('ROUTE_BATCH_MAX_ORDERS', 3))
+    app.config['ROUTE_BATCH_MAX_DELAY'] = float(os.environ.get('ROUTE_BATCH_MAX_DELAY', 10))
+    
+    # Driver GPS pings are kept in memory and upserted in batches (see app/location_ingest.py)
+    app.config['LOCATION_FLUSH_SECONDS'] = float(os.environ.get('LOCATION_FLUSH_SECONDS', 3))
+    
+    # Driver tracks: simplified, delta-encoded segments in daily partitions (see app/driver_tracks.py)
+    app.config['TRACK_TOLERANCE_M'] = float(os.environ.get('TRACK_TOLERANCE_M', 8))
+    app.config['TRACK_RAW_DAYS'] = int(os.environ.get('TRACK_RAW_DAYS', 7))
+    app.config['TRACK_RETENTION_DAYS'] = int(os.environ.get('TRACK_RETENTION_DAYS', 90))
+    app.config['TRACK_DOWNSAMPLE_SECONDS'] = int(os.environ.get('TRACK_DOWNSAMPLE_SECONDS', 30))
+    
+    # Connection pool settings (per-service defaults in config.py)
+    configure_pool(app, service=os.environ.get('SERVICE_NAME', 'web'))
+    
     # Initialize extensions with app
     db.init_app(app)
+    init_pool(app, db)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     jwt.init_app(app)
     cors.init_app(app)
+    cache.init_app(app)
+    passwords.init_app(app)
+    login_guard.init_app(app)
+    session_registry.init_app(app)
+    replica_router.init_app(app, db)
+    query_tracker.init_app(app, db)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    slow_query_log.init_app(app, db)
+    partition_maintainer.init_app(app, db)
+    order_history.init_app(app, db)
+    dispatcher.init_app(app, db)
+    locations.init_app(app, db)
 
     
     # Configure login manager
@@ -51,9 +158,9 @@ def create_app():
     # User loader - import inside function to avoid circular imports
     @login_manager.user_loader
     def load_user(user_id):
-        # Import here to avoid circular import
-        from .models import User
-        return User.query.get(int(user_id))
+        # Cached snapshot, not an ORM instance (see app/identity.py)
+        from .identity import load_identity
+        return load_identity(user_id)
     
     # JWT error handlers
     @jwt.expired_token_loader
@@ -80,6 +187,18 @@ def create_app():
             "error": "authorization_required"
         }), 401
     
+    @jwt.token_in_blocklist_loader
+    def token_revoked_check(jwt_header, jwt_payload):
+        return session_registry.is_revoked(jwt_payload['jti'])
+    
+    @jwt.revoked_token_loader
+    def revoked_token_callback(jwt_header, jwt_payload):
+        return jsonify({
+            "success": False,
+            "message": "Token has been revoked",
+            "error": "token_revoked"
+        }), 401
+    
     # Context processor for has_endpoint
     @app.context_processor
     def utility_processor():
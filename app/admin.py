@@ -1,15 +1,25 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, abort
 from flask_login import login_required, current_user
 from functools import wraps
-from .models import User, Driver, Restaurant, Customer, Order, db, Address, MenuItem, OrderItem, OrderStatusHistory
+from .models import User, Driver, Restaurant, Customer, Order, db, Address, MenuItem, OrderItem
+from .models import ACTIVE_ORDER_STATUSES
 from .forms import DriverRegistrationForm, DriverEditForm
-from datetime import datetime, timedelta
+from .api import menu_cache, order_cache
+from . import cache, profiler, slow_query_log, partition_maintainer, order_history, dispatcher, locations
+from .database import replica_reads, pool_stats
+from .business_days import business_today, business_day_bounds, within_business_days
+from .archive import all_orders
+from .order_transitions import transition, transition_many, can_transition, BATCH_LIMIT
+from datetime import datetime
 import traceback
 import math
-from sqlalchemy import func, desc, or_
+from sqlalchemy import func, desc, or_, text
 
 admin_bp = Blueprint('admin', __name__)
 
+# Dashboard counters are polled often and tolerate a few seconds of lag
+dashboard_cache = cache.namespace('dashboard', ttl=15, stale_ttl=45)
+
 
 # ============================================
 # HELPER FUNCTIONS
@@ -38,6 +48,7 @@ from .csrf import csrf_protect
 @admin_bp.route('/menu-items')
 @login_required
 @admin_required
+@replica_reads
 def manage_menu_items():
     # Get filter parameters
     page = request.args.get('page', 1, type=int)
@@ -172,6 +183,7 @@ def add_menu_item():
         
         db.session.add(new_item)
         db.session.commit()
+        menu_cache.invalidate(new_item.restaurant_id)
         
         return jsonify({
             'success': True,
@@ -237,6 +249,7 @@ def update_menu_item(item_id):
             })
         
         # Update menu item
+        old_restaurant_id = menu_item.restaurant_id
         menu_item.name = data['name'].strip()
         menu_item.description = data.get('description', '').strip()
         menu_item.price = price
@@ -247,6 +260,8 @@ def update_menu_item(item_id):
         menu_item.updated_at = datetime.utcnow()
         
         db.session.commit()
+        menu_cache.invalidate(old_restaurant_id)
+        menu_cache.invalidate(menu_item.restaurant_id)
         
         return jsonify({
             'success': True,
@@ -280,6 +295,7 @@ def toggle_menu_item_availability(item_id):
         
         menu_item.updated_at = datetime.utcnow()
         db.session.commit()
+        menu_cache.invalidate(menu_item.restaurant_id)
         
         status = "available" if menu_item.is_available else "unavailable"
         
@@ -315,8 +331,10 @@ def delete_menu_item(item_id):
             })
         
         # Delete the menu item
+        restaurant_id = menu_item.restaurant_id
         db.session.delete(menu_item)
         db.session.commit()
+        menu_cache.invalidate(restaurant_id)
         
         return jsonify({
             'success': True,
@@ -371,28 +389,32 @@ def utility_processor():
 @admin_bp.route('/dashboard')
 @login_required
 @admin_required
+@replica_reads
 def dashboard():
+    today = business_today()
+    
     # Get statistics
-    stats = {
-        'total_users': User.query.count(),
-        'active_users': User.query.filter_by(is_active=True).count(),
-        'admins': User.query.filter_by(role='admin').count(),
-        'drivers': User.query.filter_by(role='driver').count(),
-        'managers': User.query.filter_by(role='manager').count(),
-        'employees': User.query.filter_by(role='employee').count(),
-        'customers': User.query.filter_by(role='user').count(),
-        'restaurants_count': Restaurant.query.count(),
-        'active_drivers': Driver.query.filter_by(is_available=True).count(),
-        'on_shift_drivers': Driver.query.filter_by(is_on_shift=True).count(),
-        'total_orders': Order.query.count(),
-        'pending_orders': Order.query.filter_by(order_status='pending').count(),
-        'active_orders': Order.query.filter(
-            Order.order_status.in_(['confirmed', 'preparing', 'ready', 'out_for_delivery'])
-        ).count(),
-        'today_orders': Order.query.filter(
-            db.func.date(Order.created_at) == datetime.today().date()
-        ).count()
-    }
+    def load_stats():
+        return {
+            'total_users': User.query.count(),
+            'active_users': User.query.filter_by(is_active=True).count(),
+            'admins': User.query.filter_by(role='admin').count(),
+            'drivers': User.query.filter_by(role='driver').count(),
+            'managers': User.query.filter_by(role='manager').count(),
+            'employees': User.query.filter_by(role='employee').count(),
+            'customers': User.query.filter_by(role='user').count(),
+            'restaurants_count': Restaurant.query.count(),
+            'active_drivers': Driver.query.filter_by(is_available=True).count(),
+            'on_shift_drivers': Driver.query.filter_by(is_on_shift=True).count(),
+            'total_orders': db.session.query(func.count()).select_from(all_orders()).scalar(),
+            'pending_orders': Order.query.filter(Order.active('pending')).count(),
+            'active_orders': Order.query.filter(
+                Order.active('confirmed', 'preparing', 'ready', 'out_for_delivery')
+            ).count(),
+            'today_orders': Order.query.filter(Order.on_business_days(today)).count()
+        }
+    
+    stats = dashboard_cache.get_or_load(f"stats:{today.isoformat()}", load_stats)
     
     # Get recent orders
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
@@ -417,6 +439,7 @@ def dashboard():
 @admin_bp.route('/drivers')
 @login_required
 @admin_required
+@replica_reads
 def manage_drivers():
     drivers = Driver.query.join(User).all()
     
@@ -581,9 +604,8 @@ def delete_driver(driver_id):
         if not driver:
             return jsonify({'success': False, 'message': 'Driver not found'}), 404
         
-        active_orders = Order.query.filter(
-            Order.driver_id == driver_id,
-            Order.order_status.in_(['confirmed', 'preparing', 'ready', 'out_for_delivery'])
+        active_orders = Order.active_orders(
+            'confirmed', 'preparing', 'ready', 'out_for_delivery', driver_id=driver_id
         ).count()
         
         if active_orders > 0:
@@ -618,6 +640,7 @@ def delete_driver(driver_id):
 @admin_bp.route('/orders')
 @login_required
 @admin_required
+@replica_reads
 def manage_orders():
     status = request.args.get('status', 'all')
     restaurant_id = request.args.get('restaurant_id', 'all')
@@ -628,7 +651,9 @@ def manage_orders():
     
     query = Order.query
     
-    if status != 'all':
+    if status in ACTIVE_ORDER_STATUSES:
+        query = query.filter(Order.active(status))
+    elif status != 'all':
         query = query.filter_by(order_status=status)
     
     if restaurant_id != 'all':
@@ -645,31 +670,41 @@ def manage_orders():
             (Customer.phone_number.ilike(search_term))
         )
     
-    if start_date:
-        query = query.filter(Order.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
-    if end_date:
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-        query = query.filter(Order.created_at < end_date_obj)
+    if start_date or end_date:
+        first = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        last = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        if first and last:
+            query = query.filter(Order.on_business_days(first, last))
+        elif first:
+            query = query.filter(Order.business_date >= first, Order.created_at >= business_day_bounds(first)[0])
+        else:
+            query = query.filter(Order.business_date <= last, Order.created_at < business_day_bounds(last)[1])
     
     orders = query.order_by(Order.created_at.desc()).all()
     
     restaurants = Restaurant.query.all()
     
-    today = datetime.now().date()
+    today = business_today()
+    # Totals cover the archive as well; open and today's orders are always live
+    every_order = all_orders()
+    totals = db.session.query(
+        func.count(),
+        func.count().filter(every_order.c.order_status == 'delivered'),
+        func.count().filter(every_order.c.order_status == 'cancelled'),
+        func.sum(every_order.c.total_amount)
+    ).select_from(every_order).one()
     stats = {
-        'total_orders': Order.query.count(),
-        'pending_orders': Order.query.filter_by(order_status='pending').count(),
+        'total_orders': totals[0],
+        'pending_orders': Order.query.filter(Order.active('pending')).count(),
         'active_orders': Order.query.filter(
-            Order.order_status.in_(['confirmed', 'preparing', 'ready', 'out_for_delivery'])
-        ).count(),
-        'delivered_orders': Order.query.filter_by(order_status='delivered').count(),
-        'cancelled_orders': Order.query.filter_by(order_status='cancelled').count(),
-        'total_revenue': db.session.query(func.sum(Order.total_amount)).scalar() or 0,
-        'today_orders': Order.query.filter(
-            db.func.date(Order.created_at) == today
+            Order.active('confirmed', 'preparing', 'ready', 'out_for_delivery')
         ).count(),
+        'delivered_orders': totals[1],
+        'cancelled_orders': totals[2],
+        'total_revenue': totals[3] or 0,
+        'today_orders': Order.query.filter(Order.on_business_days(today)).count(),
         'delivered_today': Order.query.filter(
-            db.func.date(Order.delivered_at) == today,
+            within_business_days(Order.delivered_at, today),
             Order.order_status == 'delivered'
         ).count()
     }
@@ -694,7 +729,9 @@ def manage_orders():
 @admin_required
 @csrf_protect()
 def update_order_status(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = Order.by_id(order_id)
+    if order is None:
+        abort(404)
     data = request.get_json()
     
     try:
@@ -705,33 +742,21 @@ def update_order_status(order_id):
         
         if not new_status:
             return jsonify({'success': False, 'message': 'No status provided'})
+        if not can_transition(order, new_status):
+            return jsonify({'success': False, 'message': f'Cannot transition from {old_status} to {new_status}'})
         
-        order.order_status = new_status
-        
+        driver = None
         if driver_id and new_status == 'out_for_delivery':
             driver = Driver.query.get(driver_id)
             if driver:
-                order.driver_id = driver.driver_id
                 driver.is_available = False
                 driver.total_deliveries = (driver.total_deliveries or 0) + 1
         
-        if new_status == 'delivered':
-            order.delivered_at = datetime.utcnow()
-        elif new_status == 'out_for_delivery':
-            order.estimated_delivery = datetime.utcnow() + timedelta(minutes=30)
-        
-        history = OrderStatusHistory(
-            order_id=order.order_id,
-            old_status=old_status,
-            new_status=new_status,
-            changed_by=current_user.user_id,
-            public_notes=notes,
-            actor_type='admin',
-            source='admin_panel'
-        )
-        db.session.add(history)
+        transition(order, new_status, actor_type='admin', changed_by=current_user.user_id,
+                   driver_id=driver.driver_id if driver else None, source='admin_panel', public_notes=notes)
         
         db.session.commit()
+        order_cache.invalidate(order.order_id)
         
         return jsonify({'success': True, 'message': 'Status updated successfully'})
         
@@ -740,12 +765,54 @@ def update_order_status(order_id):
         return jsonify({'success': False, 'message': str(e)})
 
 
+@admin_bp.route('/orders/update-status', methods=['POST'])
+@login_required
+@admin_required
+@csrf_protect()
+def bulk_update_order_status():
+    """Move many orders to one status in one transaction (kitchen and dispatch consoles)"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Request body must be a JSON object'}), 400
+    order_ids = data.get('order_ids') or []
+    new_status = data.get('new_status')
+    
+    if not new_status or not order_ids:
+        return jsonify({'success': False, 'message': 'Orders and a status are required'})
+    if (not isinstance(new_status, str) or not isinstance(order_ids, list)
+            or not all(order_id and isinstance(order_id, str) for order_id in order_ids)):
+        return jsonify({'success': False, 'message': 'order_ids must be a list of strings and new_status a string'}), 400
+    if len(order_ids) > BATCH_LIMIT:
+        return jsonify({'success': False, 'message': f'At most {BATCH_LIMIT} orders at once'})
+    
+    try:
+        results = transition_many(
+            [{'order_id': order_id, 'status': new_status, 'public_notes': data.get('notes')} for order_id in order_ids],
+            actor_type='admin', changed_by=current_user.user_id, source='admin_panel'
+        )
+        db.session.commit()
+        
+        updated = [result['order_id'] for result in results if result['success']]
+        order_cache.invalidate_many(updated)
+        
+        return jsonify({
+            'success': bool(updated),
+            'message': f'{len(updated)} of {len(results)} orders updated',
+            'results': results
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+
 # ============================================
 # OTHER MANAGEMENT ROUTES (Keep existing)
 # ============================================
 @admin_bp.route('/categories')
 @login_required
 @admin_required
+@replica_reads
 def manage_categories():
     categories = db.session.query(
         MenuItem.category,
@@ -770,6 +837,7 @@ def manage_categories():
 @admin_bp.route('/customers')
 @login_required
 @admin_required
+@replica_reads
 def manage_customers():
     search = request.args.get('search', '')
     
@@ -787,7 +855,8 @@ def manage_customers():
     customers = query.order_by(Customer.created_at.desc()).all()
     
     total_customers = Customer.query.count()
-    customers_with_orders = db.session.query(func.count(func.distinct(Order.customer_id))).scalar()
+    every_order = all_orders()
+    customers_with_orders = db.session.query(func.count(func.distinct(every_order.c.customer_id))).scalar()
     recent_customers = Customer.query.order_by(Customer.created_at.desc()).limit(5).all()
     
     return render_template('admin/manage_customers.html',
@@ -801,20 +870,27 @@ def manage_customers():
 @admin_bp.route('/restaurants')
 @login_required
 @admin_required
+@replica_reads
 def manage_restaurants():
     restaurants = Restaurant.query.all()
     
+    # One grouped pass over live and archived orders
+    every_order = all_orders()
+    totals = {
+        row[0]: (row[1], row[2])
+        for row in db.session.query(
+            every_order.c.restaurant_id, func.count(), func.sum(every_order.c.total_amount)
+        ).group_by(every_order.c.restaurant_id)
+    }
+    
     restaurants_with_stats = []
     for restaurant in restaurants:
-        orders_count = Order.query.filter_by(restaurant_id=restaurant.restaurant_id).count()
-        total_revenue = db.session.query(func.sum(Order.total_amount))\
-            .filter(Order.restaurant_id == restaurant.restaurant_id)\
-            .scalar() or 0
+        orders_count, total_revenue = totals.get(restaurant.restaurant_id, (0, None))
         
         restaurants_with_stats.append({
             'restaurant': restaurant,
             'orders_count': orders_count,
-            'total_revenue': total_revenue,
+            'total_revenue': total_revenue or 0,
             'is_active': restaurant.is_active,
             'is_open': restaurant.is_open
         })
@@ -949,10 +1025,9 @@ def view_user(*args, **kwargs):
     flash('View User is coming soon!', 'info')
     return redirect(url_for('admin.dashboard'))
 
-@admin_bp.route('/system/health')
+@admin_bp.route('/analytics')
 @login_required
 @admin_required
-
 def analytics(*args, **kwargs):
     """Analytics - placeholder"""
     flash('Analytics dashboard is coming soon!', 'info')
@@ -960,10 +1035,13 @@ def analytics(*args, **kwargs):
 @admin_bp.route('/system/health')
 @login_required
 @admin_required
-
 def system_health():
+    # Flamegraph input from this worker's stack sampler
+    if request.args.get('stacks') == 'collapsed':
+        return Response(profiler.collapsed(request.args.get('route')), mimetype='text/plain')
+    
     try:
-        db.session.execute('SELECT 1')
+        db.session.execute(text('SELECT 1'))
         db_status = 'Healthy'
         db_message = 'Database connection successful'
     except Exception as e:
@@ -983,9 +1061,19 @@ def system_health():
             'start_time': current_app.config.get('START_TIME', 'Unknown'),
             'debug_mode': current_app.debug,
             'environment': current_app.config.get('ENV', 'production')
-        }
+        },
+        'pool': pool_stats(),
+        'profiler': profiler.summary(),
+        'slow_queries': {**slow_query_log.stats(), 'top': slow_query_log.top(10)},
+        'partitions': partition_maintainer.stats(),
+        'order_history': order_history.stats(),
+        'dispatch': dispatcher.stats(),
+        'locations': locations.stats()
     }
     
+    if request.args.get('format') == 'json':
+        return jsonify(stats)
+    
     return render_template('admin/system_health.html', stats=stats)
 
 
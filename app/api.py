@@ -7,15 +7,26 @@ from flask import Blueprint, request, jsonify, current_app, g
 from flask_jwt_extended import (
     JWTManager, jwt_required, create_access_token, 
     create_refresh_token, get_jwt_identity, get_jwt,
-    verify_jwt_in_request, get_jwt_header
+    verify_jwt_in_request, get_jwt_header, decode_token
 )
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
 from functools import wraps
 import logging
 from datetime import datetime, timedelta
-from app import db, bcrypt
+from app import db, cache, passwords, login_guard, session_registry, replica_router, query_tracker, metrics, locations
+from app.password_pool import VerifierSaturated
 from app.models import User, Customer, Restaurant, MenuItem, Order, Driver, OrderItem, Address
+from app.restaurant_directory import restaurant_directory
+from app.authz import resolve_principal
+from app.database import pool_stats, replica_reads, read_engine
+from app.business_days import business_days_back, business_day_bounds
+from app.archive import find_order, order_models, all_orders
+from app.order_transitions import transition, transition_many, TransitionError, BATCH_LIMIT
+from app.location_ingest import parse_ping, location_text, PING_BATCH_LIMIT
+from app.driver_tracks import driver_track, order_window
 import json
-from sqlalchemy import text
+from sqlalchemy import text, select, func, case, and_
 from decimal import Decimal
 import uuid
 
@@ -26,23 +37,27 @@ api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Read-through caches for the hot read paths (see app/caching.py)
+menu_cache = cache.namespace('menu', ttl=300, stale_ttl=300, negative_ttl=30)
+order_cache = cache.namespace('order_detail', ttl=10, negative_ttl=5)
+driver_owner_cache = cache.namespace('driver_owner', ttl=3600, negative_ttl=60)
+
 # ============================================
 # HELPER FUNCTIONS & DECORATORS
 # ============================================
 
 def role_required(roles):
-    """Decorator to require specific user roles"""
+    """Decorator to require specific user roles (decided from token claims, principal on g)"""
     def wrapper(fn):
         @wraps(fn)
         @jwt_required()
         def decorator(*args, **kwargs):
-            current_user_id = get_jwt_identity()
-            current_user = User.query.get(current_user_id)
+            principal = resolve_principal()
             
-            if not current_user:
-                return jsonify({"error": "User not found"}), 404
+            if not principal:
+                return jsonify({"error": "User not found or disabled"}), 403
             
-            if current_user.role not in roles:
+            if principal.role not in roles:
                 return jsonify({"error": "Insufficient permissions"}), 403
             
             return fn(*args, **kwargs)
@@ -81,6 +96,19 @@ def json_response(data=None, message="", status=200):
     }
     return jsonify(response), status
 
+def cache_until(response, valid_until):
+    """Let clients and proxies cache a response until ``valid_until``"""
+    max_age = max(int((valid_until - datetime.now(valid_until.tzinfo)).total_seconds()), 0)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.expires = valid_until
+    return response
+
+def register_tokens(*encoded_tokens):
+    """Record freshly issued tokens in the session registry"""
+    for encoded in encoded_tokens:
+        session_registry.record(encoded, decode_token(encoded), request.remote_addr,
+                                request.headers.get('User-Agent'))
+
 def log_api_call():
     """Log API calls for monitoring"""
     if hasattr(g, 'user_id'):
@@ -99,15 +127,25 @@ def login():
         if not data or 'username' not in data or 'password' not in data:
             return json_response(message="Username and password required", status=400)
         
+        # Throttle before spending any bcrypt time on the attempt
+        retry_after = login_guard.check(data['username'], request.remote_addr)
+        if retry_after:
+            response, status = json_response(message="Too many failed login attempts, retry later", status=429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response, status
+        
         user = User.query.filter_by(username=data['username']).first()
+        verified = bool(user) and passwords.verify_user(user, data['password'])
+        login_guard.record(data['username'], request.remote_addr, verified,
+                           user=user, user_agent=request.headers.get('User-Agent'))
         
-        if not user or not bcrypt.check_password_hash(user.password_hash, data['password']):
+        if not verified:
             return json_response(message="Invalid credentials", status=401)
         
         if not user.is_active:
             return json_response(message="Account is disabled", status=403)
         
-        # Update last login
+        # Update last login (also saves a rehashed password)
         user.last_login = datetime.now()
         db.session.commit()
         
@@ -123,6 +161,7 @@ def login():
         )
         
         refresh_token = create_refresh_token(identity=str(user.user_id))
+        register_tokens(access_token, refresh_token)
         
         return json_response({
             "access_token": access_token,
@@ -136,6 +175,13 @@ def login():
             }
         }, "Login successful")
         
+    except VerifierSaturated as e:
+        db.session.rollback()
+        logger.warning("Login rejected: password verification pool saturated")
+        response, status = json_response(message="Too many logins in progress, retry shortly", status=429)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, status
+        
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         return json_response(message="Internal server error", status=500)
@@ -151,6 +197,9 @@ def refresh():
         if not user:
             return json_response(message="User not found", status=404)
         
+        if not user.is_active:
+            return json_response(message="Account is disabled", status=403)
+        
         new_access_token = create_access_token(
             identity=str(user.user_id),
             additional_claims={
@@ -160,6 +209,7 @@ def refresh():
             },
             expires_delta=timedelta(hours=24)
         )
+        register_tokens(new_access_token)
         
         return json_response({
             "access_token": new_access_token
@@ -172,8 +222,26 @@ def refresh():
 @api_bp.route('/auth/logout', methods=['POST'])
 @jwt_required()
 def logout():
-    """User logout (client should discard tokens)"""
-    return json_response(message="Logout successful")
+    """User logout: revokes the access token, and the refresh token if sent"""
+    try:
+        claims = get_jwt()
+        session_registry.revoke(claims)
+        
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            try:
+                refresh_claims = decode_token(data['refresh_token'])
+            except (PyJWTError, JWTExtendedException, TypeError):
+                return json_response(message="Invalid refresh token", status=400)
+            if refresh_claims.get('sub') == claims.get('sub'):
+                session_registry.revoke(refresh_claims)
+        
+        return json_response(message="Logout successful")
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Logout error: {str(e)}")
+        return json_response(message="Internal server error", status=500)
 
 # ============================================
 # CUSTOMER ENDPOINTS
@@ -233,6 +301,7 @@ def create_customer():
 
 @api_bp.route('/customers/<customer_id>', methods=['GET'])
 @jwt_required()
+@replica_reads
 def get_customer(customer_id):
     """Get customer details"""
     try:
@@ -277,106 +346,64 @@ def get_customer(customer_id):
 # ============================================
 
 @api_bp.route('/restaurants', methods=['GET'])
+@replica_reads
 def get_restaurants():
-    """Get list of restaurants"""
+    """Get list of restaurants (is_open filters on the current schedule state)"""
     try:
         # Get query parameters
         is_open = request.args.get('is_open', type=lambda v: v.lower() == 'true')
         is_active = request.args.get('is_active', True, type=lambda v: v.lower() == 'true')
         
-        # Build query
-        query = Restaurant.query
+        if not is_active:
+            restaurants = restaurant_directory.inactive()
+            return json_response({
+                "restaurants": restaurants,
+                "count": len(restaurants)
+            })
         
+        restaurants, valid_until = restaurant_directory.listing()
         if is_open is not None:
-            query = query.filter_by(is_open=is_open)
+            restaurants = [r for r in restaurants if r['is_open_now'] == is_open]
         
-        if is_active is not None:
-            query = query.filter_by(is_active=is_active)
-        
-        # Execute query
-        restaurants = query.order_by(Restaurant.name).all()
-        
-        return json_response({
-            "restaurants": [
-                {
-                    "restaurant_id": r.restaurant_id,
-                    "name": r.name,
-                    "description": r.description,
-                    "address": r.address,
-                    "phone": r.phone,
-                    "email": r.email,
-                    "latitude": float(r.latitude) if r.latitude else None,
-                    "longitude": float(r.longitude) if r.longitude else None,
-                    "delivery_radius": r.delivery_radius,
-                    "is_active": r.is_active,
-                    "is_open": r.is_open,
-                    "opening_time": str(r.opening_time) if r.opening_time else None,
-                    "closing_time": str(r.closing_time) if r.closing_time else None,
-                    "min_order_amount": float(r.min_order_amount) if r.min_order_amount else 0,
-                    "delivery_fee": float(r.delivery_fee) if r.delivery_fee else 0,
-                    "estimated_prep_time": r.estimated_prep_time,
-                    "rating": float(r.rating) if r.rating else 0,
-                    "total_reviews": r.total_reviews,
-                    "logo_url": r.logo_url,
-                    "banner_url": r.banner_url
-                }
-                for r in restaurants
-            ],
-            "count": len(restaurants)
+        response, status = json_response({
+            "restaurants": restaurants,
+            "count": len(restaurants),
+            "valid_until": valid_until.isoformat()
         })
+        return cache_until(response, valid_until), status
         
     except Exception as e:
         logger.error(f"Get restaurants error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
 @api_bp.route('/restaurants/<restaurant_id>/menu', methods=['GET'])
+@replica_reads
 def get_restaurant_menu(restaurant_id):
     """Get restaurant menu items"""
     try:
-        restaurant = Restaurant.query.filter_by(restaurant_id=restaurant_id).first()
+        # The whole menu is cached per restaurant, filters are applied in memory
+        menu = menu_cache.get_or_load(restaurant_id, lambda: load_restaurant_menu(restaurant_id))
         
-        if not restaurant:
+        if not menu:
             return json_response(message="Restaurant not found", status=404)
         
         # Get query parameters
         category = request.args.get('category')
         is_available = request.args.get('is_available', True, type=lambda v: v.lower() == 'true')
         
-        # Build query
-        query = MenuItem.query.filter_by(restaurant_id=restaurant_id)
-        
-        if category:
-            query = query.filter_by(category=category)
-        
-        if is_available is not None:
-            query = query.filter_by(is_available=is_available)
-        
-        # Execute query
-        menu_items = query.order_by(MenuItem.category, MenuItem.name).all()
-        
         # Group by category
         menu_by_category = {}
-        for item in menu_items:
-            category = item.category or "Other"
-            if category not in menu_by_category:
-                menu_by_category[category] = []
+        for item in menu['items']:
+            if category and item['category'] != category:
+                continue
             
-            menu_by_category[category].append({
-                "item_id": item.item_id,
-                "name": item.name,
-                "description": item.description,
-                "price": float(item.price) if item.price else 0,
-                "category": item.category,
-                "is_available": item.is_available,
-                "image_url": item.image_url,
-                "created_at": item.created_at.isoformat() if item.created_at else None
-            })
+            if is_available is not None and item['is_available'] != is_available:
+                continue
+            
+            menu_by_category.setdefault(item['category'] or "Other", []).append(item)
         
         return json_response({
-            "restaurant": {
-                "restaurant_id": restaurant.restaurant_id,
-                "name": restaurant.name
-            },
+            "restaurant": menu['restaurant'],
             "menu_by_category": menu_by_category,
             "categories": list(menu_by_category.keys())
         })
@@ -385,6 +412,36 @@ def get_restaurant_menu(restaurant_id):
         logger.error(f"Get restaurant menu error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
+def load_restaurant_menu(restaurant_id):
+    """Load a restaurant's full menu for the menu cache (None if the restaurant is unknown)"""
+    restaurant = Restaurant.query.filter_by(restaurant_id=restaurant_id).first()
+    
+    if not restaurant:
+        return None
+    
+    menu_items = MenuItem.query.filter_by(restaurant_id=restaurant_id)\
+        .order_by(MenuItem.category, MenuItem.name).all()
+    
+    return {
+        "restaurant": {
+            "restaurant_id": restaurant.restaurant_id,
+            "name": restaurant.name
+        },
+        "items": [
+            {
+                "item_id": item.item_id,
+                "name": item.name,
+                "description": item.description,
+                "price": float(item.price) if item.price else 0,
+                "category": item.category,
+                "is_available": item.is_available,
+                "image_url": item.image_url,
+                "created_at": item.created_at.isoformat() if item.created_at else None
+            }
+            for item in menu_items
+        ]
+    }
+
 # ============================================
 # ORDER ENDPOINTS
 # ============================================
@@ -514,6 +571,7 @@ def create_order(data):
         for item_data in order_items_data:
             order_item = OrderItem(
                 order_id=order.order_id,
+                order_created_at=order.created_at,
                 item_id=item_data['menu_item'].item_id,
                 quantity=item_data['quantity'],
                 unit_price=item_data['unit_price'],
@@ -525,6 +583,7 @@ def create_order(data):
         from app.models import OrderStatusHistory
         status_history = OrderStatusHistory(
             order_id=order.order_id,
+            order_created_at=order.created_at,
             old_status=None,
             new_status='pending',
             actor_type='customer',
@@ -533,6 +592,8 @@ def create_order(data):
         db.session.add(status_history)
         
         db.session.commit()
+        order_cache.invalidate(order.order_id)
+        metrics.order_created('api')
         
         # Prepare response
         order_data = {
@@ -571,110 +632,121 @@ def create_order(data):
         logger.error(f"Create order error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
+def load_order_detail(order_id):
+    """Build the order detail payload for the order cache (None if the order is unknown)"""
+    # Closed orders past the retention window are only in the archive
+    order = find_order(order_id)
+    
+    if not order:
+        return None
+    
+    item_model, history_model = order_models(order)
+    
+    # Get order items
+    order_items = item_model.for_order(order).all()
+    
+    # Get status history
+    status_history = history_model.for_order(order)\
+        .order_by(history_model.changed_at.desc()).all()
+    
+    # Get restaurant info
+    restaurant = Restaurant.query.filter_by(restaurant_id=order.restaurant_id).first()
+    
+    # Get customer info
+    customer = Customer.query.filter_by(customer_id=order.customer_id).first()
+    
+    # Get driver info if assigned
+    driver_info = None
+    if order.driver_id:
+        driver = Driver.query.get(order.driver_id)
+        if driver:
+            user = User.query.get(driver.user_id)
+            driver_info = {
+                "driver_id": driver.driver_id,
+                "name": user.username if user else "Unknown",
+                "vehicle_type": driver.vehicle_type,
+                "phone_number": user.phone_number if user else None,
+                "rating": float(driver.rating) if driver.rating else 0
+            }
+    
+    # Get address info if delivery
+    address_info = None
+    if order.address_id:
+        address = Address.query.get(order.address_id)
+        if address:
+            address_info = {
+                "street": address.street,
+                "city": address.city,
+                "state": address.state,
+                "postal_code": address.postal_code,
+                "country": address.country
+            }
+    
+    return {
+        "order_id": order.order_id,
+        "order_status": order.order_status,
+        "delivery_type": order.delivery_type,
+        "special_instructions": order.special_instructions,
+        "subtotal": float(order.subtotal),
+        "tax": float(order.tax),
+        "delivery_fee": float(order.delivery_fee),
+        "discount": float(order.discount),
+        "total_amount": float(order.total_amount),
+        "payment_method": order.payment_method,
+        "payment_status": order.payment_status,
+        "transaction_id": order.transaction_id,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "estimated_delivery": order.estimated_delivery.isoformat() if order.estimated_delivery else None,
+        "delivered_at": order.delivered_at.isoformat() if order.delivered_at else None,
+        "archived": order.archived,
+        "customer": {
+            "customer_id": customer.customer_id if customer else None,
+            "name": customer.name if customer else None,
+            "phone_number": customer.phone_number if customer else None
+        },
+        "restaurant": {
+            "restaurant_id": restaurant.restaurant_id if restaurant else None,
+            "name": restaurant.name if restaurant else None,
+            "address": restaurant.address if restaurant else None,
+            "phone": restaurant.phone if restaurant else None
+        },
+        "driver": driver_info,
+        "address": address_info,
+        "items": [
+            {
+                "item_id": item.item_id,
+                "name": MenuItem.query.filter_by(item_id=item.item_id).first().name if MenuItem.query.filter_by(item_id=item.item_id).first() else "Unknown",
+                "quantity": item.quantity,
+                "unit_price": float(item.unit_price),
+                "total": float(item.unit_price * item.quantity),
+                "customizations": json.loads(item.customizations) if item.customizations else None
+            }
+            for item in order_items
+        ],
+        "status_history": [
+            {
+                "old_status": history.old_status,
+                "new_status": history.new_status,
+                "changed_at": history.changed_at.isoformat() if history.changed_at else None,
+                "actor_type": history.actor_type,
+                "public_notes": history.public_notes
+            }
+            for history in status_history
+        ]
+    }
+
 @api_bp.route('/orders/<order_id>', methods=['GET'])
 @jwt_required()
+@replica_reads
 def get_order(order_id):
     """Get order details"""
     try:
-        order = Order.query.filter_by(order_id=order_id).first()
+        order = order_cache.get_or_load(order_id, lambda: load_order_detail(order_id))
         
         if not order:
             return json_response(message="Order not found", status=404)
         
-        # Get order items
-        order_items = OrderItem.query.filter_by(order_id=order_id).all()
-        
-        # Get status history
-        from app.models import OrderStatusHistory
-        status_history = OrderStatusHistory.query.filter_by(order_id=order_id)\
-            .order_by(OrderStatusHistory.changed_at.desc()).all()
-        
-        # Get restaurant info
-        restaurant = Restaurant.query.filter_by(restaurant_id=order.restaurant_id).first()
-        
-        # Get customer info
-        customer = Customer.query.filter_by(customer_id=order.customer_id).first()
-        
-        # Get driver info if assigned
-        driver_info = None
-        if order.driver_id:
-            driver = Driver.query.get(order.driver_id)
-            if driver:
-                user = User.query.get(driver.user_id)
-                driver_info = {
-                    "driver_id": driver.driver_id,
-                    "name": user.username if user else "Unknown",
-                    "vehicle_type": driver.vehicle_type,
-                    "phone_number": user.phone_number if user else None,
-                    "rating": float(driver.rating) if driver.rating else 0
-                }
-        
-        # Get address info if delivery
-        address_info = None
-        if order.address_id:
-            address = Address.query.get(order.address_id)
-            if address:
-                address_info = {
-                    "street": address.street,
-                    "city": address.city,
-                    "state": address.state,
-                    "postal_code": address.postal_code,
-                    "country": address.country
-                }
-        
-        return json_response({
-            "order": {
-                "order_id": order.order_id,
-                "order_status": order.order_status,
-                "delivery_type": order.delivery_type,
-                "special_instructions": order.special_instructions,
-                "subtotal": float(order.subtotal),
-                "tax": float(order.tax),
-                "delivery_fee": float(order.delivery_fee),
-                "discount": float(order.discount),
-                "total_amount": float(order.total_amount),
-                "payment_method": order.payment_method,
-                "payment_status": order.payment_status,
-                "transaction_id": order.transaction_id,
-                "created_at": order.created_at.isoformat() if order.created_at else None,
-                "estimated_delivery": order.estimated_delivery.isoformat() if order.estimated_delivery else None,
-                "delivered_at": order.delivered_at.isoformat() if order.delivered_at else None,
-                "customer": {
-                    "customer_id": customer.customer_id if customer else None,
-                    "name": customer.name if customer else None,
-                    "phone_number": customer.phone_number if customer else None
-                },
-                "restaurant": {
-                    "restaurant_id": restaurant.restaurant_id if restaurant else None,
-                    "name": restaurant.name if restaurant else None,
-                    "address": restaurant.address if restaurant else None,
-                    "phone": restaurant.phone if restaurant else None
-                },
-                "driver": driver_info,
-                "address": address_info,
-                "items": [
-                    {
-                        "item_id": item.item_id,
-                        "name": MenuItem.query.filter_by(item_id=item.item_id).first().name if MenuItem.query.filter_by(item_id=item.item_id).first() else "Unknown",
-                        "quantity": item.quantity,
-                        "unit_price": float(item.unit_price),
-                        "total": float(item.unit_price * item.quantity),
-                        "customizations": json.loads(item.customizations) if item.customizations else None
-                    }
-                    for item in order_items
-                ],
-                "status_history": [
-                    {
-                        "old_status": history.old_status,
-                        "new_status": history.new_status,
-                        "changed_at": history.changed_at.isoformat() if history.changed_at else None,
-                        "actor_type": history.actor_type,
-                        "public_notes": history.public_notes
-                    }
-                    for history in status_history
-                ]
-            }
-        })
+        return json_response({"order": order})
         
     except Exception as e:
         logger.error(f"Get order error: {str(e)}")
@@ -697,62 +769,32 @@ def update_order_status(order_id):
         if new_status not in valid_statuses:
             return json_response(message=f"Invalid status. Must be one of: {', '.join(valid_statuses)}", status=400)
         
-        order = Order.query.filter_by(order_id=order_id).first()
+        order = Order.by_id(order_id)
         
         if not order:
             return json_response(message="Order not found", status=404)
         
         old_status = order.order_status
-        
-        # Validate status transition
-        status_transitions = {
-            'pending': ['confirmed', 'cancelled'],
-            'confirmed': ['preparing', 'cancelled'],
-            'preparing': ['ready', 'cancelled'],
-            'ready': ['out_for_delivery', 'cancelled'],
-            'out_for_delivery': ['delivered'],
-            'delivered': [],
-            'cancelled': []
-        }
-        
-        if new_status not in status_transitions.get(old_status, []):
-            return json_response(
-                message=f"Cannot transition from {old_status} to {new_status}",
-                status=400
+        principal = g.principal
+        
+        # Validated against the transition table; the history row is flushed with the order
+        try:
+            transition(
+                order, new_status,
+                actor_type=principal.role,
+                changed_by=principal.user_id,
+                source='api',
+                public_notes=data.get('public_notes'),
+                internal_notes=data.get('internal_notes'),
+                reason_code=data.get('reason_code')
             )
-        
-        # Get current user
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Update order status
-        order.order_status = new_status
-        order.updated_at = datetime.now()
-        
-        # Handle special cases
-        if new_status == 'out_for_delivery':
-            order.estimated_delivery = datetime.now() + timedelta(minutes=30)  # Estimate 30 minutes
-        
-        if new_status == 'delivered':
-            order.delivered_at = datetime.now()
-        
-        # Add to status history
-        from app.models import OrderStatusHistory
-        status_history = OrderStatusHistory(
-            order_id=order_id,
-            old_status=old_status,
-            new_status=new_status,
-            changed_by=current_user_id,
-            actor_type=current_user.role if current_user else 'system',
-            public_notes=data.get('public_notes'),
-            internal_notes=data.get('internal_notes'),
-            reason_code=data.get('reason_code')
-        )
-        db.session.add(status_history)
+        except TransitionError as e:
+            return json_response(message=str(e), status=400)
         
         db.session.commit()
+        order_cache.invalidate(order_id)
         
-        logger.info(f"Order {order_id} status updated from {old_status} to {new_status} by user {current_user_id}")
+        logger.info(f"Order {order_id} status updated from {old_status} to {new_status} by user {principal.user_id}")
         
         return json_response({
             "order_id": order_id,
@@ -766,22 +808,74 @@ def update_order_status(order_id):
         logger.error(f"Update order status error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
+@api_bp.route('/orders/status:batch', methods=['POST'])
+@jwt_required()
+@role_required(['admin', 'manager', 'driver', 'restaurant'])
+def batch_update_order_status():
+    """Update the status of many orders in one transaction.
+
+    Body: ``{"status": ..., "order_ids": [...]}`` for one target status, or
+    ``{"transitions": [{"order_id": ..., "status": ..., "public_notes": ...}]}``.
+    Each order gets its own result; refused ones do not stop the others.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return json_response(message="Request body must be a JSON object", status=400)
+        
+        if 'transitions' in data:
+            changes = data['transitions']
+        else:
+            order_ids = data.get('order_ids') or []
+            changes = [{'order_id': order_id, 'status': data.get('status'),
+                        'public_notes': data.get('public_notes'), 'reason_code': data.get('reason_code')}
+                       for order_id in order_ids] if isinstance(order_ids, list) else None
+        
+        if not isinstance(changes, list) or not changes:
+            return json_response(message="order_ids with a status, or transitions, are required", status=400)
+        if len(changes) > BATCH_LIMIT:
+            return json_response(message=f"At most {BATCH_LIMIT} orders per batch", status=400)
+        if not all(isinstance(change, dict) and change.get('order_id') and isinstance(change['order_id'], str)
+                   and change.get('status') and isinstance(change['status'], str) for change in changes):
+            return json_response(message="Every transition needs an order_id and a status (strings)", status=400)
+        
+        principal = g.principal
+        results = transition_many(changes, actor_type=principal.role, changed_by=principal.user_id, source='api')
+        db.session.commit()
+        
+        # One invalidation message for the whole batch
+        updated = [result['order_id'] for result in results if result['success']]
+        order_cache.invalidate_many(updated)
+        
+        return json_response({
+            "results": results,
+            "updated": len(updated),
+            "failed": len(results) - len(updated)
+        }, f"{len(updated)} of {len(results)} orders updated")
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Batch order status error: {str(e)}")
+        return json_response(message="Internal server error", status=500)
+
 # ============================================
 # LIVE TRACKING ENDPOINTS
 # ============================================
 
 @api_bp.route('/orders/<order_id>/track', methods=['GET'])
 @jwt_required()
+@replica_reads
 def track_order(order_id):
     """Get real-time order tracking information"""
     try:
-        order = Order.query.filter_by(order_id=order_id).first()
+        order = find_order(order_id)
         
         if not order:
             return json_response(message="Order not found", status=404)
         
         # Get driver location if assigned
         driver_location = None
+        driver_position = None
         driver_info = None
         
         if order.driver_id:
@@ -796,20 +890,29 @@ def track_order(order_id):
                     "rating": float(driver.rating) if driver.rating else 0
                 }
                 
-                # Simulate driver location (in production, this would come from GPS)
-                if driver.current_location:
+                # Latest GPS fix, flushed or still pending in this worker
+                driver_position = locations.position(driver.driver_id)
+                if driver_position:
+                    driver_location = f"{driver_position['latitude']},{driver_position['longitude']}"
+                    driver_position = {
+                        "latitude": float(driver_position['latitude']),
+                        "longitude": float(driver_position['longitude']),
+                        "heading": driver_position['heading'],
+                        "recorded_at": driver_position['recorded_at'].isoformat()
+                    }
+                elif driver.current_location:
                     driver_location = driver.current_location
         
         # Calculate ETA
         eta_minutes = None
         if order.estimated_delivery:
-            time_diff = order.estimated_delivery - datetime.now()
+            time_diff = order.estimated_delivery - datetime.utcnow()
             eta_minutes = max(0, int(time_diff.total_seconds() / 60))
         
         # Get status history for timeline
-        from app.models import OrderStatusHistory
-        status_timeline = OrderStatusHistory.query.filter_by(order_id=order_id)\
-            .order_by(OrderStatusHistory.changed_at.asc()).all()
+        history_model = order_models(order)[1]
+        status_timeline = history_model.for_order(order)\
+            .order_by(history_model.changed_at.asc()).all()
         
         # Get restaurant location
         restaurant = Restaurant.query.filter_by(restaurant_id=order.restaurant_id).first()
@@ -842,6 +945,7 @@ def track_order(order_id):
             "delivered_at": order.delivered_at.isoformat() if order.delivered_at else None,
             "driver": driver_info,
             "driver_location": driver_location,
+            "driver_position": driver_position,
             "restaurant_location": restaurant_location,
             "delivery_address": delivery_address,
             "eta_minutes": eta_minutes,
@@ -859,58 +963,172 @@ def track_order(order_id):
         logger.error(f"Track order error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
+@api_bp.route('/orders/<order_id>/driver-track', methods=['GET'])
+@jwt_required()
+@role_required(['admin', 'manager'])
+@replica_reads
+def order_driver_track(order_id):
+    """GPS track of the order's driver from pickup to delivery, for disputes and ETA analysis.
+
+    The window runs from the order going out for delivery to its delivery
+    (or now). Fixes come from the compressed ``driver_locations`` segments
+    (see app/driver_tracks.py); the last ``TRACK_SEGMENT_SECONDS`` may not
+    be written yet.
+    """
+    try:
+        order = find_order(order_id)
+        
+        if not order:
+            return json_response(message="Order not found", status=404)
+        
+        if not order.driver_id:
+            return json_response(message="Order has no driver", status=404)
+        
+        history_model = order_models(order)[1]
+        window = order_window(order, history_model.for_order(order).all())
+        if window is None:
+            return json_response(message="Order has not gone out for delivery", status=404)
+        start, end = window
+        
+        segments, fixes = driver_track(db.session, order.driver_id, start, end)
+        
+        return json_response({
+            "order_id": order_id,
+            "driver_id": order.driver_id,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "segments": segments,
+            "points": [
+                {
+                    "recorded_at": fix['recorded_at'].isoformat(),
+                    "latitude": fix['latitude'],
+                    "longitude": fix['longitude']
+                }
+                for fix in fixes
+            ]
+        })
+        
+    except Exception as e:
+        logger.error(f"Order driver track error: {str(e)}")
+        return json_response(message="Internal server error", status=500)
+
+def driver_owner(driver_id):
+    """User id of a driver, or None if there is no such driver (cached: drivers do not change hands)"""
+    return driver_owner_cache.get_or_load(
+        str(driver_id), lambda: db.session.query(Driver.user_id).filter(Driver.driver_id == driver_id).scalar())
+
+def own_driver_id(user_id):
+    """Driver id of a driver user, cached like driver_owner"""
+    return driver_owner_cache.get_or_load(
+        f'user:{user_id}', lambda: db.session.query(Driver.driver_id).filter(Driver.user_id == user_id).scalar())
+
 @api_bp.route('/drivers/<driver_id>/location', methods=['PUT'])
 @jwt_required()
 @role_required(['driver', 'admin'])
 def update_driver_location(driver_id):
-    """Update driver's current location (GPS)"""
+    """Update driver's current location (GPS).
+
+    Body: ``latitude`` and ``longitude`` (or ``location`` as "lat,lng"),
+    optional ``accuracy``, ``speed``, ``heading`` and ``recorded_at``. The
+    position is kept in memory and written with other drivers' in the next
+    batched flush (see app/location_ingest.py).
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
-        if not data or 'location' not in data:
+        if not data:
             return json_response(message="Location is required", status=400)
         
-        driver = Driver.query.get(driver_id)
-        
-        if not driver:
+        if not str(driver_id).isdigit() or driver_owner(int(driver_id)) is None:
             return json_response(message="Driver not found", status=404)
+        driver_id = int(driver_id)
         
-        # Get current user
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        principal = g.principal
         
         # Verify driver ownership (drivers can only update their own location)
-        if current_user.role == 'driver' and driver.user_id != current_user_id:
+        if principal.role == 'driver' and driver_owner(driver_id) != principal.user_id:
             return json_response(message="Cannot update other driver's location", status=403)
         
-        # Update location
-        driver.current_location = data['location']
-        driver.updated_at = datetime.now()
-        
-        # Optionally update latitude/longitude if provided
-        if 'latitude' in data and 'longitude' in data:
-            driver.current_latitude = data['latitude']
-            driver.current_longitude = data['longitude']
+        try:
+            ping = parse_ping(data, driver_id)
+        except ValueError as e:
+            return json_response(message=str(e), status=400)
         
-        db.session.commit()
+        locations.record([ping])
         
         return json_response({
             "driver_id": driver_id,
-            "location": driver.current_location,
-            "updated_at": driver.updated_at.isoformat()
+            "latitude": ping['latitude'],
+            "longitude": ping['longitude'],
+            "recorded_at": ping['recorded_at'].isoformat()
         }, "Driver location updated")
         
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Update driver location error: {str(e)}")
         return json_response(message="Internal server error", status=500)
 
+@api_bp.route('/drivers/locations:batch', methods=['POST'])
+@jwt_required()
+@role_required(['driver', 'admin'])
+def batch_driver_locations():
+    """Record many GPS pings in one request.
+
+    Body: ``{"pings": [{"driver_id": ..., "latitude": ..., "longitude": ...,
+    "recorded_at": ...}, ...]}``, as buffered by a driver app or forwarded by
+    a telematics gateway. Drivers may omit ``driver_id`` and only send their
+    own pings. Invalid pings are reported by index; the others are kept.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        pings = data.get('pings')
+        
+        if not isinstance(pings, list) or not pings:
+            return json_response(message="pings are required", status=400)
+        if len(pings) > PING_BATCH_LIMIT:
+            return json_response(message=f"At most {PING_BATCH_LIMIT} pings per batch", status=400)
+        
+        principal = g.principal
+        own_driver = own_driver_id(principal.user_id) if principal.role == 'driver' else None
+        if principal.role == 'driver' and own_driver is None:
+            return json_response(message="Driver not found", status=404)
+        
+        now = datetime.utcnow()
+        accepted, rejected = [], []
+        for index, item in enumerate(pings):
+            if not isinstance(item, dict):
+                rejected.append({"index": index, "message": "Ping must be an object"})
+                continue
+            driver_id = item.get('driver_id', own_driver)
+            if not str(driver_id).isdigit() or driver_owner(int(driver_id)) is None:
+                rejected.append({"index": index, "message": "Driver not found"})
+                continue
+            if own_driver is not None and int(driver_id) != own_driver:
+                rejected.append({"index": index, "message": "Cannot update other driver's location"})
+                continue
+            try:
+                accepted.append(parse_ping(item, int(driver_id), now))
+            except ValueError as e:
+                rejected.append({"index": index, "message": str(e)})
+        
+        newest = locations.record(accepted) if accepted else 0
+        
+        return json_response({
+            "accepted": len(accepted),
+            "newest": newest,
+            "rejected": rejected
+        }, f"{len(accepted)} of {len(pings)} pings recorded", status=202 if accepted else 400)
+        
+    except Exception as e:
+        logger.error(f"Batch driver locations error: {str(e)}")
+        return json_response(message="Internal server error", status=500)
+
 # ============================================
 # DRIVER ENDPOINTS
 # ============================================
 
 @api_bp.route('/drivers/available', methods=['GET'])
 @jwt_required()
+@replica_reads
 def get_available_drivers():
     """Get list of available drivers"""
     try:
@@ -929,6 +1147,7 @@ def get_available_drivers():
         
         # Execute query
         drivers = query.order_by(Driver.rating.desc()).all()
+        positions = locations.positions(driver.driver_id for driver in drivers)
         
         # Get user info for each driver
         available_drivers = []
@@ -945,7 +1164,7 @@ def get_available_drivers():
                     "vehicle_model": driver.vehicle_model,
                     "license_plate": driver.license_plate,
                     "rating": float(driver.rating) if driver.rating else 0,
-                    "current_location": driver.current_location,
+                    "current_location": location_text(positions.get(driver.driver_id), driver.current_location),
                     "total_deliveries": driver.total_deliveries,
                     "completed_deliveries": driver.completed_deliveries,
                     "avg_delivery_time": driver.avg_delivery_time,
@@ -986,7 +1205,7 @@ def assign_order_to_driver(driver_id, order_id):
             return json_response(message="Driver is not available", status=400)
         
         # Get order
-        order = Order.query.filter_by(order_id=order_id).first()
+        order = Order.by_id(order_id)
         if not order:
             return json_response(message="Order not found", status=404)
         
@@ -999,28 +1218,18 @@ def assign_order_to_driver(driver_id, order_id):
             return json_response(message="Order already has a driver assigned", status=400)
         
         # Assign driver to order
-        order.driver_id = driver_id
-        order.order_status = 'out_for_delivery'
-        order.estimated_delivery = datetime.now() + timedelta(minutes=30)  # Estimate 30 minutes
-        order.updated_at = datetime.now()
+        try:
+            transition(order, 'out_for_delivery', actor_type='admin', changed_by=g.principal.user_id,
+                       driver_id=driver_id, source='api', public_notes=f"Order assigned to driver {driver_id}")
+        except TransitionError as e:
+            return json_response(message=str(e), status=400)
         
         # Mark driver as unavailable
         driver.is_available = False
         driver.updated_at = datetime.now()
         
-        # Add to status history
-        from app.models import OrderStatusHistory
-        status_history = OrderStatusHistory(
-            order_id=order_id,
-            old_status='ready',
-            new_status='out_for_delivery',
-            driver_id=driver_id,
-            actor_type='admin',
-            public_notes=f"Order assigned to driver {driver_id}"
-        )
-        db.session.add(status_history)
-        
         db.session.commit()
+        order_cache.invalidate(order_id)
         
         logger.info(f"Order {order_id} assigned to driver {driver_id}")
         
@@ -1049,13 +1258,15 @@ def health_check():
         
         # Get basic stats
         orders_count = Order.query.count()
-        active_orders = Order.query.filter(Order.order_status.notin_(['delivered', 'cancelled'])).count()
+        active_orders = Order.query.filter(Order.active()).count()
         available_drivers = Driver.query.filter_by(is_available=True, is_on_shift=True).count()
         
         return json_response({
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
             "database": "connected",
+            "database_pool": pool_stats(),
+            "replica": replica_router.stats(),
             "statistics": {
                 "total_orders": orders_count,
                 "active_orders": active_orders,
@@ -1075,26 +1286,29 @@ def health_check():
 @api_bp.route('/metrics', methods=['GET'])
 @jwt_required()
 @role_required(['admin'])
+@replica_reads
 def get_metrics():
     """Get system metrics (admin only)"""
     try:
         # Get time range
         days = request.args.get('days', 7, type=int)
-        since_date = datetime.now() - timedelta(days=days)
+        since_date = business_days_back(days)
+        # Live and archived orders; the created_at bound keeps Postgres on the
+        # partitions involved
+        orders = all_orders()
+        in_window = and_(orders.c.business_date >= since_date,
+                         orders.c.created_at >= business_day_bounds(since_date)[0])
         
         # Calculate metrics
-        with db.engine.connect() as conn:
+        with read_engine().connect() as conn:
             # Order metrics
-            result = conn.execute(text("""
-                SELECT 
-                    COUNT(*) as total_orders,
-                    SUM(CASE WHEN order_status = 'delivered' THEN 1 ELSE 0 END) as delivered_orders,
-                    SUM(CASE WHEN order_status = 'cancelled' THEN 1 ELSE 0 END) as cancelled_orders,
-                    AVG(total_amount) as avg_order_value,
-                    SUM(total_amount) as total_revenue
-                FROM orders 
-                WHERE created_at >= :since_date
-            """), {"since_date": since_date})
+            result = conn.execute(select(
+                func.count().label('total_orders'),
+                func.sum(case((orders.c.order_status == 'delivered', 1), else_=0)).label('delivered_orders'),
+                func.sum(case((orders.c.order_status == 'cancelled', 1), else_=0)).label('cancelled_orders'),
+                func.avg(orders.c.total_amount).label('avg_order_value'),
+                func.sum(orders.c.total_amount).label('total_revenue')
+            ).where(in_window))
             order_metrics = result.fetchone()
             
             # Driver metrics
@@ -1108,26 +1322,18 @@ def get_metrics():
             driver_metrics = result.fetchone()
             
             # Customer metrics
-            result = conn.execute(text("""
-                SELECT 
-                    COUNT(DISTINCT customer_id) as unique_customers,
-                    COUNT(*) as total_orders
-                FROM orders 
-                WHERE created_at >= :since_date
-            """), {"since_date": since_date})
+            result = conn.execute(select(
+                func.count(orders.c.customer_id.distinct()).label('unique_customers'),
+                func.count().label('total_orders')
+            ).where(in_window))
             customer_metrics = result.fetchone()
             
             # Daily orders for chart
-            result = conn.execute(text("""
-                SELECT 
-                    DATE(created_at) as date,
-                    COUNT(*) as order_count,
-                    SUM(total_amount) as daily_revenue
-                FROM orders 
-                WHERE created_at >= :since_date
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """), {"since_date": since_date})
+            result = conn.execute(select(
+                orders.c.business_date.label('date'),
+                func.count().label('order_count'),
+                func.sum(orders.c.total_amount).label('daily_revenue')
+            ).where(in_window).group_by(orders.c.business_date).order_by(orders.c.business_date))
             daily_stats = result.fetchall()
         
         return json_response({
@@ -1188,7 +1394,8 @@ def internal_server_error(error):
 def before_request():
     """Log API requests"""
     g.start_time = datetime.now()
-    g.request_id = str(uuid.uuid4())[:8]
+    if 'request_id' not in g:
+        g.request_id = str(uuid.uuid4())[:8]
     
     logger.info(f"Request {g.request_id}: {request.method} {request.path}")
 
@@ -1197,7 +1404,12 @@ def after_request(response):
     """Log API responses"""
     if hasattr(g, 'start_time'):
         duration = (datetime.now() - g.start_time).total_seconds() * 1000
-        logger.info(f"Response {g.request_id}: {response.status_code} ({duration:.2f}ms)")
+        queries = query_tracker.current()
+        if queries is not None:
+            logger.info(f"Response {g.request_id}: {response.status_code} ({duration:.2f}ms, "
+                        f"{queries.count} queries, {queries.total_ms:.2f}ms db)")
+        else:
+            logger.info(f"Response {g.request_id}: {response.status_code} ({duration:.2f}ms)")
     
     # Add CORS headers
     response.headers['Access-Control-Allow-Origin'] = '*'
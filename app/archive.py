@@ -0,0 +1,129 @@
+# app/archive.py
+"""
+Order archive tier.
+
+Delivered and cancelled orders older than ``ORDER_ARCHIVE_DAYS`` are moved,
+with their items, status history and its audit text, from the live tables
+to ``orders_archive``, ``order_items_archive``,
+``order_status_history_archive`` and ``order_status_audit_archive`` (see
+db/init.sql). The archive tables have the same columns, no foreign keys and
+only the indexes that lookups and reports need, so the live indexes stay
+sized to the orders still in play.
+
+``OrderArchiver`` moves orders oldest first, one short transaction per
+batch (``flask archive-orders``, run from cron). Readers do not need to
+know which tier an order is in:
+
+- ``find_order()`` falls back to the archive when the live tables miss, and
+  ``order_models()`` gives the item/history models for the tier it came from
+- ``all_orders()`` is the union of both tiers for reports; Postgres pushes
+  the report's filters into both branches, so partition pruning and the
+  business_date indexes still apply
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select, union_all
+
+from .models import (Order, OrderItem, OrderStatusHistory, OrderStatusAudit, TERMINAL_ORDER_STATUSES,
+                     OrderArchive, OrderItemArchive, OrderStatusHistoryArchive, OrderStatusAuditArchive)
+
+logger = logging.getLogger(__name__)
+
+CLOSED_STATUSES = TERMINAL_ORDER_STATUSES
+
+# Columns reports read from either tier
+REPORT_COLUMNS = ('order_id', 'customer_id', 'restaurant_id', 'driver_id', 'order_status',
+                  'payment_status', 'total_amount', 'created_at', 'delivered_at', 'business_date')
+
+
+def find_order(order_id):
+    """Live order by id, else its archived copy (``order.archived`` tells which)"""
+    return Order.by_id(order_id) or OrderArchive.by_id(order_id)
+
+
+def order_models(order):
+    """``(item model, history model)`` of the tier ``order`` was read from"""
+    if order.archived:
+        return OrderItemArchive, OrderStatusHistoryArchive
+    return OrderItem, OrderStatusHistory
+
+
+def all_orders(name='all_orders'):
+    """Live and archived orders as one subquery, for reports"""
+    return union_all(
+        select(*(getattr(Order, column) for column in REPORT_COLUMNS)),
+        select(*(getattr(OrderArchive, column) for column in REPORT_COLUMNS))
+    ).subquery(name)
+
+
+class OrderArchiver:
+    """Move closed orders past the retention window to the archive tables"""
+
+    # (live, archive) pairs, children first for deletes
+    CHILDREN = ((OrderItem, OrderItemArchive), (OrderStatusHistory, OrderStatusHistoryArchive),
+                (OrderStatusAudit, OrderStatusAuditArchive))
+
+    def __init__(self, engine, retention_days=30, batch_size=1000, pause=0.05, log=print):
+        self.engine = engine
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.log = log
+
+    def cutoff(self):
+        return datetime.utcnow() - timedelta(days=self.retention_days)
+
+    def _copy(self, conn, live, archive, criteria):
+        columns = [column.name for column in live.__table__.columns]
+        conn.execute(archive.__table__.insert().from_select(
+            columns, select(*(live.__table__.c[name] for name in columns)).where(criteria)
+        ))
+        conn.execute(live.__table__.delete().where(criteria))
+
+    def archive_batch(self, cutoff):
+        """Move one batch in one transaction; returns the number of orders moved"""
+        orders = Order.__table__
+        with self.engine.begin() as conn:
+            query = select(orders.c.order_id, orders.c.created_at).where(
+                orders.c.order_status.in_(CLOSED_STATUSES),
+                orders.c.created_at < cutoff
+            ).order_by(orders.c.created_at).limit(self.batch_size)
+            if conn.dialect.name == 'postgresql':
+                query = query.with_for_update(skip_locked=True)
+            rows = conn.execute(query).fetchall()
+            if not rows:
+                return 0
+
+            order_ids = [row.order_id for row in rows]
+            first, last = rows[0].created_at, rows[-1].created_at
+            for live, archive in self.CHILDREN:
+                table = live.__table__
+                # The created_at range keeps the statements on the partitions involved
+                self._copy(conn, live, archive, and_(
+                    table.c.order_id.in_(order_ids),
+                    or_(table.c.order_created_at.between(first, last), table.c.order_created_at.is_(None))
+                ))
+            self._copy(conn, Order, OrderArchive, and_(
+                orders.c.order_id.in_(order_ids), orders.c.created_at.between(first, last)
+            ))
+        return len(rows)
+
+    def run(self, limit=None):
+        """Archive until nothing is left past the cutoff (or ``limit`` orders moved)"""
+        cutoff = self.cutoff()
+        started = time.monotonic()
+        moved = 0
+        self.log(f"📦 Archiving {', '.join(CLOSED_STATUSES)} orders created before {cutoff:%Y-%m-%d %H:%M} UTC")
+        while limit is None or moved < limit:
+            count = self.archive_batch(cutoff)
+            if not count:
+                break
+            moved += count
+            self.log(f"   {moved:>10} orders archived")
+            if self.pause:
+                time.sleep(self.pause)
+        self.log(f"✅ Archived {moved} orders in {time.monotonic() - started:.1f}s")
+        logger.info(f"Archived {moved} orders older than {self.retention_days} days")
+        return moved
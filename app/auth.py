@@ -1,6 +1,9 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from .models import User, db
+from . import passwords, login_guard
+from .password_pool import VerifierSaturated
+from datetime import datetime
 from .forms import LoginForm, RegistrationForm
 
 auth_bp = Blueprint('auth', __name__)
@@ -18,11 +21,26 @@ def login():
     
     if form.validate_on_submit():
         print(f"DEBUG: Form validated! Username: {form.username.data}")
+        retry_after = login_guard.check(form.username.data, request.remote_addr)
+        if retry_after:
+            flash(f'⏳ Too many failed attempts, please retry in {retry_after} seconds.', 'warning')
+            return render_template('auth/login.html', form=form), 429, {'Retry-After': str(retry_after)}
+        
         user = User.query.filter_by(username=form.username.data).first()
         print(f"DEBUG: User found: {user}")
         
-        if user and user.verify_password(form.password.data) and user.is_active:
+        try:
+            verified = bool(user) and passwords.verify_user(user, form.password.data)
+        except VerifierSaturated as e:
+            flash('⏳ Too many logins in progress, please retry in a moment.', 'warning')
+            return render_template('auth/login.html', form=form), 429, {'Retry-After': str(e.retry_after)}
+        login_guard.record(form.username.data, request.remote_addr, verified,
+                           user=user, user_agent=request.headers.get('User-Agent'))
+        
+        if verified and user.is_active:
             print(f"DEBUG: Password verified. User active: {user.is_active}")
+            user.last_login = datetime.now()
+            db.session.commit()
             login_user(user)
             flash('🎉 Login successful! Welcome back!', 'success')
             
@@ -34,7 +52,7 @@ def login():
                 return redirect(url_for('main.dashboard'))
         else:
             flash('❌ Invalid username or password', 'danger')
-            print(f"DEBUG: Login failed - user: {user}, verify: {user.verify_password(form.password.data) if user else 'No user'}")
+            print(f"DEBUG: Login failed - user: {user}, verify: {verified}")
     
     print(f"DEBUG: Rendering template. Form errors: {form.errors}")
     return render_template('auth/login.html', form=form)
@@ -0,0 +1,81 @@
+# app/authz.py
+"""
+Claims-based authorization for the JWT API.
+
+Access tokens already carry role, username and restaurant_id, so protected
+endpoints decide from the verified claims instead of loading the user row.
+What a token cannot tell us is whether the account changed after it was
+issued; that comes from the database, through the identity cache
+(app/identity.py). A user that is missing, inactive, or whose role or
+restaurant no longer matches the claims is treated as revoked, so a demoted
+admin loses admin access without waiting for the token to expire. Entries
+are invalidated on commit when any identity field changes or the row is
+deleted, and every worker re-reads within the cache TTL even without Redis
+or after a restart.
+"""
+import logging
+
+from flask import g
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from . import db
+from .identity import identity
+
+logger = logging.getLogger(__name__)
+
+
+class Principal:
+    """The authenticated caller as resolved from token claims"""
+
+    __slots__ = ('user_id', 'role', 'username', 'restaurant_id')
+
+    def __init__(self, user_id, role, username=None, restaurant_id=None):
+        self.user_id = user_id
+        self.role = role
+        self.username = username
+        self.restaurant_id = restaurant_id
+
+    def has_role(self, *roles):
+        return self.role in roles
+
+    def __repr__(self):
+        return f'<Principal {self.user_id} {self.role}>'
+
+
+def is_revoked(user_id, claims):
+    """Whether the account was deleted, disabled, or its role or restaurant changed"""
+    data = identity(user_id)
+    if not data or not data['is_active']:
+        return True
+    return data['role'] != claims['role'] or data['restaurant_id'] != claims.get('restaurant_id')
+
+
+def resolve_principal():
+    """
+    Build the principal for the current (already verified) JWT.
+
+    Returns None when the account no longer exists, was disabled, or no longer
+    has the role and restaurant the token was issued for. Tokens
+    issued before role claims were added fall back to a single user lookup.
+    """
+    if 'principal' in g:
+        return g.principal
+
+    user_id = int(get_jwt_identity())
+    claims = get_jwt()
+    principal = None
+
+    if 'role' in claims:
+        if not is_revoked(user_id, claims):
+            principal = Principal(user_id, claims['role'], claims.get('username'), claims.get('restaurant_id'))
+    else:
+        from .models import User
+        user = db.session.get(User, user_id)
+        if user and user.is_active:
+            principal = Principal(user.user_id, user.role, user.username, user.restaurant_id)
+
+    g.principal = principal
+    if principal:
+        g.user_id = principal.user_id
+    return principal
+
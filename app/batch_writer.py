@@ -0,0 +1,90 @@
+# app/batch_writer.py
+"""
+Write-behind inserts: rows are queued by request threads and written by a
+background thread as one multi-row INSERT per flush interval.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BatchInsertWriter:
+    """Queue rows for ``table()`` and append them in multi-row INSERTs"""
+
+    def __init__(self, name, table, flush_interval=0.5, batch_size=500, max_queue=10000):
+        self.name = name
+        self.table = table
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.app = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def init_app(self, app, flush_interval=None):
+        self.app = app
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        atexit.register(self.flush)
+
+    def submit(self, row):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Losing a row beats blocking the request
+            self.dropped += 1
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name=f'{self.name}-writer', daemon=True).start()
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        from . import db
+
+        total = 0
+        with self._flush_lock:
+            rows = self._drain()
+            while rows:
+                try:
+                    with self.app.app_context():
+                        with db.engine.begin() as conn:
+                            conn.execute(self.table().insert().values(rows))
+                    total += len(rows)
+                except Exception as e:
+                    self.dropped += len(rows)
+                    logger.error(f"Writing {len(rows)} {self.name} rows failed: {e}")
+                rows = self._drain()
+        self.written += total
+        return total
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
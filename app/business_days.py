@@ -0,0 +1,72 @@
+# app/business_days.py
+"""
+Business dates: the restaurant-local calendar day an order belongs to.
+
+Order timestamps are stored as naive UTC. ``orders.business_date`` is a
+stored generated column holding the Africa/Algiers date of ``created_at``
+(every restaurant runs on the business timezone, see
+restaurant_directory.py), indexed on its own and as
+``(restaurant_id, business_date)`` so "today" counts and daily grouping are
+index scans instead of ``DATE(created_at)`` over the whole table.
+
+Date filters go through these helpers: ``Order.business_date`` for orders,
+and ``within_business_days`` for other timestamp columns, which turns local
+dates into a UTC range on the raw column so its index still applies.
+"""
+from datetime import datetime, time, timedelta, timezone
+
+from sqlalchemy import Date
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+
+from .restaurant_directory import DEFAULT_TIMEZONE, business_timezone
+
+
+class LocalDate(ColumnElement):
+    """``column`` (naive UTC) as a calendar date in ``tz``; immutable, so usable in generated columns"""
+
+    type = Date()
+    inherit_cache = False
+
+    def __init__(self, column_name, tz=DEFAULT_TIMEZONE):
+        self.column_name = column_name
+        self.tz = tz
+
+
+@compiles(LocalDate, 'postgresql')
+def _local_date_postgresql(element, compiler, **kw):
+    return f"(({element.column_name} AT TIME ZONE 'UTC') AT TIME ZONE '{element.tz}')::date"
+
+
+@compiles(LocalDate)
+def _local_date_default(element, compiler, **kw):
+    # SQLite and friends (development only): fixed offset of the zone right now
+    from zoneinfo import ZoneInfo
+    offset = datetime.now(ZoneInfo(element.tz)).utcoffset()
+    return f"date({element.column_name}, '{int(offset.total_seconds() // 60):+d} minutes')"
+
+
+def business_today(now=None):
+    """Today's date in the business timezone"""
+    tz = business_timezone()
+    return (now or datetime.now(tz)).astimezone(tz).date()
+
+
+def business_day_bounds(start, end=None):
+    """Naive UTC ``[from, to)`` covering local days ``start`` to ``end`` (inclusive)"""
+    tz = business_timezone()
+    end = end or start
+    lower = datetime.combine(start, time(0), tz).astimezone(timezone.utc).replace(tzinfo=None)
+    upper = datetime.combine(end + timedelta(days=1), time(0), tz).astimezone(timezone.utc).replace(tzinfo=None)
+    return lower, upper
+
+
+def within_business_days(column, start, end=None):
+    """Sargable filter: naive-UTC ``column`` falls on local days ``start`` to ``end``"""
+    lower, upper = business_day_bounds(start, end)
+    return (column >= lower) & (column < upper)
+
+
+def business_days_back(days, today=None):
+    """First local day of a window of ``days`` days ending today"""
+    return (today or business_today()) - timedelta(days=days - 1)
@@ -0,0 +1,502 @@
+# app/caching.py
+"""
+Two-tier cache for read-heavy endpoints.
+
+L1 is a per-process LRU with TTLs and a size bound, L2 is an optional Redis
+shared by every gunicorn worker. Misses are coalesced (single-flight), stale
+entries are served while one background load refreshes them, and ``None``
+results are cached for a short negative TTL so unknown ids do not hammer the
+database. Every namespace keeps its own hit/miss/eviction counters.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+try:
+    import redis
+except ImportError:  # Redis is optional, L1 works on its own
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ('value', 'fresh_until', 'stale_until', 'negative')
+
+    def __init__(self, value, fresh_until, stale_until, negative=False):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.negative = negative
+
+
+class _Flight:
+    """A load in progress that concurrent callers can wait on"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = _MISSING
+        self.error = None
+
+
+# ============================================
+# L1 - IN-PROCESS LRU
+# ============================================
+class LRUCache:
+    """Thread-safe LRU keyed by string with per-entry expiry"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry.stale_until <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        """Store an entry, returns how many entries were evicted"""
+        evicted = 0
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ============================================
+# L2 - REDIS
+# ============================================
+class RedisBackend:
+    """Shared tier; every failure degrades to a miss instead of an error"""
+
+    INVALIDATION_CHANNEL = 'cache:invalidate'
+
+    def __init__(self, client, prefix='megapizza'):
+        self.client = client
+        self.prefix = prefix
+        self.channel = f'{prefix}:{self.INVALIDATION_CHANNEL}'
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            return None
+        payload = json.loads(raw)
+        return _Entry(payload['v'], payload['f'], payload['s'], payload.get('n', False))
+
+    def set(self, key, entry):
+        ttl_ms = max(1, int((entry.stale_until - time.time()) * 1000))
+        payload = json.dumps({
+            'v': entry.value,
+            'f': entry.fresh_until,
+            's': entry.stale_until,
+            'n': entry.negative
+        }, default=str)
+        self.client.set(self._key(key), payload, px=ttl_ms)
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def acquire_lock(self, key, ttl_ms):
+        return bool(self.client.set(self._key(f'lock:{key}'), '1', nx=True, px=ttl_ms))
+
+    def release_lock(self, key):
+        self.client.delete(self._key(f'lock:{key}'))
+
+    def publish_invalidation(self, key):
+        self.client.publish(self.channel, key)
+
+    def delete_many(self, keys):
+        """Delete ``keys`` and announce them in one message (newline separated), one round trip"""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(*(self._key(key) for key in keys))
+        pipe.publish(self.channel, '\n'.join(keys))
+        pipe.execute()
+
+
+# ============================================
+# NAMESPACES
+# ============================================
+class CacheNamespace:
+    """A named group of keys sharing TTLs, an L1 partition and counters"""
+
+    COUNTERS = ('hits', 'stale_hits', 'negative_hits', 'l2_hits', 'misses',
+                'loads', 'load_errors', 'coalesced', 'evictions', 'invalidations',
+                'l2_errors')
+
+    def __init__(self, cache, name, ttl=60, stale_ttl=0, negative_ttl=5, max_entries=None):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self._l1 = LRUCache(max_entries or cache.default_max_entries)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(self.COUNTERS, 0)
+
+    def _full_key(self, key):
+        return f'{self.name}:{key}'
+
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            self._stats[counter] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['negative_hits'] + stats['misses']
+        stats['size'] = len(self._l1)
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    # ----- lookups -----
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Return the cached value for ``key`` or call ``loader()`` once to fill it.
+
+        Values are shared between callers and must be treated as read-only.
+        A loader returning ``None`` is cached as a negative entry.
+        """
+        if not self.cache.enabled:
+            return loader()
+
+        full_key = self._full_key(key)
+        now = time.time()
+
+        entry = self._l1.get(full_key, now)
+        if entry is None:
+            entry = self._l2_get(full_key)
+            if entry is not None and entry.stale_until > now:
+                self._count('l2_hits')
+                self._store_l1(full_key, entry)
+            else:
+                entry = None
+
+        if entry is not None:
+            if entry.fresh_until > now:
+                self._count('negative_hits' if entry.negative else 'hits')
+                return entry.value
+            self._count('stale_hits')
+            self._refresh_in_background(key, loader, ttl)
+            return entry.value
+
+        self._count('misses')
+        # Cached values outlive replica lag, so always fill from the primary
+        from .database import on_primary
+        with on_primary():
+            return self._load(key, loader, ttl)
+
+    def peek(self, key):
+        """Return a fresh cached value without loading, or ``None``"""
+        entry = self._l1.get(self._full_key(key))
+        if entry is None or entry.fresh_until <= time.time():
+            return None
+        return entry.value
+
+    def set(self, key, value, ttl=None):
+        self._store(self._full_key(key), value, ttl)
+
+    def invalidate(self, key):
+        """Drop a key from both tiers and tell the other workers to drop it too"""
+        full_key = self._full_key(key)
+        self._l1.delete(full_key)
+        self._count('invalidations')
+        backend = self.cache.backend
+        if backend is not None:
+            try:
+                backend.delete(full_key)
+                backend.publish_invalidation(full_key)
+            except Exception as e:
+                self._count('l2_errors')
+                logger.warning(f"Cache invalidation for {full_key} failed on Redis: {e}")
+
+    def invalidate_many(self, keys):
+        """``invalidate()`` for many keys with one Redis DEL and one invalidation message"""
+        full_keys = [self._full_key(key) for key in keys]
+        if not full_keys:
+            return
+        for full_key in full_keys:
+            self._l1.delete(full_key)
+        self._count('invalidations', len(full_keys))
+        backend = self.cache.backend
+        if backend is not None:
+            try:
+                backend.delete_many(full_keys)
+            except Exception as e:
+                self._count('l2_errors')
+                logger.warning(f"Cache invalidation of {len(full_keys)} {self.name} keys failed on Redis: {e}")
+
+    def clear(self):
+        """Drop the local tier for this namespace"""
+        self._l1.clear()
+
+    # ----- internals -----
+
+    def _l2_get(self, full_key):
+        backend = self.cache.backend
+        if backend is None:
+            return None
+        try:
+            return backend.get(full_key)
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"Cache read for {full_key} failed on Redis: {e}")
+            return None
+
+    def _store_l1(self, full_key, entry):
+        evicted = self._l1.set(full_key, entry)
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _store(self, full_key, value, ttl=None):
+        now = time.time()
+        if value is None:
+            fresh_until = now + self.negative_ttl
+            entry = _Entry(None, fresh_until, fresh_until, negative=True)
+        else:
+            fresh_until = now + (ttl if ttl is not None else self.ttl)
+            entry = _Entry(value, fresh_until, fresh_until + self.stale_ttl)
+        self._store_l1(full_key, entry)
+
+        backend = self.cache.backend
+        if backend is not None:
+            try:
+                backend.set(full_key, entry)
+            except Exception as e:
+                self._count('l2_errors')
+                logger.warning(f"Cache write for {full_key} failed on Redis: {e}")
+        return entry
+
+    def _join_flight(self, full_key):
+        with self._flights_lock:
+            flight = self._flights.get(full_key)
+            if flight is not None:
+                return flight, False
+            flight = _Flight()
+            self._flights[full_key] = flight
+            return flight, True
+
+    def _finish_flight(self, full_key, flight):
+        with self._flights_lock:
+            self._flights.pop(full_key, None)
+        flight.event.set()
+
+    def _load(self, key, loader, ttl):
+        full_key = self._full_key(key)
+        flight, leader = self._join_flight(full_key)
+
+        if not leader:
+            self._count('coalesced')
+            if flight.event.wait(self.cache.load_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                if flight.value is not _MISSING:
+                    return flight.value
+            # Leader is stuck or died, load on our own rather than fail
+            return loader()
+
+        try:
+            value = self._load_across_workers(full_key, loader, ttl)
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            self._count('load_errors')
+            raise
+        finally:
+            self._finish_flight(full_key, flight)
+
+    def _load_across_workers(self, full_key, loader, ttl):
+        """Only one worker per key runs the loader, the others poll L2 briefly"""
+        backend = self.cache.backend
+        locked = False
+        if backend is not None:
+            lock_ms = int(self.cache.load_timeout * 1000)
+            try:
+                locked = backend.acquire_lock(full_key, lock_ms)
+            except Exception as e:
+                self._count('l2_errors')
+                logger.warning(f"Cache lock for {full_key} failed on Redis: {e}")
+                locked = True  # Redis is down, just load
+            if not locked:
+                deadline = time.time() + self.cache.load_timeout
+                while time.time() < deadline:
+                    time.sleep(self.cache.lock_poll_interval)
+                    entry = self._l2_get(full_key)
+                    if entry is not None and entry.fresh_until > time.time():
+                        self._count('coalesced')
+                        self._store_l1(full_key, entry)
+                        return entry.value
+        try:
+            self._count('loads')
+            value = loader()
+            self._store(full_key, value, ttl)
+            return value
+        finally:
+            if locked and backend is not None:
+                try:
+                    backend.release_lock(full_key)
+                except Exception:
+                    self._count('l2_errors')
+
+    def _refresh_in_background(self, key, loader, ttl):
+        full_key = self._full_key(key)
+        flight, leader = self._join_flight(full_key)
+        if not leader:
+            return
+
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def refresh():
+            try:
+                if app is not None:
+                    with app.app_context():
+                        flight.value = self._load_across_workers(full_key, loader, ttl)
+                else:
+                    flight.value = self._load_across_workers(full_key, loader, ttl)
+            except Exception as e:
+                flight.error = e
+                self._count('load_errors')
+                logger.warning(f"Background refresh of {full_key} failed: {e}")
+            finally:
+                self._finish_flight(full_key, flight)
+
+        threading.Thread(target=refresh, name=f'cache-refresh-{self.name}', daemon=True).start()
+
+
+# ============================================
+# CACHE EXTENSION
+# ============================================
+class Cache:
+    """Flask extension holding the namespaces and the optional Redis tier"""
+
+    def __init__(self, app=None, redis_client=None):
+        self.enabled = True
+        self.backend = None
+        self.default_max_entries = 1024
+        self.load_timeout = 5.0
+        self.lock_poll_interval = 0.05
+        self._namespaces = {}
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, redis_client=redis_client)
+
+    def init_app(self, app, redis_client=None):
+        """
+        Read ``CACHE_*`` settings from the app config.
+
+        ``redis_client`` lets tests plug in ``fakeredis.FakeRedis()``; otherwise
+        ``CACHE_REDIS_URL`` is used when set and the redis package is installed.
+        """
+        app.config.setdefault('CACHE_ENABLED', True)
+        app.config.setdefault('CACHE_REDIS_URL', os.environ.get('REDIS_URL'))
+        app.config.setdefault('CACHE_KEY_PREFIX', 'megapizza')
+        app.config.setdefault('CACHE_L1_MAX_ENTRIES', 1024)
+        app.config.setdefault('CACHE_LOAD_TIMEOUT', 5.0)
+
+        self.enabled = app.config['CACHE_ENABLED']
+        self.default_max_entries = app.config['CACHE_L1_MAX_ENTRIES']
+        self.load_timeout = app.config['CACHE_LOAD_TIMEOUT']
+
+        if redis_client is None and app.config['CACHE_REDIS_URL']:
+            if redis is None:
+                logger.warning("CACHE_REDIS_URL is set but the redis package is not installed, using L1 only")
+            else:
+                redis_client = redis.Redis.from_url(
+                    app.config['CACHE_REDIS_URL'],
+                    socket_timeout=0.25,
+                    socket_connect_timeout=0.25
+                )
+        if redis_client is not None:
+            self.backend = RedisBackend(redis_client, prefix=app.config['CACHE_KEY_PREFIX'])
+
+        app.extensions['cache'] = self
+
+        if self.backend is not None:
+            @app.before_request
+            def _start_cache_listener():
+                self.ensure_listener()
+
+    def namespace(self, name, ttl=60, stale_ttl=0, negative_ttl=5, max_entries=None):
+        """Create a namespace, or return the existing one with that name"""
+        ns = self._namespaces.get(name)
+        if ns is None:
+            ns = CacheNamespace(self, name, ttl=ttl, stale_ttl=stale_ttl,
+                                negative_ttl=negative_ttl, max_entries=max_entries)
+            self._namespaces[name] = ns
+        return ns
+
+    def stats(self):
+        return {name: ns.stats() for name, ns in self._namespaces.items()}
+
+    def clear(self):
+        for ns in self._namespaces.values():
+            ns.clear()
+
+    def _drop_local(self, full_key):
+        name = full_key.split(':', 1)[0]
+        ns = self._namespaces.get(name)
+        if ns is not None:
+            ns._l1.delete(full_key)
+
+    def ensure_listener(self):
+        """Subscribe this worker to invalidations published by the others (once per process)"""
+        if self.backend is None or self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.backend.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.backend.channel)
+                for message in pubsub.listen():
+                    data = message.get('data')
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    for key in (data or '').split('\n'):
+                        if key:
+                            self._drop_local(key)
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener lost Redis: {e}")
+                time.sleep(1)
@@ -0,0 +1,537 @@
+# app/database.py
+"""
+Database access layer: one configured connection pool per worker, used by
+the ORM and by raw-SQL code alike.
+
+Pool sizing, pre-ping, recycle and the Postgres statement timeout come from
+``DB_*`` settings (defaults per service in config.py). The pool records how
+long checkouts wait and how close it runs to saturation, and can be
+pre-filled when a worker starts so the first requests do not pay for
+connection setup.
+
+With ``DATABASE_REPLICA_URL`` set, ``db.session`` is a routing session:
+handlers marked ``@replica_reads`` send their SELECTs to the replica while
+writes stay on the primary. A client that has just written keeps reading
+from the primary until the replica has caught up with that write, and the
+replica is skipped altogether while its lag exceeds ``DB_REPLICA_MAX_LAG``.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, text
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.elements import TextClause
+
+logger = logging.getLogger(__name__)
+
+POOL_DEFAULTS = {
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 10,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    'DB_STATEMENT_TIMEOUT_MS': 15000,
+    'DB_POOL_PREFILL': 2,
+    'DB_REPLICA_MAX_LAG': 5,
+    'DB_REPLICA_LAG_CHECK': 2,
+}
+
+REPLICA_BIND = 'replica'
+
+# Upper bounds (ms) of the checkout wait histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics:
+    """Checkout wait times and saturation of a pool"""
+
+    bounds_ms = WAIT_BUCKETS_MS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidated = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.peak_checked_out = 0
+
+    def observe_wait(self, wait_ms):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            for i, bound in enumerate(WAIT_BUCKETS_MS):
+                if wait_ms <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+            else:
+                self.wait_buckets[-1] += 1
+
+    def observe_checked_out(self, checked_out):
+        if checked_out > self.peak_checked_out:
+            self.peak_checked_out = checked_out
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a connection"""
+
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.timeouts += 1
+            raise
+        if self.metrics is not None:
+            self.metrics.observe_wait((time.perf_counter() - start) * 1000)
+            self.metrics.observe_checked_out(self.checkedout())
+        return connection
+
+
+pool_metrics = PoolMetrics()
+
+
+def _is_postgres(uri):
+    return (uri or '').startswith(('postgresql', 'postgres'))
+
+
+def configure_pool(app, service='web'):
+    """
+    Fill ``SQLALCHEMY_ENGINE_OPTIONS`` from the ``DB_*`` settings.
+
+    Call before ``db.init_app``. Values already in ``app.config`` win over the
+    per-service defaults in config.py, which win over ``POOL_DEFAULTS``. A
+    ``DATABASE_REPLICA_URL`` becomes the ``replica`` bind with the same pool
+    settings.
+    """
+    try:
+        from config import pool_config
+        service_config = pool_config.get(service, pool_config['default'])
+        defaults = {key: getattr(service_config, key) for key in POOL_DEFAULTS if hasattr(service_config, key)}
+    except ImportError:
+        defaults = {}
+
+    for key, value in POOL_DEFAULTS.items():
+        app.config.setdefault(key, defaults.get(key, value))
+
+    replica_url = app.config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        # Flask-SQLAlchemy does not apply SQLALCHEMY_ENGINE_OPTIONS to other binds
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(REPLICA_BIND, {**pool_options(app, replica_url), 'url': replica_url})
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    for key, value in pool_options(app, app.config.get('SQLALCHEMY_DATABASE_URI')).items():
+        options.setdefault(key, value)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def pool_options(app, uri):
+    """Engine options for ``uri`` from the ``DB_*`` settings (none for sqlite and friends)"""
+    if not _is_postgres(uri):
+        return {}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
+    timeout = app.config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def init_pool(app, db):
+    """Attach metrics to the app's engine and pre-fill it once per worker process"""
+    state = {'pid': None}
+    lock = threading.Lock()
+
+    with app.app_context():
+        engine = db.engine
+        if isinstance(engine.pool, InstrumentedQueuePool):
+            engine.pool.metrics = pool_metrics
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_connection, connection_record):
+            pool_metrics.connects += 1
+
+        @event.listens_for(engine, 'invalidate')
+        def _on_invalidate(dbapi_connection, connection_record, exception):
+            pool_metrics.invalidated += 1
+
+    def prefill():
+        with app.app_context():
+            warm_pool(db.engine, app.config['DB_POOL_PREFILL'])
+
+    @app.before_request
+    def _prefill_pool_once_per_worker():
+        # Workers are forked after create_app, so do this on their first request
+        if state['pid'] == os.getpid():
+            return
+        with lock:
+            if state['pid'] == os.getpid():
+                return
+            state['pid'] = os.getpid()
+        if app.config['DB_POOL_PREFILL'] and isinstance(db.engine.pool, QueuePool):
+            threading.Thread(target=prefill, name='db-pool-prefill', daemon=True).start()
+
+
+def warm_pool(engine, count):
+    """Open ``count`` connections and return them to the pool"""
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.raw_connection())
+    except Exception as e:
+        logger.warning(f"Pool prefill stopped after {len(connections)} connections: {e}")
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def pooled_connection():
+    """
+    A DBAPI (psycopg2) connection from the shared pool.
+
+    ``close()`` returns it to the pool instead of closing it.
+    """
+    from . import db
+    return db.engine.raw_connection()
+
+
+@contextmanager
+def raw_cursor(commit=False):
+    """Cursor on a pooled connection; rolls back on error, always returns the connection"""
+    connection = pooled_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            if commit:
+                connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+
+def pool_stats():
+    """Current pool occupancy plus the checkout metrics collected so far"""
+    from . import db
+
+    pool = db.engine.pool
+    stats = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + pool._max_overflow
+        checked_out = pool.checkedout()
+        stats.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': checked_out,
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'saturation': round(checked_out / capacity, 3) if capacity > 0 else 0,
+            'peak_saturation': round(pool_metrics.peak_checked_out / capacity, 3) if capacity > 0 else 0,
+        })
+
+    checkouts = pool_metrics.checkouts
+    stats.update({
+        'checkouts': checkouts,
+        'checkout_timeouts': pool_metrics.timeouts,
+        'connects': pool_metrics.connects,
+        'invalidated': pool_metrics.invalidated,
+        'wait_avg_ms': round(pool_metrics.wait_total_ms / checkouts, 3) if checkouts else 0,
+        'wait_max_ms': round(pool_metrics.wait_max_ms, 3),
+        'wait_buckets_ms': dict(zip([*map(str, WAIT_BUCKETS_MS), '+Inf'], pool_metrics.wait_buckets)),
+    })
+    return stats
+
+
+# ============================================
+# READ REPLICA ROUTING
+# ============================================
+def _is_read(clause):
+    """Plain SELECTs only; anything else (DML, FOR UPDATE, CTEs) stays on the primary"""
+    if clause is None:
+        return False
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT' and 'FOR UPDATE' not in clause.text.upper()
+    return getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+
+class RoutingSession(Session):
+    """
+    ``db.session`` class: SELECTs go to the replica when the session is routed
+    there (``info['route']``), everything else to the primary.
+
+    The first write switches the rest of the session to the primary so a
+    handler always reads what it has just written.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            if _is_read(clause):
+                if self.info.get('route') == REPLICA_BIND:
+                    replica = self._db.engines.get(REPLICA_BIND)
+                    if replica is not None:
+                        return replica
+            elif clause is not None:
+                self._wrote()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _wrote(self):
+        self.info['route'] = None
+        self.info['wrote'] = True
+        self.info['unmarked_write'] = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _session_flushed(session, flush_context):
+    session._wrote()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _session_committed(session):
+    if session.info.pop('unmarked_write', False):
+        record_write()
+
+
+def record_write():
+    """
+    Note that the current client has just committed a write.
+
+    Session commits do this on their own; raw connections from
+    ``pooled_connection()`` call it after committing.
+    """
+    if not has_request_context():
+        return
+    router = current_app.extensions.get('replica_router')
+    if router is not None and router.enabled:
+        router.mark_write()
+
+
+class WriteMarks:
+    """When each client last wrote, in Redis when available so every worker sees it"""
+
+    def __init__(self, prefix='megapizza', max_keys=100000):
+        self.prefix = prefix
+        self.client = None
+        self.max_keys = max_keys
+        self._marks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set(self, key, timestamp, ttl):
+        if self.client is not None:
+            try:
+                self.client.set(f'{self.prefix}:ryw:{key}', repr(timestamp), px=max(1, int(ttl * 1000)))
+                return
+            except Exception as e:
+                logger.warning(f"Write mark for {key} failed on Redis: {e}")
+        with self._lock:
+            self._marks[key] = (timestamp, time.time() + ttl)
+            self._marks.move_to_end(key)
+            while len(self._marks) > self.max_keys:
+                self._marks.popitem(last=False)
+
+    def get(self, key):
+        if self.client is not None:
+            try:
+                value = self.client.get(f'{self.prefix}:ryw:{key}')
+                return float(value) if value is not None else None
+            except Exception as e:
+                logger.warning(f"Write mark lookup for {key} failed on Redis: {e}")
+        with self._lock:
+            mark = self._marks.get(key)
+        if mark is None or mark[1] <= time.time():
+            return None
+        return mark[0]
+
+
+class ReplicaRouter:
+    """Flask extension deciding per request whether reads may use the replica"""
+
+    LAG_QUERY = text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self, app=None, db=None):
+        self.enabled = False
+        self.max_lag = 5
+        self.check_interval = 2
+        self.marks = WriteMarks()
+        self._db = None
+        self._lag = None
+        self._checked_at = 0
+        self._check_lock = threading.Lock()
+        self.counters = {'replica': 0, 'primary_recent_write': 0, 'primary_lagging': 0, 'lag_check_errors': 0}
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        for key in ('DB_REPLICA_MAX_LAG', 'DB_REPLICA_LAG_CHECK'):
+            app.config.setdefault(key, POOL_DEFAULTS[key])
+
+        self._db = db
+        self.max_lag = float(app.config['DB_REPLICA_MAX_LAG'])
+        self.check_interval = float(app.config['DB_REPLICA_LAG_CHECK'])
+        self.enabled = REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+        self.marks.prefix = app.config.get('CACHE_KEY_PREFIX', 'megapizza')
+
+        cache = app.extensions.get('cache')
+        if cache is not None and cache.backend is not None:
+            self.marks.client = cache.backend.client
+
+        app.extensions['replica_router'] = self
+
+    # ----- lag -----
+
+    def _measure_lag(self):
+        engine = self._db.engines[REPLICA_BIND]
+        if not _is_postgres(str(engine.url)):
+            return 0.0
+        with engine.connect() as conn:
+            return float(conn.execute(self.LAG_QUERY).scalar() or 0)
+
+    def lag(self):
+        """Replica lag in seconds as of the last check (``inf`` if unreachable)"""
+        now = time.time()
+        if now - self._checked_at > self.check_interval and self._check_lock.acquire(blocking=False):
+            # One thread per worker measures, the others keep the previous value
+            try:
+                self._lag = self._measure_lag()
+            except Exception as e:
+                self._lag = float('inf')
+                self.counters['lag_check_errors'] += 1
+                logger.warning(f"Replica lag check failed, reading from the primary: {e}")
+            finally:
+                self._checked_at = time.time()
+                self._check_lock.release()
+        return self._lag if self._lag is not None else float('inf')
+
+    # ----- read-your-writes -----
+
+    @staticmethod
+    def client_key():
+        """The user behind the request (JWT or Flask-Login), else the client IP"""
+        user_id = g.get('user_id')
+        if user_id is None:
+            try:
+                from flask_jwt_extended import get_jwt_identity
+                user_id = get_jwt_identity()
+            except RuntimeError:
+                user_id = None
+        if user_id is None:
+            from flask_login import current_user
+            if current_user and current_user.is_authenticated:
+                user_id = current_user.get_id()
+        return f'user:{user_id}' if user_id is not None else f'ip:{request.remote_addr}'
+
+    def mark_write(self):
+        # Past max_lag + one check interval the replica is skipped anyway
+        self.marks.set(self.client_key(), time.time(), self.max_lag + self.check_interval)
+
+    def use_replica(self):
+        """Whether this request's reads can go to the replica"""
+        if not self.enabled:
+            return False
+        lag = self.lag()
+        if lag > self.max_lag:
+            self.counters['primary_lagging'] += 1
+            return False
+        last_write = self.marks.get(self.client_key())
+        # The lag figure may be one check old, so allow for that too
+        if last_write is not None and time.time() - last_write <= lag + self.check_interval:
+            self.counters['primary_recent_write'] += 1
+            return False
+        self.counters['replica'] += 1
+        return True
+
+    def stats(self):
+        return {
+            **self.counters,
+            'enabled': self.enabled,
+            'lag_seconds': None if self._lag is None else round(self._lag, 3),
+            'max_lag_seconds': self.max_lag
+        }
+
+
+def replica_reads(f):
+    """Route a read-only handler's SELECTs to the replica when it is safe to"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        router = current_app.extensions.get('replica_router')
+        if router is not None and router.use_replica():
+            from . import db
+            db.session.info['route'] = REPLICA_BIND
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def read_engine():
+    """Engine for report queries run on a bare connection: the replica when the session is routed there"""
+    from . import db
+
+    if db.session.info.get('route') == REPLICA_BIND:
+        return db.engines[REPLICA_BIND]
+    return db.engine
+
+
+@contextmanager
+def on_replica():
+    """Send the enclosed reads (e.g. a report) to the replica when it is safe to"""
+    from . import db
+
+    router = current_app.extensions.get('replica_router')
+    if router is None or db.session.info.get('wrote') or not router.use_replica():
+        yield
+        return
+    previous = db.session.info.get('route')
+    db.session.info['route'] = REPLICA_BIND
+    try:
+        yield
+    finally:
+        db.session.info['route'] = previous
+
+
+@contextmanager
+def on_primary():
+    """Read the enclosed queries from the primary even in a replica-routed handler"""
+    from . import db
+
+    if not has_app_context() or db.session.info.get('route') != REPLICA_BIND:
+        yield
+        return
+    db.session.info['route'] = None
+    try:
+        yield
+    finally:
+        # A write inside the block keeps the session on the primary
+        if not db.session.info.get('wrote'):
+            db.session.info['route'] = REPLICA_BIND
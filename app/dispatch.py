@@ -0,0 +1,457 @@
+# app/dispatch.py
+"""
+Automatic driver dispatch.
+
+Every ``DISPATCH_INTERVAL`` seconds a round collects the delivery orders
+that are ready and have no driver, and the available on-shift drivers, and
+assigns them as a batch instead of first come, first served. Orders that
+can share a trip are grouped first (see app/route_batching.py) and each
+trip is assigned like a single order:
+
+- ``cost_matrix()`` scores every (driver, trip) pair with NumPy: pickup
+  distance (haversine from the driver's latest GPS fix to the restaurant),
+  the driver's rating and current load, minus a bonus for how long the
+  oldest order has waited. Pickups further than ``DISPATCH_MAX_PICKUP_KM`` are infeasible.
+- ``assign()`` solves the assignment optimally (``solve_optimal``, the
+  Hungarian method with shortest augmenting paths, one vectorised row at a
+  time) while the smaller side has at most ``DISPATCH_OPTIMAL_MAX`` entries,
+  and greedily above that (``solve_greedy``: mutual best pairs, a few
+  vectorised passes).
+- the round commits all assignments in one transaction: order rows through
+  ``transition_many`` (out_for_delivery, driver and history, the route's
+  ETA for orders of a multi-drop trip), drivers marked busy only for the
+  orders that actually moved.
+
+Rounds take a transaction-level advisory lock, so with several workers
+running the dispatcher only one of them assigns at a time. ``flask dispatch``
+runs rounds from the command line; bench_dispatch.py times the solver.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select, text
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+# Cost of a pair that must not be assigned; finite so the solver's
+# potentials stay finite
+INFEASIBLE = 1e6
+
+# Cost terms, in kilometres of pickup distance
+DEFAULT_WEIGHTS = {
+    'distance': 1.0,  # per km to the restaurant
+    'rating': 0.5,    # per star below 5
+    'load': 2.0,      # per open order already carried
+    'waiting': 0.1,   # bonus per minute the order has been ready
+}
+
+# pg_try_advisory_xact_lock key of a dispatch round
+DISPATCH_LOCK = 4707
+
+
+def parse_position(location):
+    """(lat, lng) from a "lat,lng" location string, or None"""
+    try:
+        lat, lng = (float(part) for part in (location or '').split(','))
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def _fix_position(fix, location):
+    """Driver's latest GPS fix (app/location_ingest.py), else their location string"""
+    if fix is not None:
+        return float(fix['latitude']), float(fix['longitude'])
+    return parse_position(location)
+
+
+# ============================================
+# COST MATRIX
+# ============================================
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """Great-circle distances in km between every point of set 1 (rows) and set 2 (columns)"""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lng1, lat2, lng2))
+    dlat = lat2[None, :] - lat1[:, None]
+    dlng = lng2[None, :] - lng1[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1)[:, None] * np.cos(lat2)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _unit_vectors(lat, lng):
+    lat, lng = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lng, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)])
+
+
+def distance_matrix(lat1, lng1, lat2, lng2):
+    """Great-circle distances like haversine_matrix, from one matrix product of unit vectors.
+
+    Trig runs once per point instead of once per pair, several times faster
+    on a dispatch round. Off by up to a few decimetres for near-identical
+    points, which does not matter for pickup costs.
+    """
+    dot = _unit_vectors(lat1, lng1) @ _unit_vectors(lat2, lng2).T
+    # Half the chord length between the points, squared
+    half_chord = np.clip((1 - dot) / 2, 0, 1)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(half_chord, out=half_chord), out=half_chord)
+
+
+def cost_matrix(drivers, orders, weights=None, max_pickup_km=None):
+    """Cost of each driver (rows) taking each order (columns).
+
+    ``drivers`` holds arrays ``lat``, ``lng``, ``rating`` and ``load``;
+    ``orders`` holds ``lat``, ``lng`` (the pickup) and ``waiting`` minutes.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    distance = distance_matrix(drivers['lat'], drivers['lng'], orders['lat'], orders['lng'])
+    cost = weights['distance'] * distance
+    cost += (weights['rating'] * (5 - np.asarray(drivers['rating'], dtype=float))
+             + weights['load'] * np.asarray(drivers['load'], dtype=float))[:, None]
+    cost -= weights['waiting'] * np.asarray(orders['waiting'], dtype=float)[None, :]
+    if max_pickup_km is not None:
+        cost[distance > max_pickup_km] = INFEASIBLE
+    return cost
+
+
+# ============================================
+# SOLVERS
+# ============================================
+def solve_optimal(cost):
+    """Minimum-cost assignment of a rectangular matrix: (rows, columns), one per row or column.
+
+    Hungarian method in its shortest augmenting path form: O(n²m) for n
+    rows <= m columns, with the inner loop over columns done by NumPy.
+    Rows start matched to their cheapest column when nobody else took it,
+    so only the contested rows need a search, and each search updates the
+    potentials once at the end instead of at every step.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # Row reduction keeps every reduced cost >= 0 with each row's cheapest column tight
+    u = cost.min(axis=1)
+    v = np.zeros(m)
+    row_for_col = np.full(m, -1, dtype=np.intp)
+    col_for_row = np.full(n, -1, dtype=np.intp)
+    for i, j in enumerate(cost.argmin(axis=1)):
+        if row_for_col[j] < 0:
+            row_for_col[j], col_for_row[i] = i, j
+
+    reduced = np.empty(m)
+    pending = np.empty(m)  # shortest path to each column not reached yet
+    path = np.empty(m, dtype=np.intp)
+    for start in np.flatnonzero(col_for_row < 0):
+        pending.fill(np.inf)
+        reached = np.zeros(m, dtype=bool)
+        distance = {}  # column -> shortest path length when reached
+        rows = [start]
+        i, shortest, sink = start, 0.0, -1
+        while sink < 0:
+            np.subtract(cost[i], v, out=reduced)
+            reduced += shortest - u[i]
+            reduced[reached] = np.inf
+            better = reduced < pending
+            np.copyto(pending, reduced, where=better)
+            path[better] = i
+            j = int(pending.argmin())
+            shortest = distance[j] = pending[j]
+            reached[j] = True
+            pending[j] = np.inf
+            if row_for_col[j] < 0:
+                sink = j
+            else:
+                i = row_for_col[j]
+                rows.append(i)
+        # Potentials of everything reached move by the slack left to the sink
+        u[start] += shortest
+        for i in rows[1:]:
+            u[i] += shortest - distance[col_for_row[i]]
+        v[np.fromiter(distance, dtype=np.intp)] -= shortest - np.fromiter(distance.values(), dtype=float)
+        # Augment along the path back to the starting row
+        j = sink
+        while True:
+            i = path[j]
+            row_for_col[j] = i
+            col_for_row[i], j = j, col_for_row[i]
+            if i == start:
+                break
+
+    rows = np.arange(n)
+    return (col_for_row, rows) if transposed else (rows, col_for_row)
+
+
+def solve_greedy(cost):
+    """Greedy assignment: pair rows and columns that are each other's cheapest, repeat.
+
+    The cheapest remaining pair is always mutual, so every pass assigns at
+    least one pair; in practice a handful of passes assign everyone.
+    """
+    cost = np.array(cost, dtype=float)
+    n = cost.shape[0]
+    every_row = np.arange(n)
+    rows, cols = [], []
+    while True:
+        best_col = cost.argmin(axis=1)
+        best_row = cost.argmin(axis=0)
+        mutual = np.flatnonzero((best_row[best_col] == every_row) & (cost[every_row, best_col] < INFEASIBLE))
+        if not mutual.size:
+            break
+        rows.append(mutual)
+        cols.append(best_col[mutual])
+        cost[mutual, :] = np.inf
+        cost[:, best_col[mutual]] = np.inf
+    if not rows:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def assign(cost, optimal_max=400):
+    """Feasible (rows, columns, method) pairs of ``cost``, optimal for small problems"""
+    if not cost.size:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), 'none'
+    if min(cost.shape) <= optimal_max:
+        rows, cols, method = *solve_optimal(cost), 'optimal'
+    else:
+        rows, cols, method = *solve_greedy(cost), 'greedy'
+    feasible = cost[rows, cols] < INFEASIBLE
+    return rows[feasible], cols[feasible], method
+
+
+# ============================================
+# DISPATCH ROUNDS
+# ============================================
+class Dispatcher:
+    """Flask extension: periodic batched assignment of ready orders to drivers"""
+
+    def __init__(self, app=None, db=None):
+        self.enabled = False
+        self.interval = 15
+        self.max_orders = 1000
+        self.optimal_max = 400
+        self.max_pickup_km = 10.0
+        self.weights = dict(DEFAULT_WEIGHTS)
+        self.batching = {}
+        self.rounds = 0
+        self.assigned = 0
+        self.last_run = None
+        self.last_round = {}
+        self.last_error = None
+        self._db = None
+        self._app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('DISPATCH_ENABLED', False)
+        app.config.setdefault('DISPATCH_INTERVAL', 15)
+        app.config.setdefault('DISPATCH_MAX_ORDERS', 1000)
+        app.config.setdefault('DISPATCH_OPTIMAL_MAX', 400)
+        app.config.setdefault('DISPATCH_MAX_PICKUP_KM', 10.0)
+        app.config.setdefault('DISPATCH_WEIGHTS', {})
+        app.config.setdefault('ROUTE_BATCHING_ENABLED', True)
+        app.config.setdefault('ROUTE_BATCH_MAX_ORDERS', 3)
+        app.config.setdefault('ROUTE_BATCH_MAX_DELAY', 10.0)
+        app.config.setdefault('ROUTE_BATCH_RADIUS_KM', 2.0)
+        app.config.setdefault('ROUTE_SPEED_KMH', 25.0)
+
+        self.enabled = app.config['DISPATCH_ENABLED']
+        self.interval = app.config['DISPATCH_INTERVAL']
+        self.max_orders = app.config['DISPATCH_MAX_ORDERS']
+        self.optimal_max = app.config['DISPATCH_OPTIMAL_MAX']
+        self.max_pickup_km = app.config['DISPATCH_MAX_PICKUP_KM']
+        self.weights = {**DEFAULT_WEIGHTS, **app.config['DISPATCH_WEIGHTS']}
+        # batch_orders() keyword arguments, empty when batching is off
+        self.batching = {
+            'max_orders': app.config['ROUTE_BATCH_MAX_ORDERS'],
+            'max_delay': app.config['ROUTE_BATCH_MAX_DELAY'],
+            'radius_km': app.config['ROUTE_BATCH_RADIUS_KM'],
+            'speed_kmh': app.config['ROUTE_SPEED_KMH'],
+        } if app.config['ROUTE_BATCHING_ENABLED'] else {}
+        self._db = db
+        self._app = app
+
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        if self.enabled and uri.startswith('postgres'):
+            app.before_request(self._ensure_thread)
+
+        app.extensions['dispatcher'] = self
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='dispatcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._app.app_context():
+                self.run_once()
+            time.sleep(self.interval)
+
+    # ----- one round -----
+
+    def _ready_orders(self, conn):
+        from .models import Address, Order, Restaurant
+        orders, restaurants, addresses = Order.__table__, Restaurant.__table__, Address.__table__
+        return conn.execute(
+            select(orders.c.order_id, orders.c.restaurant_id, orders.c.status_changed_at, orders.c.created_at,
+                   restaurants.c.latitude, restaurants.c.longitude,
+                   addresses.c.latitude.label('drop_latitude'), addresses.c.longitude.label('drop_longitude'))
+            .join(restaurants, restaurants.c.restaurant_id == orders.c.restaurant_id)
+            .outerjoin(addresses, addresses.c.address_id == orders.c.address_id)
+            .where(Order.active('ready'), orders.c.driver_id.is_(None), orders.c.delivery_type == 'delivery',
+                   restaurants.c.latitude.is_not(None), restaurants.c.longitude.is_not(None))
+            .order_by(orders.c.created_at)
+            .limit(self.max_orders)
+        ).all()
+
+    def _available_drivers(self, conn):
+        from .models import Driver, Order
+        drivers, orders = Driver.__table__, Order.__table__
+        query = select(drivers.c.driver_id, drivers.c.current_location, drivers.c.rating).where(
+            drivers.c.is_available.is_(True), drivers.c.is_on_shift.is_(True))
+        if conn.dialect.name == 'postgresql':
+            # Drivers being assigned by hand right now sit this round out
+            query = query.with_for_update(skip_locked=True)
+        rows = conn.execute(query).all()
+        if not rows:
+            return [], {}
+        loads = dict(conn.execute(
+            select(orders.c.driver_id, func.count())
+            .where(Order.active('out_for_delivery'), orders.c.driver_id.in_([row.driver_id for row in rows]))
+            .group_by(orders.c.driver_id)
+        ).all())
+        return rows, loads
+
+    def _trips(self, orders, now):
+        """Dispatch units of a round: multi-drop trips when batching, else one per order"""
+        from .route_batching import batch_orders
+        units = [{
+            'order_id': row.order_id,
+            'restaurant_id': row.restaurant_id,
+            'pickup': (float(row.latitude), float(row.longitude)),
+            'drop': (float(row.drop_latitude), float(row.drop_longitude))
+            if row.drop_latitude is not None and row.drop_longitude is not None else None,
+            'waiting': (now - (row.status_changed_at or row.created_at)).total_seconds() / 60,
+        } for row in orders]
+        if self.batching:
+            return batch_orders(units, **self.batching)
+        return [{'pickup': unit['pickup'], 'orders': [unit]} for unit in units]
+
+    def run_once(self, now=None):
+        """Assign ready orders to available drivers; returns the round's summary"""
+        from . import locations
+        from .api import order_cache
+        from .models import Driver
+        from .order_transitions import transition_many
+
+        db = self._db
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        summary = {'orders': 0, 'drivers': 0, 'assigned': 0, 'batched': 0, 'method': 'none', 'solve_ms': 0.0}
+        try:
+            conn = db.session.connection()
+            if conn.dialect.name == 'postgresql' and not conn.execute(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': DISPATCH_LOCK}).scalar():
+                db.session.rollback()
+                summary['skipped'] = 'another dispatcher is running'
+                return summary
+
+            orders = self._ready_orders(conn)
+            drivers, loads = self._available_drivers(conn) if orders else ([], {})
+            fixes = locations.positions(row.driver_id for row in drivers) if drivers else {}
+            located = [(row, position) for row in drivers
+                       for position in [_fix_position(fixes.get(row.driver_id), row.current_location)] if position]
+            summary.update(orders=len(orders), drivers=len(located))
+            if not orders or not located:
+                db.session.rollback()
+                return self._finish(summary, started)
+
+            solve_started = time.perf_counter()
+            trips = self._trips(orders, now)
+            cost = cost_matrix(
+                {'lat': [position[0] for _, position in located],
+                 'lng': [position[1] for _, position in located],
+                 'rating': [float(row.rating or 0) for row, _ in located],
+                 'load': [loads.get(row.driver_id, 0) for row, _ in located]},
+                {'lat': [trip['pickup'][0] for trip in trips],
+                 'lng': [trip['pickup'][1] for trip in trips],
+                 'waiting': [max(order['waiting'] for order in trip['orders']) for trip in trips]},
+                self.weights, self.max_pickup_km)
+            rows, cols, summary['method'] = assign(cost, self.optimal_max)
+            summary['solve_ms'] = round((time.perf_counter() - solve_started) * 1000, 2)
+
+            changes, pairs, estimates = [], {}, {}
+            for row, col in zip(rows, cols):
+                (driver, position), trip = located[row], trips[col]
+                stops = len(trip['orders'])
+                if stops > 1:
+                    to_pickup = haversine_matrix([position[0]], [position[1]],
+                                                 [trip['pickup'][0]], [trip['pickup'][1]])[0, 0]
+                    leaves = now + timedelta(minutes=float(to_pickup) / self.batching['speed_kmh'] * 60)
+                for stop, order in enumerate(trip['orders'], 1):
+                    pairs[order['order_id']] = driver.driver_id
+                    note = f"Order assigned to driver {driver.driver_id}"
+                    if stops > 1:
+                        estimates[order['order_id']] = leaves + timedelta(minutes=trip['arrivals'][stop - 1])
+                        note += f" (drop {stop} of {stops})"
+                    changes.append({'order_id': order['order_id'], 'status': 'out_for_delivery', 'public_notes': note})
+            results = transition_many(changes, actor_type='system', source='dispatch', now=now,
+                                      drivers=pairs, estimates=estimates)
+            moved = [result['order_id'] for result in results if result['success']]
+            if moved:
+                drivers_table = Driver.__table__
+                conn.execute(drivers_table.update()
+                             .where(drivers_table.c.driver_id.in_([pairs[order_id] for order_id in moved]))
+                             .values(is_available=False, updated_at=now))
+            db.session.commit()
+            order_cache.invalidate_many(moved)
+            summary['assigned'] = len(moved)
+            summary['batched'] = sum(1 for order_id in moved if order_id in estimates)
+        except Exception as e:
+            db.session.rollback()
+            self.last_error = str(e)
+            logger.error(f"Dispatch round failed: {e}")
+            return summary
+        self.last_error = None
+        return self._finish(summary, started)
+
+    def _finish(self, summary, started):
+        summary['round_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        self.rounds += 1
+        self.assigned += summary['assigned']
+        self.last_run = datetime.utcnow()
+        self.last_round = summary
+        if summary['assigned']:
+            logger.info(f"Dispatch: {summary['assigned']} orders assigned, {summary['batched']} in multi-drop trips "
+                        f"({summary['orders']} ready, {summary['drivers']} drivers, "
+                        f"{summary['method']} in {summary['solve_ms']}ms)")
+        return summary
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'rounds': self.rounds,
+            'assigned': self.assigned,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_round': self.last_round,
+            'last_error': self.last_error
+        }
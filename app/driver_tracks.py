@@ -0,0 +1,307 @@
+# app/driver_tracks.py
+"""
+Driver location history.
+
+Every GPS ping the ingestor accepts (app/location_ingest.py) is also kept
+for the driver's track, which disputes ("the driver never came") and ETA
+modelling read back. Tracks are stored compressed in ``driver_locations``,
+partitioned by day:
+
+- pings are buffered per driver and cut into segments of
+  ``TRACK_SEGMENT_SECONDS``; each segment is simplified with Douglas-Peucker
+  on the synchronized distance (the gap between a fix and where the driver
+  would be at that time on the simplified line), so stops keep their
+  duration and only fixes the line already explains are dropped
+- the kept fixes are stored as the first fix in columns (microdegrees,
+  timestamp) and the rest as zigzag varint deltas of (milliseconds,
+  microdegrees) in one bytea: a few bytes per fix instead of a row each
+- ``driver_track()`` decodes the segments overlapping a window; only the
+  day partitions of the window are read
+
+``TrackRetention`` (``flask compact-tracks``) downsamples segments older
+than ``TRACK_RAW_DAYS`` to one fix per ``TRACK_DOWNSAMPLE_SECONDS`` and
+drops day partitions older than ``TRACK_RETENTION_DAYS``.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, text
+
+logger = logging.getLogger(__name__)
+
+# Longest segment; track queries look back this far before a window for
+# segments that started earlier and run into it
+MAX_SEGMENT = timedelta(minutes=10)
+# Fixes buffered per driver before a segment is cut regardless of age
+MAX_SEGMENT_POINTS = 1000
+
+MICRODEGREES = 1_000_000
+_METRES_PER_DEGREE = 111_320.0
+
+
+# ============================================
+# COMPRESSION
+# ============================================
+def simplify(times, lats, lngs, tolerance_m):
+    """Indexes of the fixes Douglas-Peucker keeps, by synchronized (time-aware) distance"""
+    count = len(times)
+    if count <= 2:
+        return list(range(count))
+    t = np.asarray(times, dtype=float)
+    # Local equirectangular projection, in metres
+    y = np.asarray(lats, dtype=float) * _METRES_PER_DEGREE
+    x = np.asarray(lngs, dtype=float) * _METRES_PER_DEGREE * np.cos(np.radians(np.mean(lats)))
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner = slice(first + 1, last)
+        span = t[last] - t[first]
+        ratio = (t[inner] - t[first]) / span if span > 0 else np.zeros(last - first - 1)
+        gap = np.hypot(x[inner] - (x[first] + ratio * (x[last] - x[first])),
+                       y[inner] - (y[first] + ratio * (y[last] - y[first])))
+        worst = int(gap.argmax())
+        if gap[worst] > tolerance_m:
+            split = first + 1 + worst
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return [int(i) for i in np.flatnonzero(keep)]
+
+
+def _varint(value, out):
+    value = (value << 1) ^ (value >> 63)  # zigzag: small negatives stay short
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_track(points):
+    """Segment row values for ``points``: (recorded_at, lat, lng) sorted by time, at least one"""
+    started_at = points[0][0]
+    fixes = [(int(round((stamp - started_at).total_seconds() * 1000)),
+              int(round(lat * MICRODEGREES)), int(round(lng * MICRODEGREES))) for stamp, lat, lng in points]
+    deltas = bytearray()
+    for previous, fix in zip(fixes, fixes[1:]):
+        for a, b in zip(previous, fix):
+            _varint(b - a, deltas)
+    return {
+        'started_at': started_at,
+        'ended_at': points[-1][0],
+        'points': len(points),
+        'start_lat': fixes[0][1],
+        'start_lng': fixes[0][2],
+        'deltas': bytes(deltas),
+    }
+
+
+def decode_track(row):
+    """(recorded_at, lat, lng) fixes of a driver_locations row"""
+    values, value, shift = [], 0, 0
+    # Raw SELECTs get psycopg2's memoryview, which iterates as 1-byte bytes
+    for byte in bytes(row.deltas):
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value, shift = 0, 0
+    ms, lat, lng = 0, row.start_lat, row.start_lng
+    fixes = [(row.started_at, lat / MICRODEGREES, lng / MICRODEGREES)]
+    for i in range(0, len(values) - 2, 3):
+        ms, lat, lng = ms + values[i], lat + values[i + 1], lng + values[i + 2]
+        fixes.append((row.started_at + timedelta(milliseconds=ms), lat / MICRODEGREES, lng / MICRODEGREES))
+    return fixes
+
+
+def compress(driver_id, pings, tolerance_m):
+    """driver_locations row for one segment of a driver's pings"""
+    pings = sorted(pings, key=lambda ping: ping['recorded_at'])
+    epoch = pings[0]['recorded_at']
+    kept = simplify([(ping['recorded_at'] - epoch).total_seconds() for ping in pings],
+                    [ping['latitude'] for ping in pings], [ping['longitude'] for ping in pings], tolerance_m)
+    row = encode_track([(pings[i]['recorded_at'], pings[i]['latitude'], pings[i]['longitude']) for i in kept])
+    return {'driver_id': driver_id, **row, 'raw_points': len(pings), 'resolution': 0}
+
+
+# ============================================
+# RECORDING (fed by LocationIngestor)
+# ============================================
+def _runs(pings):
+    """Pings split into runs no longer than MAX_SEGMENT (offline uploads can span hours)"""
+    runs = []
+    for ping in sorted(pings, key=lambda ping: ping['recorded_at']):
+        if (not runs or ping['recorded_at'] - runs[-1][0]['recorded_at'] > MAX_SEGMENT
+                or len(runs[-1]) >= MAX_SEGMENT_POINTS):
+            runs.append([])
+        runs[-1].append(ping)
+    return runs
+
+
+class TrackRecorder:
+    """Per-driver ping buffers, cut into compressed segments"""
+
+    def __init__(self, segment_seconds=60, tolerance_m=8.0):
+        self.segment_seconds = segment_seconds
+        self.tolerance_m = tolerance_m
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self.points_in = 0
+        self.points_kept = 0
+
+    def add(self, pings):
+        with self._lock:
+            for ping in pings:
+                self._buffers.setdefault(ping['driver_id'], []).append(ping)
+
+    def buffered(self):
+        return sum(len(pings) for pings in self._buffers.values())
+
+    def cut(self, force=False, now=None):
+        """(row, pings) of the buffers due: oldest fix older than segment_seconds, or all when forced"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.segment_seconds)
+        with self._lock:
+            due = {driver_id: pings for driver_id, pings in self._buffers.items()
+                   if force or len(pings) >= MAX_SEGMENT_POINTS
+                   or min(ping['recorded_at'] for ping in pings) <= cutoff}
+            for driver_id in due:
+                del self._buffers[driver_id]
+        return [(compress(driver_id, run, self.tolerance_m), run)
+                for driver_id, pings in due.items() for run in _runs(pings)]
+
+    def count(self, segments):
+        self.points_in += sum(row['raw_points'] for row, _ in segments)
+        self.points_kept += sum(row['points'] for row, _ in segments)
+
+    def restore(self, segments):
+        """Buffer again the pings of segments a failed write did not store"""
+        with self._lock:
+            for row, pings in segments:
+                self._buffers.setdefault(row['driver_id'], []).extend(pings)
+
+
+# ============================================
+# QUERIES
+# ============================================
+def driver_track(conn, driver_id, start, end):
+    """(segments read, fixes) of ``driver_id`` between ``start`` and ``end``; fixes
+    are dicts, oldest first. ``conn`` is a connection or session."""
+    from .models import DriverLocation
+    table = DriverLocation.__table__
+    rows = conn.execute(select(table).where(
+        table.c.driver_id == driver_id,
+        table.c.started_at >= start - MAX_SEGMENT,  # prunes to the window's day partitions
+        table.c.started_at <= end,
+        table.c.ended_at >= start,
+    ).order_by(table.c.started_at)).all()
+    fixes = sorted({fix for row in rows for fix in decode_track(row) if start <= fix[0] <= end})
+    return len(rows), [{'recorded_at': stamp, 'latitude': lat, 'longitude': lng} for stamp, lat, lng in fixes]
+
+
+def order_window(order, history):
+    """(start, end) of an order's delivery trip from its status history rows, or None"""
+    started = [row.changed_at for row in history if row.new_status == 'out_for_delivery']
+    if not started:
+        return None
+    return min(started), order.delivered_at or datetime.utcnow()
+
+
+# ============================================
+# RETENTION
+# ============================================
+# Day partitions of driver_locations with their first day
+DAY_PARTITIONS = """
+SELECT c.relname, to_date(right(c.relname, 10), 'YYYY_MM_DD') AS day
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = CAST('driver_locations' AS regclass)
+  AND c.relname ~ '_[0-9]{4}_[0-9]{2}_[0-9]{2}$'
+ORDER BY day
+"""
+
+
+def downsample(fixes, seconds):
+    """First fix of every ``seconds`` bucket, plus the last fix"""
+    kept, bucket = [], None
+    for fix in fixes:
+        current = int(fix[0].timestamp() // seconds)
+        if current != bucket:
+            kept.append(fix)
+            bucket = current
+    if kept[-1] is not fixes[-1]:
+        kept.append(fixes[-1])
+    return kept
+
+
+class TrackRetention:
+    """Downsampling of old tracks and removal of expired day partitions"""
+
+    def __init__(self, engine, raw_days=7, keep_days=90, resolution=30, batch_size=2000, pause=0.05, log=print):
+        self.engine = engine
+        self.raw_days = raw_days
+        self.keep_days = keep_days
+        self.resolution = resolution
+        self.batch_size = batch_size
+        self.pause = pause
+        self.log = log
+
+    def _partitions(self, conn):
+        return conn.execute(text(DAY_PARTITIONS)).all()
+
+    def downsample_partition(self, name):
+        """Downsample the full-resolution segments of one day partition; returns segments rewritten"""
+        done = 0
+        while True:
+            with self.engine.begin() as conn:
+                rows = conn.execute(text(
+                    f'SELECT driver_id, started_at, start_lat, start_lng, deltas FROM "{name}" '
+                    'WHERE resolution = 0 ORDER BY driver_id, started_at LIMIT :limit FOR UPDATE'
+                ), {'limit': self.batch_size}).all()
+                if not rows:
+                    break
+                updates = []
+                for row in rows:
+                    fixes = downsample(decode_track(row), self.resolution)
+                    updates.append({**encode_track(fixes), 'driver_id': row.driver_id,
+                                    'old_started_at': row.started_at, 'resolution': self.resolution})
+                conn.execute(text(
+                    f'UPDATE "{name}" SET points = :points, start_lat = :start_lat, start_lng = :start_lng, '
+                    'deltas = :deltas, resolution = :resolution '
+                    'WHERE driver_id = :driver_id AND started_at = :old_started_at'
+                ), updates)
+            done += len(rows)
+            self.log(f"   {name}: {done:>10} segments downsampled")
+            if self.pause:
+                time.sleep(self.pause)
+        return done
+
+    def run(self):
+        if self.engine.dialect.name != 'postgresql':
+            self.log("ℹ️  Track retention needs PostgreSQL, nothing to do")
+            return {}
+        today = datetime.utcnow().date()
+        with self.engine.connect() as conn:
+            partitions = self._partitions(conn)
+
+        result = {'downsampled': 0, 'dropped': []}
+        for name, day in partitions:
+            age = (today - day).days
+            if age > self.keep_days:
+                with self.engine.begin() as conn:
+                    conn.execute(text(f'DROP TABLE "{name}"'))
+                result['dropped'].append(name)
+                self.log(f"   🗑️  {name} dropped")
+            elif age > self.raw_days:
+                result['downsampled'] += self.downsample_partition(name)
+
+        self.log(f"✅ {result['downsampled']} segments downsampled to {self.resolution}s, "
+                 f"{len(result['dropped'])} day partitions dropped")
+        logger.info(f"Track retention: {result['downsampled']} downsampled, {len(result['dropped'])} dropped")
+        return result
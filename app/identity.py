@@ -0,0 +1,134 @@
+# app/identity.py
+"""
+Cached identity for Flask-Login sessions.
+
+The web and admin UI only need a handful of user fields per request, so the
+user loader returns a small snapshot kept in the cache for a few seconds
+instead of loading (and later lazy-loading relationships of) the ORM row.
+Snapshots are invalidated on commit whenever an identity field changes or
+the user is deleted.
+"""
+import logging
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import db, cache
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_FIELDS = ('username', 'email', 'role', 'is_active', 'restaurant_id', 'phone_number')
+
+identity_cache = cache.namespace('identity', ttl=30, negative_ttl=5)
+
+
+class UserSnapshot(UserMixin):
+    """Read-only view of a user for ``current_user``; use ``load()`` for the ORM row"""
+
+    def __init__(self, user_id, username, email, role, is_active, restaurant_id=None, phone_number=None):
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+        self.role = role
+        self._active = is_active
+        self.restaurant_id = restaurant_id
+        self.phone_number = phone_number
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{'user_id': user.user_id, **{f: getattr(user, f) for f in IDENTITY_FIELDS}})
+
+    def to_dict(self):
+        data = {f: getattr(self, f) for f in IDENTITY_FIELDS}
+        data['user_id'] = self.user_id
+        return data
+
+    @property
+    def is_active(self):
+        return bool(self._active)
+
+    def get_id(self):
+        return str(self.user_id)
+
+    def load(self):
+        from .models import User
+        return db.session.get(User, self.user_id)
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+    def is_driver(self):
+        return self.role == 'driver'
+
+    def is_manager(self):
+        return self.role == 'manager'
+
+    def is_employee(self):
+        return self.role == 'employee'
+
+    def is_customer(self):
+        return self.role == 'user'
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.username}>'
+
+
+def identity(user_id):
+    """Cached identity fields of a user as a dict, or None if there is no such user"""
+    from .models import User
+
+    def load():
+        row = db.session.query(
+            User.user_id, *(getattr(User, f) for f in IDENTITY_FIELDS)
+        ).filter(User.user_id == int(user_id)).first()
+        return dict(row._mapping) if row else None
+
+    return identity_cache.get_or_load(str(user_id), load)
+
+
+def load_identity(user_id):
+    """Flask-Login user loader: snapshot of an active user, or None"""
+    from .models import User
+
+    if not current_app.config.get('IDENTITY_CACHE_ENABLED', True):
+        return db.session.get(User, int(user_id))
+
+    data = identity(user_id)
+    if not data or not data['is_active']:
+        return None
+    return UserSnapshot(**data)
+
+
+def invalidate_identity(user_id):
+    identity_cache.invalidate(str(user_id))
+
+
+# ============================================
+# INVALIDATION
+# ============================================
+@event.listens_for(Session, 'before_flush')
+def _collect_identity_changes(session, flush_context, instances):
+    from .models import User
+
+    changed = session.info.setdefault('identity_dirty', set())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.user_id)
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[f].history.has_changes() for f in IDENTITY_FIELDS):
+                changed.add(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('identity_dirty', ()):
+        invalidate_identity(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('identity_dirty', None)
@@ -0,0 +1,353 @@
+# app/index_advisor.py
+"""
+Workload-driven index advisor (``flask index-advisor``).
+
+Reads three sources from the primary and, when configured, the replica:
+
+- ``pg_stat_user_indexes``: scans and size per index, summed over the
+  partitions of a partitioned index and over both nodes (an index only the
+  replica uses is not unused)
+- ``pg_stat_statements``: the normalized statements and the time spent in
+  them, if the extension is installed
+- captured fingerprints: the ``slow_queries`` section of
+  ``/admin/system/health?format=json`` saved to a file, or any JSON list of
+  ``{"fingerprint", "count", "total_ms"}``
+
+and reports
+
+- unused indexes: no scans since the statistics were reset, not backing a
+  constraint
+- duplicate indexes: same key columns as another index (or as the leading
+  columns of a wider one) with the same predicate
+- missing indexes: per table, the equality columns of a WHERE clause
+  followed by its first range or ORDER BY column, when no index starts with
+  them. The estimated benefit is the time spent in the statements that want
+  the index, an upper bound on what it can save
+
+``migration()`` turns the findings into SQL for psql: ``CREATE INDEX
+CONCURRENTLY`` / ``DROP INDEX CONCURRENTLY``. Unused indexes are only listed
+unless asked for (``--drop-unused``): zero scans on a fresh or recently
+reset database says nothing about the indexes a workload needs. For
+partitioned tables it writes an index on the parent ``ONLY`` plus one built
+concurrently per partition and attached to it, since Postgres cannot build a
+partitioned index concurrently.
+
+The WHERE-clause reading is regex based and deliberately shallow: it finds
+``alias.column <op>`` comparisons and ORDER BY columns, not every plan the
+optimizer could use. Treat missing-index suggestions as candidates to check
+with EXPLAIN.
+"""
+import json
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import text
+
+from .query_stats import fingerprint
+
+logger = logging.getLogger(__name__)
+
+_COMMENT = re.compile(r'/\*.*?\*/|--[^\n]*', re.DOTALL)
+_PG_PARAM = re.compile(r'\$\d+')
+_TABLE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(?:ONLY\s+)?"?(\w+)"?(?:\s+(?:AS\s+)?(?!WHERE|ON|JOIN|LEFT|RIGHT|INNER|GROUP|ORDER|LIMIT|SET|USING|VALUES)(\w+))?',
+                    re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bOFFSET\b|\bFOR\s+UPDATE\b|\bRETURNING\b|\bUNION\b|$)',
+                    re.IGNORECASE | re.DOTALL)
+_ORDER_BY = re.compile(r'\bORDER\s+BY\b(.*?)(?=\bLIMIT\b|\bOFFSET\b|\bFOR\s+UPDATE\b|\)|$)', re.IGNORECASE | re.DOTALL)
+_COMPARISON = re.compile(
+    r'(?:"?(\w+)"?\.)?"?(\w+)"?\s*(=|<=|>=|<(?!>)|>|\bIN\b|\bBETWEEN\b|\bIS\s+NULL\b)',
+    re.IGNORECASE)
+_ORDER_COLUMN = re.compile(r'(?:"?(\w+)"?\.)?"?(\w+)"?\s*(?:ASC|DESC)?\s*(?:NULLS\s+(?:FIRST|LAST))?\s*(?:,|$)', re.IGNORECASE)
+
+EQUALITY = ('=', 'IN', 'IS NULL')
+
+INDEXES_SQL = """
+WITH usage AS (
+    SELECT COALESCE(pg_partition_root(s.indexrelid), s.indexrelid) AS root,
+           sum(s.idx_scan) AS scans, sum(pg_relation_size(s.indexrelid)) AS bytes
+    FROM pg_stat_user_indexes s
+    GROUP BY 1
+)
+SELECT ic.relname AS name, tc.relname AS "table", am.amname AS method,
+       i.indisunique AS is_unique, i.indisprimary AS is_primary,
+       EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid) AS backs_constraint,
+       tc.relkind = 'p' AS partitioned,
+       ARRAY(SELECT pg_get_indexdef(i.indexrelid, k, true)
+             FROM generate_series(1, i.indnkeyatts) AS k ORDER BY k) AS columns,
+       ARRAY(SELECT pg_get_indexdef(i.indexrelid, k, true)
+             FROM generate_series(i.indnkeyatts + 1, i.indnatts) AS k ORDER BY k) AS include,
+       pg_get_expr(i.indpred, i.indrelid) AS predicate,
+       pg_get_indexdef(i.indexrelid) AS definition,
+       COALESCE(u.scans, 0) AS scans,
+       COALESCE(u.bytes, 0) AS bytes
+FROM pg_index i
+JOIN pg_class ic ON ic.oid = i.indexrelid
+JOIN pg_class tc ON tc.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = tc.relnamespace
+JOIN pg_am am ON am.oid = ic.relam
+LEFT JOIN usage u ON u.root = i.indexrelid
+WHERE n.nspname = :schema
+  AND NOT EXISTS (SELECT 1 FROM pg_inherits inh WHERE inh.inhrelid = i.indexrelid)
+"""
+
+TABLES_SQL = """
+SELECT c.relname AS "table", c.relkind = 'p' AS partitioned,
+       (SELECT COALESCE(sum(GREATEST(p.reltuples, 0)), 0)
+        FROM pg_partition_tree(c.oid) t JOIN pg_class p ON p.oid = t.relid) AS rows,
+       ARRAY(SELECT a.attname FROM pg_attribute a
+             WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped ORDER BY a.attnum) AS columns,
+       ARRAY(SELECT t.relid::regclass::text FROM pg_partition_tree(c.oid) t WHERE t.isleaf AND t.relid <> c.oid) AS partitions
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+"""
+
+
+def _pg_stat_statements(conn, limit):
+    """Top statements by total time, or [] without the extension"""
+    installed = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")).scalar()
+    if not installed:
+        return []
+    # total_exec_time since Postgres 13, total_time before
+    column = conn.execute(text(
+        "SELECT attname FROM pg_attribute WHERE attrelid = 'pg_stat_statements'::regclass "
+        "AND attname IN ('total_exec_time', 'total_time') ORDER BY attname DESC LIMIT 1"
+    )).scalar()
+    rows = conn.execute(text(
+        f"SELECT query, calls, {column} FROM pg_stat_statements "
+        f"WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+        f"ORDER BY {column} DESC LIMIT :limit"
+    ), {'limit': limit})
+    return [{'fingerprint': fingerprint(_PG_PARAM.sub('?', query)), 'count': calls, 'total_ms': float(total)}
+            for query, calls, total in rows]
+
+
+def load_fingerprints(path):
+    """Captured fingerprints from a saved health JSON or a plain list"""
+    with open(path) as handle:
+        data = json.load(handle)
+    if isinstance(data, dict):
+        data = (data.get('slow_queries') or {}).get('top') or data.get('top') or []
+    return [{'fingerprint': row['fingerprint'], 'count': row.get('count', 1), 'total_ms': float(row.get('total_ms', 0))}
+            for row in data if row.get('fingerprint')]
+
+
+def wanted_index(statement, tables):
+    """``{table: (equality columns, range/order column)}`` for one statement"""
+    statement = _COMMENT.sub(' ', statement)
+    aliases = {}
+    for table, alias in _TABLE.findall(statement):
+        if table in tables:
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+    if not aliases:
+        return {}
+    only_table = next(iter(set(aliases.values()))) if len(set(aliases.values())) == 1 else None
+
+    def owner(qualifier, column):
+        table = aliases.get(qualifier) if qualifier else only_table
+        return table if table and column in tables[table]['columns'] else None
+
+    wanted = defaultdict(lambda: ([], None))
+    for clause in _WHERE.findall(statement):
+        for qualifier, column, operator in _COMPARISON.findall(clause):
+            table = owner(qualifier, column)
+            if table is None:
+                continue
+            equality, ranged = wanted[table]
+            operator = ' '.join(operator.upper().split())
+            if operator in EQUALITY:
+                if column not in equality:
+                    equality.append(column)
+            elif ranged is None:
+                wanted[table] = (equality, column)
+    for clause in _ORDER_BY.findall(statement):
+        for qualifier, column in _ORDER_COLUMN.findall(clause.strip())[:1]:
+            table = owner(qualifier, column)
+            if table is not None and wanted[table][1] is None:
+                wanted[table] = (wanted[table][0], column)
+    return {table: (tuple(equality), ranged) for table, (equality, ranged) in wanted.items()
+            if equality or ranged}
+
+
+def _serves(index, equality, ranged):
+    """Whether ``index`` can drive a scan for these equality/range columns"""
+    if index['method'] != 'btree' or index['predicate']:
+        return False
+    columns = index['columns']
+    if equality:
+        if set(columns[:len(equality)]) != set(equality):
+            return False
+        return ranged is None or len(columns) > len(equality) and columns[len(equality)] == ranged
+    return bool(columns) and columns[0] == ranged
+
+
+class IndexAdvisor:
+    """Collect index statistics and the workload, and derive recommendations"""
+
+    def __init__(self, engines, schema='public', min_rows=10000, min_share=0.01, statements=500):
+        self.engines = [engine for engine in engines if engine is not None]
+        self.schema = schema
+        self.min_rows = min_rows
+        self.min_share = min_share
+        self.statements = statements
+        self.indexes = {}
+        self.tables = {}
+        self.workload = []
+        self.stats_reset = None
+
+    def collect(self, fingerprints=()):
+        for position, engine in enumerate(self.engines):
+            with engine.connect() as conn:
+                for row in conn.execute(text(INDEXES_SQL), {'schema': self.schema}).mappings():
+                    index = self.indexes.get(row['name'])
+                    if index is None:
+                        self.indexes[row['name']] = {**row, 'columns': list(row['columns']), 'include': list(row['include'])}
+                    else:
+                        index['scans'] += row['scans']
+                if position == 0:
+                    for row in conn.execute(text(TABLES_SQL), {'schema': self.schema}).mappings():
+                        self.tables[row['table']] = {**row, 'columns': set(row['columns'])}
+                    self.stats_reset = conn.execute(text(
+                        "SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()"
+                    )).scalar()
+                self.workload.extend(_pg_stat_statements(conn, self.statements))
+        self.workload.extend(fingerprints)
+        return self
+
+    # ----- findings -----
+
+    def unused(self):
+        return sorted(
+            (index for index in self.indexes.values()
+             if index['scans'] == 0 and not index['backs_constraint'] and not index['is_unique']),
+            key=lambda index: index['bytes'], reverse=True
+        )
+
+    def duplicates(self):
+        """``(redundant, kept_because_of)`` pairs"""
+        found = []
+        by_table = defaultdict(list)
+        for index in self.indexes.values():
+            by_table[index['table']].append(index)
+        for indexes in by_table.values():
+            for index in indexes:
+                if index['backs_constraint'] or index['is_unique']:
+                    continue
+                for other in indexes:
+                    if other is index or other['method'] != index['method'] or other['predicate'] != index['predicate']:
+                        continue
+                    same = other['columns'] == index['columns']
+                    prefix = len(other['columns']) > len(index['columns']) and \
+                        other['columns'][:len(index['columns'])] == index['columns'] and index['method'] == 'btree'
+                    if not (same or prefix) or not set(index['include']) <= set(other['columns'] + other['include']):
+                        continue
+                    # Of two identical plain indexes keep the busier one (the name breaks ties)
+                    if same and not (other['backs_constraint'] or other['is_unique']) and \
+                            (other['scans'], other['name']) < (index['scans'], index['name']):
+                        continue
+                    found.append((index, other))
+                    break
+        return found
+
+    def missing(self):
+        """Candidate indexes with the workload share that wants them"""
+        total_ms = sum(row['total_ms'] for row in self.workload) or 1.0
+        candidates = {}
+        for row in self.workload:
+            for table, (equality, ranged) in wanted_index(row['fingerprint'], self.tables).items():
+                if self.tables[table]['rows'] < self.min_rows:
+                    continue
+                if any(_serves(index, equality, ranged) for index in self.indexes.values() if index['table'] == table):
+                    continue
+                columns = list(equality[:3]) + ([ranged] if ranged and ranged not in equality else [])
+                key = (table, tuple(columns))
+                candidate = candidates.setdefault(key, {
+                    'table': table, 'columns': columns, 'calls': 0, 'total_ms': 0.0,
+                    'rows': self.tables[table]['rows'], 'examples': []
+                })
+                candidate['calls'] += row['count']
+                candidate['total_ms'] += row['total_ms']
+                if len(candidate['examples']) < 3:
+                    candidate['examples'].append(row['fingerprint'][:200])
+        found = [dict(candidate, share=candidate['total_ms'] / total_ms) for candidate in candidates.values()]
+        return sorted((candidate for candidate in found if candidate['share'] >= self.min_share),
+                      key=lambda candidate: candidate['total_ms'], reverse=True)
+
+    # ----- output -----
+
+    def report(self, log=print):
+        since = f"since {self.stats_reset:%Y-%m-%d}" if self.stats_reset else "since the statistics were last reset"
+        log(f"📊 {len(self.indexes)} indexes, {len(self.workload)} statements sampled ({since}, "
+            f"{len(self.engines)} node{'s' if len(self.engines) > 1 else ''})")
+
+        log("\n🗑  Unused indexes")
+        for index in self.unused():
+            log(f"   {index['name']:<48} {index['table']:<24} {_size(index['bytes']):>10}")
+        log("\n♊ Duplicate indexes")
+        for index, other in self.duplicates():
+            log(f"   {index['name']:<48} covered by {other['name']} ({', '.join(other['columns'])})")
+        log("\n➕ Missing indexes (benefit: time in statements that want them)")
+        for candidate in self.missing():
+            log(f"   {candidate['table']}({', '.join(candidate['columns'])})  "
+                f"{candidate['total_ms'] / 1000:,.1f}s over {candidate['calls']:,} calls "
+                f"({candidate['share']:.0%} of sampled time), ~{int(candidate['rows']):,} rows")
+            for example in candidate['examples']:
+                log(f"      {example}")
+
+    def migration(self, drop_unused=False):
+        """SQL for psql (no surrounding transaction: CONCURRENTLY cannot run in one);
+        unused indexes are dropped only with ``drop_unused``, otherwise listed as comments"""
+        lines = [f"-- Generated by `flask index-advisor` on {datetime.now():%Y-%m-%d %H:%M}",
+                 "-- Run with psql outside a transaction; review every statement first.", ""]
+        dropped = set()
+        for index, other in self.duplicates():
+            if index['name'] in dropped:
+                continue
+            dropped.add(index['name'])
+            lines.append(f"-- duplicate of {other['name']}: {index['definition']}")
+            lines.extend(self._drop(index))
+        for index in self.unused():
+            if index['name'] in dropped:
+                continue
+            dropped.add(index['name'])
+            lines.append(f"-- unused, {_size(index['bytes'])}: {index['definition']}")
+            if drop_unused:
+                lines.extend(self._drop(index))
+            else:
+                lines.extend(f"-- {line}" if line else line for line in self._drop(index))
+        for candidate in self.missing():
+            lines.append(f"-- {candidate['total_ms'] / 1000:,.1f}s over {candidate['calls']:,} calls, "
+                         f"e.g. {candidate['examples'][0][:120]}")
+            lines.extend(self._create(candidate['table'], candidate['columns']))
+        return '\n'.join(lines) + '\n'
+
+    def _drop(self, index):
+        if self.tables.get(index['table'], {}).get('partitioned'):
+            # Dropping the parent index drops the partition indexes with it
+            return [f"DROP INDEX IF EXISTS {self.schema}.{index['name']};", ""]
+        return [f"DROP INDEX CONCURRENTLY IF EXISTS {self.schema}.{index['name']};", ""]
+
+    def _create(self, table, columns):
+        name = f"idx_{table}_{'_'.join(columns)}"[:63]
+        column_list = ', '.join(columns)
+        info = self.tables[table]
+        if not info['partitioned']:
+            return [f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {self.schema}.{table} ({column_list});", ""]
+        lines = [f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {self.schema}.{table} ({column_list});"]
+        for partition in info['partitions']:
+            child = f"{partition.split('.')[-1]}_{'_'.join(columns)}"[:63]
+            lines.append(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} ({column_list});")
+            lines.append(f"ALTER INDEX {self.schema}.{name} ATTACH PARTITION {child};")
+        return lines + [""]
+
+
+def _size(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
@@ -0,0 +1,236 @@
+# app/jwt_sessions.py
+"""
+JWT session registry.
+
+Issued tokens are recorded in ``user_sessions`` (keyed by JTI) through the
+batched writer, so login does not commit for them. Revoked JTIs are mirrored
+in every worker as an exact set fronted by a bloom filter: most tokens are
+not revoked, and for those the check is a few bit tests on the JTI's string
+hash, with no query and no Redis round trip.
+
+Workers stay in sync through the cache: the revocation list is a cached
+value (loaded from ``user_sessions``) that is invalidated over Redis pub/sub
+whenever a token is revoked, and reloaded at least every
+``JWT_REVOCATION_REFRESH`` seconds.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from .batch_writer import BatchInsertWriter
+
+logger = logging.getLogger(__name__)
+
+REVOKED_KEY = 'revoked'
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings, using Python's cached str hash"""
+
+    def __init__(self, capacity=10000, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, value):
+        h = hash(value)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.size
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, value):
+        h = hash(value)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits = self.bits
+        size = self.size
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % size
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+def token_fingerprint(encoded_token):
+    """What ``user_sessions.token`` stores: a digest, never the bearer token itself"""
+    return hashlib.sha256(encoded_token.encode('utf-8')).hexdigest()
+
+
+class SessionRegistry:
+    """Flask extension recording issued JWTs and answering revocation checks"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.refresh_interval = 60
+        self.purge_batch_size = 1000
+        self._namespace = None
+        self._snapshot = None
+        self._loaded_at = 0
+        self._bloom = BloomFilter(1)
+        self._revoked = frozenset()
+        self._local = {}
+        self._lock = threading.Lock()
+        self.writer = BatchInsertWriter('user_sessions', self._sessions_table)
+        self.counters = {'issued': 0, 'revoked': 0, 'bloom_hits': 0, 'rejected': 0, 'purged': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JWT_SESSION_REGISTRY_ENABLED', True)
+        app.config.setdefault('JWT_REVOCATION_REFRESH', 60)
+        app.config.setdefault('JWT_SESSION_FLUSH_MS', 500)
+        app.config.setdefault('JWT_SESSION_PURGE_BATCH', 1000)
+
+        self.enabled = app.config['JWT_SESSION_REGISTRY_ENABLED']
+        self.refresh_interval = app.config['JWT_REVOCATION_REFRESH']
+        self.purge_batch_size = app.config['JWT_SESSION_PURGE_BATCH']
+        self.writer.init_app(app, flush_interval=app.config['JWT_SESSION_FLUSH_MS'] / 1000.0)
+
+        cache = app.extensions['cache']
+        self._namespace = cache.namespace('jwt_sessions', ttl=self.refresh_interval)
+
+        app.extensions['session_registry'] = self
+
+    @staticmethod
+    def _sessions_table():
+        from .models import UserSession
+        return UserSession.__table__
+
+    # ----- issuing -----
+
+    def record(self, encoded_token, decoded, ip_address=None, user_agent=None):
+        """Queue a ``user_sessions`` row for a freshly issued token"""
+        if not self.enabled:
+            return
+        self.writer.submit({
+            'session_id': decoded['jti'],
+            'user_id': int(decoded['sub']),
+            'token_type': decoded.get('type', 'access'),
+            'token': token_fingerprint(encoded_token),
+            'ip_address': ip_address,
+            'user_agent': (user_agent or '')[:500] or None,
+            'expires_at': datetime.fromtimestamp(decoded['exp']),
+            'created_at': datetime.now()
+        })
+        self.counters['issued'] += 1
+
+    # ----- revocation -----
+
+    def load_revoked(self):
+        """Unexpired revoked JTIs with their expiry (epoch seconds)"""
+        from . import db
+        rows = db.session.execute(text(
+            "SELECT session_id, expires_at FROM user_sessions "
+            "WHERE revoked_at IS NOT NULL AND expires_at > :now"
+        ), {'now': datetime.now()})
+        revoked = {}
+        for session_id, expires_at in rows:
+            if isinstance(expires_at, str):
+                expires_at = datetime.fromisoformat(expires_at)
+            revoked[session_id] = expires_at.timestamp()
+        return revoked
+
+    def _latest_snapshot(self):
+        if self._namespace.cache.enabled:
+            return self._namespace.get_or_load(REVOKED_KEY, self.load_revoked)
+        # Without the cache, reload on our own schedule rather than per request
+        if self._snapshot is None or time.time() - self._loaded_at > self.refresh_interval:
+            self._loaded_at = time.time()
+            return self.load_revoked()
+        return self._snapshot
+
+    def _current(self):
+        """Bloom filter and exact set for the latest revocation list"""
+        snapshot = self._latest_snapshot()
+        if snapshot is not self._snapshot:
+            with self._lock:
+                if snapshot is not self._snapshot:
+                    now = time.time()
+                    # Keep local revocations until the reloaded list includes them
+                    self._local = {j: exp for j, exp in self._local.items() if exp > now and j not in snapshot}
+                    revoked = set(snapshot) | set(self._local)
+                    bloom = BloomFilter(max(len(revoked) * 2, 1024))
+                    for jti in revoked:
+                        bloom.add(jti)
+                    self._bloom, self._revoked = bloom, frozenset(revoked)
+                    self._snapshot = snapshot
+        return self._bloom, self._revoked
+
+    def is_revoked(self, jti):
+        """Hot-path check used by the JWT blocklist loader"""
+        if not self.enabled:
+            return False
+        bloom, revoked = self._current()
+        if jti not in bloom:
+            return False
+        self.counters['bloom_hits'] += 1
+        if jti in revoked:
+            self.counters['rejected'] += 1
+            return True
+        return False
+
+    def revoke(self, decoded):
+        """Revoke a token now (this worker) and for every worker via the database"""
+        from . import db
+
+        jti = decoded['jti']
+        with self._lock:
+            self._local[jti] = decoded['exp']
+            self._bloom.add(jti)
+            self._revoked = self._revoked | {jti}
+
+        # The issuing row may still be queued
+        self.writer.flush()
+        now = datetime.now()
+        result = db.session.execute(
+            text("UPDATE user_sessions SET revoked_at = :now WHERE session_id = :jti"),
+            {'now': now, 'jti': jti}
+        )
+        if result.rowcount == 0:
+            db.session.execute(self._sessions_table().insert().values(
+                session_id=jti,
+                user_id=int(decoded['sub']),
+                token_type=decoded.get('type', 'access'),
+                token='',
+                expires_at=datetime.fromtimestamp(decoded['exp']),
+                revoked_at=now
+            ))
+        db.session.commit()
+
+        self._namespace.invalidate(REVOKED_KEY)
+        self.counters['revoked'] += 1
+
+    # ----- maintenance -----
+
+    def purge_expired(self, batch_size=None):
+        """Delete expired session rows in batches; returns the number deleted"""
+        from . import db
+
+        batch_size = batch_size or self.purge_batch_size
+        total = 0
+        while True:
+            with db.engine.begin() as conn:
+                deleted = conn.execute(text(
+                    "DELETE FROM user_sessions WHERE session_id IN ("
+                    "SELECT session_id FROM user_sessions WHERE expires_at < :now LIMIT :limit)"
+                ), {'now': datetime.now(), 'limit': batch_size}).rowcount
+            total += deleted
+            if deleted < batch_size:
+                break
+        self.counters['purged'] += total
+        return total
+
+    def stats(self):
+        return {
+            **self.counters,
+            'revoked_tracked': len(self._revoked),
+            'sessions_queued': self.writer.queued(),
+            'sessions_written': self.writer.written,
+            'sessions_dropped': self.writer.dropped
+        }
@@ -0,0 +1,302 @@
+# app/location_ingest.py
+"""
+Driver GPS ingestion.
+
+Driver apps report a position every few seconds. Committing each ping as an
+UPDATE of the ``drivers`` row (a full row version, its updated_at trigger
+and every index on the table) made GPS the largest write load, so pings go
+through ``LocationIngestor`` instead:
+
+- ``record()`` keeps the newest ping per driver in ``LatestPositions``, an
+  in-process store; nothing is written on the request path
+- every ``LOCATION_FLUSH_SECONDS`` a background thread writes the drivers
+  whose position changed since the last flush as one multi-row upsert into
+  ``driver_positions``: one narrow row per driver, no secondary index, so
+  the updates stay HOT. A driver pinging five times between flushes costs
+  one row version
+- the upsert only moves a position forward in time (``recorded_at`` guard),
+  so late, replayed or out-of-order pings are dropped
+
+``positions()`` reads the table and overlays this worker's newer,
+not yet flushed pings; other workers flush theirs within the interval.
+``drivers.current_location`` is no longer written: readers use
+``positions()`` (or join ``driver_positions`` in SQL) and only fall back to
+it for drivers that have not pinged since.
+
+Every accepted ping, stale or not, also goes to the driver's track
+(``TrackRecorder`` in app/driver_tracks.py); the same flush writes the
+segments that are due to ``driver_locations``.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .driver_tracks import TrackRecorder
+
+logger = logging.getLogger(__name__)
+
+# Pings stamped further ahead than this are rejected (device clocks drift)
+MAX_CLOCK_SKEW = timedelta(minutes=1)
+# Oldest ping accepted, for apps sending what they buffered offline
+MAX_PING_AGE = timedelta(hours=24)
+
+# Most pings one batch request may carry
+PING_BATCH_LIMIT = 500
+
+_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _number(data, field, low, high, required=False):
+    value = data.get(field)
+    if value is None:
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number")
+    if not low <= value <= high:
+        raise ValueError(f"{field} must be between {low} and {high}")
+    return value
+
+
+def _timestamp(value, now):
+    if value is None:
+        return now
+    if isinstance(value, (int, float)):
+        # Epoch seconds, or milliseconds as most devices send
+        try:
+            return datetime.utcfromtimestamp(value / 1000 if value > 1e11 else value)
+        except (OverflowError, OSError):
+            raise ValueError("recorded_at is out of range")
+    try:
+        stamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("recorded_at must be an ISO timestamp or epoch seconds")
+    if stamp.tzinfo is not None:
+        stamp = (stamp - stamp.utcoffset()).replace(tzinfo=None)
+    return stamp
+
+
+def parse_ping(data, driver_id, now=None):
+    """Validated ping dict for ``driver_id`` from request data; raises ValueError"""
+    now = now or datetime.utcnow()
+    if 'latitude' not in data and data.get('location'):
+        # Older clients send "lat,lng" in location
+        parts = str(data['location']).split(',')
+        if len(parts) == 2:
+            data = {**data, 'latitude': parts[0], 'longitude': parts[1]}
+    recorded_at = _timestamp(data.get('recorded_at'), now)
+    if recorded_at > now + MAX_CLOCK_SKEW:
+        raise ValueError("recorded_at is in the future")
+    if recorded_at < now - MAX_PING_AGE:
+        raise ValueError("recorded_at is too old")
+    heading = _number(data, 'heading', 0, 360)
+    return {
+        'driver_id': driver_id,
+        'latitude': _number(data, 'latitude', -90, 90, required=True),
+        'longitude': _number(data, 'longitude', -180, 180, required=True),
+        'accuracy': _number(data, 'accuracy', 0, 100000),
+        'speed': _number(data, 'speed', 0, 500),
+        'heading': int(heading) % 360 if heading is not None else None,
+        'recorded_at': recorded_at,
+    }
+
+
+def location_text(position, fallback=None):
+    """``position`` as the "lat,lng" string drivers.current_location used to hold"""
+    if position is None:
+        return fallback
+    return f"{float(position['latitude'])},{float(position['longitude'])}"
+
+
+# ============================================
+# LATEST POSITIONS (in process)
+# ============================================
+class LatestPositions:
+    """Newest ping per driver, and the ones not flushed yet"""
+
+    def __init__(self):
+        self._positions = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def update(self, ping):
+        """Keep ``ping`` if it is the driver's newest; returns whether it was"""
+        with self._lock:
+            current = self._positions.get(ping['driver_id'])
+            if current is not None and current['recorded_at'] >= ping['recorded_at']:
+                return False
+            self._positions[ping['driver_id']] = ping
+            self._dirty[ping['driver_id']] = ping
+            return True
+
+    def get(self, driver_id):
+        return self._positions.get(driver_id)
+
+    def drain(self):
+        """Pings changed since the last drain"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return list(dirty.values())
+
+    def restore(self, pings):
+        """Put back pings a failed flush did not write, unless newer ones arrived"""
+        with self._lock:
+            for ping in pings:
+                pending = self._dirty.get(ping['driver_id'])
+                if pending is None or pending['recorded_at'] < ping['recorded_at']:
+                    self._dirty[ping['driver_id']] = ping
+
+    def pending(self):
+        return len(self._dirty)
+
+    def __len__(self):
+        return len(self._positions)
+
+
+# ============================================
+# INGESTION
+# ============================================
+class LocationIngestor:
+    """Flask extension: GPS pings kept in memory and flushed as coalesced upserts"""
+
+    def __init__(self, app=None, db=None):
+        self.flush_interval = 3.0
+        self.store = LatestPositions()
+        self.tracks = TrackRecorder()
+        self.counters = {'received': 0, 'stale': 0, 'flushes': 0, 'written': 0, 'segments': 0, 'failed': 0}
+        self.last_flush = None
+        self.last_error = None
+        self._db = None
+        self._app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('LOCATION_FLUSH_SECONDS', 3.0)
+        app.config.setdefault('TRACK_SEGMENT_SECONDS', 60)
+        app.config.setdefault('TRACK_TOLERANCE_M', 8.0)
+
+        self.flush_interval = app.config['LOCATION_FLUSH_SECONDS']
+        self.tracks = TrackRecorder(app.config['TRACK_SEGMENT_SECONDS'], app.config['TRACK_TOLERANCE_M'])
+        self._db = db
+        self._app = app
+        atexit.register(self.flush, force=True)
+
+        app.extensions['locations'] = self
+
+    @staticmethod
+    def _table():
+        from .models import DriverPosition
+        return DriverPosition.__table__
+
+    @staticmethod
+    def _track_table():
+        from .models import DriverLocation
+        return DriverLocation.__table__
+
+    def record(self, pings):
+        """Take validated pings (see ``parse_ping``); returns how many were the newest for their driver"""
+        self._ensure_thread()
+        fresh = sum(self.store.update(ping) for ping in sorted(pings, key=lambda ping: ping['recorded_at']))
+        self.tracks.add(pings)
+        self.counters['received'] += len(pings)
+        self.counters['stale'] += len(pings) - fresh
+        return fresh
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='location-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self, force=False):
+        """Upsert the positions changed since the last flush and write the track segments due
+        (all buffered ones when ``force``); returns positions written"""
+        with self._flush_lock:
+            pings = self.store.drain()
+            segments = self.tracks.cut(force)
+            if not pings and not segments:
+                return 0
+            try:
+                with self._app.app_context():
+                    with self._db.engine.begin() as conn:
+                        if pings:
+                            self._upsert_positions(conn, pings)
+                        if segments:
+                            insert = _INSERTS[conn.dialect.name](self._track_table())
+                            conn.execute(insert.values([row for row, _ in segments]).on_conflict_do_nothing())
+            except Exception as e:
+                self.store.restore(pings)
+                self.tracks.restore(segments)
+                self.counters['failed'] += 1
+                self.last_error = str(e)
+                logger.error(f"Flushing {len(pings)} driver positions and {len(segments)} track segments failed: {e}")
+                return 0
+            self.tracks.count(segments)
+            self.counters['flushes'] += 1
+            self.counters['written'] += len(pings)
+            self.counters['segments'] += len(segments)
+            self.last_flush = datetime.utcnow()
+            self.last_error = None
+            return len(pings)
+
+    def _upsert_positions(self, conn, pings):
+        table = self._table()
+        statement = _INSERTS[conn.dialect.name](table).values(
+            [{**ping, 'received_at': datetime.utcnow()} for ping in pings])
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.driver_id],
+            set_={column: statement.excluded[column]
+                  for column in ('latitude', 'longitude', 'accuracy', 'speed', 'heading',
+                                 'recorded_at', 'received_at')},
+            where=statement.excluded.recorded_at > table.c.recorded_at))
+
+    # ----- reads -----
+
+    def positions(self, driver_ids):
+        """driver_id -> newest known ping (flushed by any worker or pending here)"""
+        table = self._table()
+        driver_ids = list(driver_ids)
+        found = {row.driver_id: dict(row._mapping) for row in self._db.session.execute(
+            select(table).where(table.c.driver_id.in_(driver_ids)))} if driver_ids else {}
+        for driver_id in driver_ids:
+            ping = self.store.get(driver_id)
+            if ping is not None and (driver_id not in found or found[driver_id]['recorded_at'] < ping['recorded_at']):
+                found[driver_id] = ping
+        return found
+
+    def position(self, driver_id):
+        return self.positions([driver_id]).get(driver_id)
+
+    def stats(self):
+        return {
+            'flush_interval': self.flush_interval,
+            'drivers': len(self.store),
+            'pending': self.store.pending(),
+            **self.counters,
+            'track_buffered': self.tracks.buffered(),
+            'track_points_in': self.tracks.points_in,
+            'track_points_kept': self.tracks.points_kept,
+            'last_flush': self.last_flush.isoformat() if self.last_flush else None,
+            'last_error': self.last_error
+        }
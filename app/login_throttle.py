@@ -0,0 +1,201 @@
+# app/login_throttle.py
+"""
+Login guard: sliding-window throttling of failed logins and batched
+recording of every attempt in ``login_attempts``.
+
+Failures are counted per username and per client IP over a sliding window,
+in Redis when the cache has a Redis tier (so all workers share the counts)
+and in process memory otherwise. The check runs before any bcrypt work, so
+credential stuffing is refused without spending CPU on it.
+
+Attempt rows are queued and written by a background thread as multi-row
+INSERTs every ``LOGIN_ATTEMPT_FLUSH_MS``; the login request never commits
+for them.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from .batch_writer import BatchInsertWriter
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# SLIDING WINDOW COUNTERS
+# ============================================
+class MemoryWindow:
+    """Per-key timestamps of recent events, bounded in number of keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now, window):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def count(self, key, now, window):
+        """(events in window, oldest event time or None)"""
+        with self._lock:
+            events = self._prune(key, now, window)
+            if not events:
+                return 0, None
+            return len(events), events[0]
+
+    def add(self, key, now, window):
+        with self._lock:
+            events = self._prune(key, now, window)
+            if events is None:
+                events = self._events[key] = deque()
+            events.append(now)
+            self._events.move_to_end(key)
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+
+class RedisWindow:
+    """Same counters in Redis sorted sets, shared by every worker"""
+
+    def __init__(self, client, prefix='megapizza'):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f'{self.prefix}:login:{key}'
+
+    def count(self, key, now, window):
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self._key(key), 0, now - window)
+        pipe.zcard(self._key(key))
+        pipe.zrange(self._key(key), 0, 0, withscores=True)
+        _, count, oldest = pipe.execute()
+        return count, (oldest[0][1] if oldest else None)
+
+    def add(self, key, now, window):
+        pipe = self.client.pipeline()
+        pipe.zadd(self._key(key), {f'{now}:{uuid.uuid4().hex[:8]}': now})
+        pipe.pexpire(self._key(key), int(window * 1000))
+        pipe.execute()
+
+    def reset(self, key):
+        self.client.delete(self._key(key))
+
+
+# ============================================
+# GUARD
+# ============================================
+class LoginGuard:
+    """Flask extension: throttle check before bcrypt, attempt recording after"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.window = 300
+        self.user_limit = 5
+        self.ip_limit = 20
+        self.memory = MemoryWindow()
+        self.redis = None
+        self.writer = BatchInsertWriter('login_attempts', self._attempts_table)
+        self.counters = {'allowed': 0, 'throttled': 0, 'redis_errors': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, redis_client=None):
+        app.config.setdefault('LOGIN_GUARD_ENABLED', True)
+        app.config.setdefault('LOGIN_GUARD_WINDOW', 300)
+        app.config.setdefault('LOGIN_GUARD_USER_LIMIT', 5)
+        app.config.setdefault('LOGIN_GUARD_IP_LIMIT', 20)
+        app.config.setdefault('LOGIN_ATTEMPT_FLUSH_MS', 500)
+
+        self.enabled = app.config['LOGIN_GUARD_ENABLED']
+        self.window = app.config['LOGIN_GUARD_WINDOW']
+        self.user_limit = app.config['LOGIN_GUARD_USER_LIMIT']
+        self.ip_limit = app.config['LOGIN_GUARD_IP_LIMIT']
+        self.writer.init_app(app, flush_interval=app.config['LOGIN_ATTEMPT_FLUSH_MS'] / 1000.0)
+
+        if redis_client is None:
+            cache = app.extensions.get('cache')
+            if cache is not None and cache.backend is not None:
+                redis_client = cache.backend.client
+        if redis_client is not None:
+            self.redis = RedisWindow(redis_client, prefix=app.config.get('CACHE_KEY_PREFIX', 'megapizza'))
+
+        app.extensions['login_guard'] = self
+
+    @staticmethod
+    def _attempts_table():
+        from .models import LoginAttempt
+        return LoginAttempt.__table__
+
+    def _keys(self, username, ip_address):
+        return [
+            (f'user:{(username or "").strip().lower()}', self.user_limit),
+            (f'ip:{ip_address}', self.ip_limit),
+        ]
+
+    def _call(self, method, *args):
+        if self.redis is not None:
+            try:
+                return getattr(self.redis, method)(*args)
+            except Exception as e:
+                self.counters['redis_errors'] += 1
+                logger.warning(f"Login guard falling back to memory: {e}")
+        return getattr(self.memory, method)(*args)
+
+    def check(self, username, ip_address):
+        """Seconds to wait before another attempt is allowed, or 0"""
+        if not self.enabled:
+            return 0
+
+        now = time.time()
+        retry_after = 0
+        for key, limit in self._keys(username, ip_address):
+            count, oldest = self._call('count', key, now, self.window)
+            if count >= limit:
+                retry_after = max(retry_after, int(oldest + self.window - now) + 1)
+
+        self.counters['throttled' if retry_after else 'allowed'] += 1
+        return retry_after
+
+    def record(self, username, ip_address, success, user=None, user_agent=None):
+        """Count a failure towards the windows and queue the attempt row"""
+        if self.enabled:
+            now = time.time()
+            if success:
+                self._call('reset', self._keys(username, ip_address)[0][0])
+            else:
+                for key, _ in self._keys(username, ip_address):
+                    self._call('add', key, now, self.window)
+
+        self.writer.submit({
+            'user_id': user.user_id if user is not None else None,
+            'username': (username or '')[:50],
+            'ip_address': ip_address,
+            'user_agent': (user_agent or '')[:500] or None,
+            'success': bool(success),
+            'attempted_at': datetime.now()
+        })
+
+    def stats(self):
+        return {
+            **self.counters,
+            'backend': 'redis' if self.redis is not None else 'memory',
+            'attempts_written': self.writer.written,
+            'attempts_dropped': self.writer.dropped,
+            'attempts_queued': self.writer.queued()
+        }
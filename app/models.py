@@ -1,5 +1,9 @@
+from flask import current_app
 from flask_login import UserMixin
 from . import db, bcrypt
+from .business_days import LocalDate, business_day_bounds
+from .partitions import order_created_range
+from sqlalchemy import and_, or_, true, select, event, text, literal_column
 from datetime import datetime
 import time as time_module
 import json
@@ -89,19 +93,47 @@ class Restaurant(db.Model):
     
     # Relationships
     menu_items = db.relationship('MenuItem', backref='restaurant', lazy=True, cascade='all, delete-orphan')
+    hours = db.relationship('RestaurantHours', backref='restaurant', lazy=True, cascade='all, delete-orphan')
     
-    def is_open_now(self):
-        """Check if restaurant is open now"""
+    def is_open_now(self, now=None):
+        """Check if restaurant is open now (weekly hours in the business timezone)"""
         if not self.is_open:
             return False
         
-        now = datetime.now().time()
-        return self.opening_time <= now <= self.closing_time
+        from .restaurant_directory import schedule_for
+        return schedule_for(self).is_open_at(now)
     
     def __repr__(self):
         return f'<Restaurant {self.name}>'
 
 
+class RestaurantHours(db.Model):
+    __tablename__ = 'restaurant_hours'
+    
+    hours_id = db.Column(db.Integer, primary_key=True)
+    restaurant_id = db.Column(db.String(20), db.ForeignKey('restaurants.restaurant_id', ondelete='CASCADE'), nullable=False)
+    day_of_week = db.Column(db.SmallInteger, nullable=False)  # 0 = Monday
+    opens_at = db.Column(db.Time, nullable=False)
+    closes_at = db.Column(db.Time, nullable=False)  # not after opens_at = runs past midnight
+    
+    def __repr__(self):
+        return f'<RestaurantHours {self.restaurant_id} {self.day_of_week} {self.opens_at}-{self.closes_at}>'
+
+
+class RestaurantHoliday(db.Model):
+    __tablename__ = 'restaurant_holidays'
+    
+    holiday_id = db.Column(db.Integer, primary_key=True)
+    restaurant_id = db.Column(db.String(20), db.ForeignKey('restaurants.restaurant_id', ondelete='CASCADE'))  # NULL = all restaurants
+    holiday_date = db.Column(db.Date, nullable=False)
+    name = db.Column(db.String(100))
+    opens_at = db.Column(db.Time)  # NULL = closed all day
+    closes_at = db.Column(db.Time)
+    
+    def __repr__(self):
+        return f'<RestaurantHoliday {self.restaurant_id} {self.holiday_date}>'
+
+
 # ============================================
 # DRIVER MODEL
 # ============================================
@@ -157,6 +189,13 @@ class Driver(db.Model):
         else:
             return 'Off Duty'
     
+    @property
+    def last_location(self):
+        """Newest GPS fix as "lat,lng"; current_location is only the pre-driver_positions value"""
+        from . import locations
+        from .location_ingest import location_text
+        return location_text(locations.position(self.driver_id), self.current_location)
+    
     def calculate_rating_stars(self):
         if not self.rating:
             return ''
@@ -181,6 +220,41 @@ class Driver(db.Model):
         return f'<Driver {self.user.username if self.user else "No User"}>'
 
 
+class DriverPosition(db.Model):
+    """Latest GPS fix per driver, upserted in batches (see app/location_ingest.py)"""
+    __tablename__ = 'driver_positions'
+    
+    driver_id = db.Column(db.Integer, primary_key=True)
+    latitude = db.Column(db.Numeric(9, 6), nullable=False)
+    longitude = db.Column(db.Numeric(9, 6), nullable=False)
+    accuracy = db.Column(db.Float)  # metres
+    speed = db.Column(db.Float)  # km/h
+    heading = db.Column(db.SmallInteger)  # degrees
+    recorded_at = db.Column(db.DateTime, nullable=False)  # device time of the fix
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DriverPosition {self.driver_id} {self.latitude},{self.longitude}>'
+
+
+class DriverLocation(db.Model):
+    """Compressed segment of a driver's GPS track, partitioned by day (see app/driver_tracks.py)"""
+    __tablename__ = 'driver_locations'
+    
+    driver_id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, primary_key=True)  # first fix, partition key
+    ended_at = db.Column(db.DateTime, nullable=False)  # last fix
+    points = db.Column(db.SmallInteger, nullable=False)  # fixes stored
+    raw_points = db.Column(db.SmallInteger, nullable=False)  # fixes received
+    start_lat = db.Column(db.Integer, nullable=False)  # microdegrees
+    start_lng = db.Column(db.Integer, nullable=False)
+    deltas = db.Column(db.LargeBinary, nullable=False)  # zigzag varint (ms, lat, lng) deltas
+    resolution = db.Column(db.SmallInteger, nullable=False, default=0)  # seconds per fix once downsampled
+    
+    def __repr__(self):
+        return f'<DriverLocation {self.driver_id} {self.started_at} {self.points} fixes>'
+
+
 # ============================================
 # CUSTOMER MODEL
 # ============================================
@@ -251,6 +325,14 @@ class MenuItem(db.Model):
 # ============================================
 # ORDER MODEL
 # ============================================
+TERMINAL_ORDER_STATUSES = ('delivered', 'cancelled')
+ACTIVE_ORDER_STATUSES = ('pending', 'confirmed', 'preparing', 'ready', 'out_for_delivery')
+
+# Predicate of the partial "active orders" indexes. Queries must repeat it
+# with the constants inline for the planner to use them: Order.active().
+ACTIVE_ORDER_PREDICATE = "order_status NOT IN ('delivered', 'cancelled')"
+
+
 class Order(db.Model):
     __tablename__ = 'orders'
     
@@ -288,11 +370,37 @@ class Order(db.Model):
     estimated_delivery = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    status_changed_at = db.Column(db.DateTime, default=datetime.utcnow)  # last transition (see app/order_transitions.py)
+    
+    # Restaurant-local day of created_at, generated by the database (see app/business_days.py)
+    business_date = db.Column(db.Date, db.Computed(LocalDate('created_at'), persisted=True))
+    
+    __table_args__ = (
+        db.Index('idx_orders_status_created', 'order_status', 'created_at'),
+        db.Index('idx_orders_restaurant_created', 'restaurant_id', 'created_at'),
+        # Open orders are a small slice of the table: boards and counters read these
+        db.Index('idx_orders_active', 'order_status', 'created_at',
+                 postgresql_include=['restaurant_id', 'driver_id', 'total_amount'],
+                 postgresql_where=text(ACTIVE_ORDER_PREDICATE), sqlite_where=text(ACTIVE_ORDER_PREDICATE)),
+        db.Index('idx_orders_active_restaurant', 'restaurant_id', 'created_at',
+                 postgresql_include=['order_status'],
+                 postgresql_where=text(ACTIVE_ORDER_PREDICATE), sqlite_where=text(ACTIVE_ORDER_PREDICATE)),
+        db.Index('idx_orders_active_driver', 'driver_id', 'created_at',
+                 postgresql_include=['order_status'],
+                 postgresql_where=text(ACTIVE_ORDER_PREDICATE), sqlite_where=text(ACTIVE_ORDER_PREDICATE)),
+        db.Index('idx_orders_business_date', 'business_date',
+                 postgresql_include=['created_at', 'order_status', 'total_amount']),
+        db.Index('idx_orders_restaurant_business_date', 'restaurant_id', 'business_date',
+                 postgresql_include=['created_at', 'order_status', 'total_amount']),
+    )
     
     # Relationships
     order_items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     status_history = db.relationship('OrderStatusHistory', backref='order', lazy=True, cascade='all, delete-orphan')
     
+    # Live row; OrderArchive holds the closed orders moved out by the archiver
+    archived = False
+    
     def __repr__(self):
         return f'<Order {self.order_id} - {self.order_status}>'
     
@@ -307,6 +415,64 @@ class Order(db.Model):
             'cancelled': 'danger'
         }
         return status_classes.get(self.order_status, 'secondary')
+    
+    # Partition-friendly filters: orders are partitioned by month on created_at
+    # (see app/partitions.py), and Postgres only skips partitions when the
+    # query constrains created_at
+    
+    @classmethod
+    def created_window(cls, order_id):
+        """created_at range implied by the order id (no restriction for ids without a timestamp)"""
+        bounds = order_created_range(order_id)
+        if bounds is None:
+            return true()
+        return and_(cls.created_at >= bounds[0], cls.created_at < bounds[1])
+    
+    @classmethod
+    def created_span(cls, order_ids):
+        """created_at range covering the windows of all ``order_ids`` (no restriction if one has none)"""
+        bounds = [order_created_range(order_id) for order_id in order_ids]
+        if not bounds or None in bounds:
+            return true()
+        return and_(cls.created_at >= min(lower for lower, _ in bounds),
+                    cls.created_at < max(upper for _, upper in bounds))
+    
+    @classmethod
+    def by_id(cls, order_id):
+        """Order by id, searching only the partitions its id points at"""
+        order = cls.query.filter(cls.order_id == order_id, cls.created_window(order_id)).first()
+        if order is None and order_created_range(order_id) is not None \
+                and current_app.config.get('ORDER_LOOKUP_ALL_PARTITIONS'):
+            # Imported or hand-made ids whose timestamp does not match created_at;
+            # off by default since every miss then scans all partitions
+            order = cls.query.filter(cls.order_id == order_id).first()
+        return order
+    
+    @classmethod
+    def active(cls, *statuses):
+        """Open orders (optionally only ``statuses``), matching the partial indexes' predicate"""
+        # Literal constants: a bound parameter would not prove the index predicate
+        # once statements are prepared server-side
+        predicate = cls.order_status.not_in([literal_column(f"'{status}'") for status in TERMINAL_ORDER_STATUSES])
+        if statuses:
+            return and_(predicate, cls.order_status.in_(statuses))
+        return predicate
+    
+    @classmethod
+    def active_orders(cls, *statuses, restaurant_id=None, driver_id=None):
+        """Open orders, oldest first, through idx_orders_active*"""
+        query = cls.query.filter(cls.active(*statuses))
+        if restaurant_id is not None:
+            query = query.filter(cls.restaurant_id == restaurant_id)
+        if driver_id is not None:
+            query = query.filter(cls.driver_id == driver_id)
+        return query.order_by(cls.created_at)
+    
+    @classmethod
+    def on_business_days(cls, start, end=None):
+        """Orders of local days start..end, with the created_at range that prunes partitions"""
+        lower, upper = business_day_bounds(start, end)
+        return and_(cls.business_date.between(start, end or start), cls.created_at >= lower, cls.created_at < upper)
 
 
 # ============================================
@@ -322,6 +488,13 @@ class OrderItem(db.Model):
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
     customizations = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    order_created_at = db.Column(db.DateTime)  # the order's created_at, partition key
+    
+    @classmethod
+    def for_order(cls, order):
+        """Items of ``order``, read from its partition only"""
+        return cls.query.filter(cls.order_id == order.order_id, or_(
+            cls.order_created_at == order.created_at, cls.order_created_at.is_(None)))
     
     def calculate_total(self):
         """Calculate total price for this item"""
@@ -334,15 +507,34 @@ class OrderItem(db.Model):
 # ============================================
 # ORDER STATUS HISTORY MODEL
 # ============================================
+def _audit_column(name):
+    """Audit field kept in order_status_audit, set and read like a column (see app/order_history.py)"""
+    def get(self):
+        if self.pending_audit and name in self.pending_audit:
+            return self.pending_audit[name]
+        return getattr(self.audit, name) if self.audit is not None else None
+    
+    def set(self, value):
+        self.pending_audit = {**(self.pending_audit or {}), name: value}
+    
+    return property(get, set)
+
 
 # ============================================
 # ORDER STATUS HISTORY MODEL (UPDATED TO MATCH DATABASE)
 # ============================================
 class OrderStatusHistory(db.Model):
+    """Append-only log of status changes; the hot columns only"""
     __tablename__ = 'order_status_history'
+    __table_args__ = (
+        db.Index('idx_order_status_history_timeline', 'order_id', 'changed_at'),
+        db.Index('idx_order_status_history_changed_at_brin', 'changed_at',
+                 postgresql_using='brin', postgresql_with={'pages_per_range': 32}),
+    )
     
     history_id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(30), db.ForeignKey('orders.order_id'), nullable=False)
+    order_created_at = db.Column(db.DateTime)  # the order's created_at, partition key
     
     # Status Information
     old_status = db.Column(db.String(20))
@@ -364,7 +556,6 @@ class OrderStatusHistory(db.Model):
     
     # Notes & Details
     public_notes = db.Column(db.Text)  # ✅ This is what you should use instead of 'notes'
-    internal_notes = db.Column(db.Text)
     reason_code = db.Column(db.String(50))
     
     # Timestamps
@@ -373,8 +564,6 @@ class OrderStatusHistory(db.Model):
     effective_until = db.Column(db.DateTime)
     
     # Technical Audit
-    ip_address = db.Column(db.String(45))  # INET in PostgreSQL
-    user_agent = db.Column(db.Text)
     source = db.Column(db.String(50), default='web')
     
     # Performance Metrics
@@ -385,9 +574,116 @@ class OrderStatusHistory(db.Model):
     changer = db.relationship('User', backref='status_changes', lazy=True)
     driver = db.relationship('Driver', backref='status_history', lazy=True)
     
+    # Audit text, written to the side table after the row (see app/order_history.py)
+    audit = db.relationship('OrderStatusAudit', uselist=False, viewonly=True, lazy=True,
+                            primaryjoin='OrderStatusHistory.history_id == foreign(OrderStatusAudit.history_id)')
+    pending_audit = None
+    internal_notes = _audit_column('internal_notes')
+    ip_address = _audit_column('ip_address')
+    user_agent = _audit_column('user_agent')
+    
+    @classmethod
+    def for_order(cls, order):
+        """History of ``order``, read from its partition only"""
+        return cls.query.filter(cls.order_id == order.order_id, or_(
+            cls.order_created_at == order.created_at, cls.order_created_at.is_(None)))
+    
     def __repr__(self):
         return f'<OrderStatusHistory {self.old_status} -> {self.new_status}>'
 
+
+class OrderStatusAudit(db.Model):
+    """Audit text of a status change, out of the hot history rows; no foreign keys, BRIN only"""
+    __tablename__ = 'order_status_audit'
+    __table_args__ = (
+        db.Index('idx_order_status_audit_brin', 'history_id', 'order_created_at', postgresql_using='brin'),
+    )
+    
+    history_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.String(30), nullable=False)
+    order_created_at = db.Column(db.DateTime)
+    internal_notes = db.Column(db.Text)
+    ip_address = db.Column(db.String(45))  # INET in PostgreSQL
+    user_agent = db.Column(db.Text)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<OrderStatusAudit {self.history_id}>'
+
+
+# ============================================
+# ORDER ARCHIVE MODELS (see app/archive.py)
+# ============================================
+def _archive_table(live, name, *extra):
+    """Copy of ``live``'s columns for the archive tier: no defaults, foreign keys or generated values"""
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key,
+                         nullable=column.nullable, autoincrement=False)
+               for column in live.columns]
+    archived_at = db.Column('archived_at', db.DateTime, default=datetime.utcnow, nullable=False)
+    return db.Table(name, *columns, archived_at, *extra)
+
+
+class OrderArchive(db.Model):
+    """Closed order moved out of the live tables; read-only"""
+    __table__ = _archive_table(
+        Order.__table__, 'orders_archive',
+        db.Index('idx_orders_archive_customer', 'customer_id'),
+        db.Index('idx_orders_archive_restaurant_business_date', 'restaurant_id', 'business_date',
+                 postgresql_include=['order_status', 'total_amount']),
+        db.Index('idx_orders_archive_business_date', 'business_date',
+                 postgresql_include=['created_at', 'order_status', 'total_amount']),
+    )
+    archived = True
+    
+    get_status_badge_class = Order.get_status_badge_class
+    
+    @classmethod
+    def by_id(cls, order_id):
+        return cls.query.get(order_id)
+    
+    def __repr__(self):
+        return f'<OrderArchive {self.order_id} - {self.order_status}>'
+
+
+class OrderItemArchive(db.Model):
+    __table__ = _archive_table(OrderItem.__table__, 'order_items_archive',
+                               db.Index('idx_order_items_archive_order', 'order_id'))
+    
+    @classmethod
+    def for_order(cls, order):
+        return cls.query.filter(cls.order_id == order.order_id)
+
+
+class OrderStatusHistoryArchive(db.Model):
+    __table__ = _archive_table(OrderStatusHistory.__table__, 'order_status_history_archive',
+                               db.Index('idx_order_history_archive_order', 'order_id'))
+    
+    @classmethod
+    def for_order(cls, order):
+        return cls.query.filter(cls.order_id == order.order_id)
+
+
+class OrderStatusAuditArchive(db.Model):
+    __table__ = _archive_table(OrderStatusAudit.__table__, 'order_status_audit_archive')
+
+
+@event.listens_for(OrderItem, 'before_insert')
+@event.listens_for(OrderStatusHistory, 'before_insert')
+def _fill_order_created_at(mapper, connection, target):
+    """Copy the order's created_at into the child row, which is partitioned on it"""
+    if target.order_created_at is not None:
+        return
+    order = target.__dict__.get('order')
+    if order is not None and order.created_at is not None:
+        target.order_created_at = order.created_at
+        return
+    created_at = connection.execute(
+        select(Order.created_at).where(Order.order_id == target.order_id, Order.created_window(target.order_id))
+    ).scalar()
+    if created_at is None:
+        created_at = connection.execute(select(Order.created_at).where(Order.order_id == target.order_id)).scalar()
+    target.order_created_at = created_at
+
 # ============================================
 # AUTHENTICATION MODELS
 # ============================================
@@ -396,6 +692,7 @@ class LoginAttempt(db.Model):
     
     attempt_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    username = db.Column(db.String(50))  # as typed, also for unknown users
     ip_address = db.Column(db.String(45))  # IPv4 or IPv6
     user_agent = db.Column(db.Text)
     success = db.Column(db.Boolean)
@@ -407,12 +704,14 @@ class LoginAttempt(db.Model):
 class UserSession(db.Model):
     __tablename__ = 'user_sessions'
     
-    session_id = db.Column(db.String(128), primary_key=True)
+    session_id = db.Column(db.String(128), primary_key=True)  # JWT jti
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
-    token = db.Column(db.Text, nullable=False)
+    token_type = db.Column(db.String(10), default='access')
+    token = db.Column(db.Text, nullable=False)  # SHA-256 of the token
     ip_address = db.Column(db.String(45))
     user_agent = db.Column(db.Text)
     expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='sessions', lazy=True)
@@ -0,0 +1,269 @@
+# app/order_history.py
+"""
+Order status history storage.
+
+``order_status_history`` is an append-only log: a status change inserts a
+row and nothing updates it afterwards. To keep that insert cheap the hot
+table holds only what timelines and reports read, and is indexed for
+exactly those (see db/init.sql):
+
+- one B-tree on (order_id, changed_at), which serves the track_order and
+  order detail timelines in order without a sort
+- a BRIN index on changed_at for time-range scans; rows arrive in
+  changed_at order, so a few hundred bytes cover a month of history
+- no foreign keys on the actor or driver, which would turn deleting a user
+  into an UPDATE of the log
+
+The wide audit text of a change (staff notes, client IP, user agent) lives
+in ``order_status_audit``, a side table with no foreign keys and a single
+BRIN index. ``OrderStatusHistory.internal_notes`` / ``ip_address`` /
+``user_agent`` are still set as before; ``OrderHistoryStore`` collects them
+as the history rows are inserted and writes them as one multi-row INSERT in
+the same flush, so they commit or roll back with the status change. With
+``ORDER_AUDIT_WRITE_BEHIND`` they are queued after commit on a
+``BatchInsertWriter`` instead, which takes the insert off the transaction
+but loses the queued rows on a crash, a restart or a full queue.
+
+``HistoryCompactor`` (``flask compact-history``, run from cron) moves audit
+text still stored inline by older versions to the side table, summarizes
+new BRIN ranges and freezes closed monthly partitions once, so
+anti-wraparound vacuums do not rewrite them later.
+"""
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import object_session
+
+from .batch_writer import BatchInsertWriter
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FIELDS = ('internal_notes', 'ip_address', 'user_agent')
+
+# BRIN indexes the compactor summarizes
+BRIN_INDEXES = ('idx_order_status_history_changed_at_brin', 'idx_order_status_audit_brin')
+
+
+# ============================================
+# AUDIT SIDE TABLE WRITES
+# ============================================
+def audit_row(history_id, order_id, order_created_at, values):
+    """order_status_audit row for a history row; ``values`` holds the AUDIT_FIELDS given"""
+    return {
+        'history_id': history_id,
+        'order_id': order_id,
+        'order_created_at': order_created_at,
+        **{field: values.get(field) for field in AUDIT_FIELDS},
+        'recorded_at': datetime.utcnow()
+    }
+
+
+class OrderHistoryStore:
+    """Flask extension: batched writes of the audit side table"""
+
+    def __init__(self, app=None, db=None):
+        self.write_behind = False
+        self.writer = BatchInsertWriter('order_status_audit', self._audit_table)
+        self.counters = {'inline': 0, 'queued': 0, 'discarded': 0}
+        self._listening = False
+        if app is not None:
+            self.init_app(app, db)
+
+    @staticmethod
+    def _audit_table():
+        from .models import OrderStatusAudit
+        return OrderStatusAudit.__table__
+
+    def init_app(self, app, db):
+        app.config.setdefault('ORDER_AUDIT_WRITE_BEHIND', False)
+        app.config.setdefault('ORDER_AUDIT_FLUSH_MS', 500)
+
+        self.write_behind = app.config['ORDER_AUDIT_WRITE_BEHIND']
+        self.writer.init_app(app, flush_interval=app.config['ORDER_AUDIT_FLUSH_MS'] / 1000.0)
+
+        if not self._listening:
+            from .models import OrderStatusHistory
+            self._listening = True
+            event.listen(OrderStatusHistory, 'after_insert', self._collect)
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_transaction_end', self._after_transaction_end)
+
+        app.extensions['order_history'] = self
+
+    # ----- session events -----
+
+    def _collect(self, mapper, connection, target):
+        audit = target.pending_audit
+        session = object_session(target)
+        if not audit or session is None or not any(value is not None for value in audit.values()):
+            return
+        session.info.setdefault('order_audit', []).append(
+            audit_row(target.history_id, target.order_id, target.order_created_at, audit))
+
+    def _after_flush(self, session, flush_context):
+        rows = session.info.pop('order_audit', None)
+        if rows:
+            self.add_audit(session, rows)
+
+    def _after_commit(self, session):
+        rows = session.info.pop('order_audit_committed', None)
+        for row in rows or ():
+            self.writer.submit(row)
+        self.counters['queued'] += len(rows or ())
+
+    def _after_transaction_end(self, session, transaction):
+        # Savepoints end inside the transaction; only the outermost one
+        # ending (after its commit was handled, or on rollback) drops rows
+        if transaction.parent is not None:
+            return
+        for key in ('order_audit', 'order_audit_committed'):
+            self.counters['discarded'] += len(session.info.pop(key, None) or ())
+
+    def add_audit(self, session, rows):
+        """Write audit rows for history inserted in ``session``'s transaction (Core inserts call this)"""
+        if self.write_behind:
+            session.info.setdefault('order_audit_committed', []).extend(rows)
+            return
+        session.connection().execute(self._audit_table().insert(), rows)
+        self.counters['inline'] += len(rows)
+
+    def stats(self):
+        return {
+            'write_behind': self.write_behind,
+            'audit_inline': self.counters['inline'],
+            'audit_queued': self.writer.queued(),
+            'audit_written': self.writer.written,
+            'audit_dropped': self.writer.dropped,
+            'audit_discarded': self.counters['discarded']
+        }
+
+
+# ============================================
+# COMPACTION
+# ============================================
+MOVE_INLINE_AUDIT = """
+WITH batch AS (
+    SELECT history_id, order_id, order_created_at, internal_notes, ip_address, user_agent
+    FROM order_status_history
+    WHERE history_id > :after
+      AND (internal_notes IS NOT NULL OR ip_address IS NOT NULL OR user_agent IS NOT NULL)
+    ORDER BY history_id
+    LIMIT :batch_size
+    FOR UPDATE
+), moved AS (
+    INSERT INTO order_status_audit (history_id, order_id, order_created_at, internal_notes, ip_address, user_agent)
+    SELECT history_id, order_id, order_created_at, internal_notes, ip_address, user_agent FROM batch
+    RETURNING history_id
+)
+UPDATE order_status_history h
+SET internal_notes = NULL, ip_address = NULL, user_agent = NULL
+FROM batch
+WHERE h.history_id = batch.history_id AND h.order_created_at IS NOT DISTINCT FROM batch.order_created_at
+RETURNING h.history_id
+"""
+
+# Monthly history partitions before the current month that were written to
+# since their last vacuum or are not frozen yet
+CLOSED_PARTITIONS = """
+SELECT c.relname
+FROM pg_partition_tree('order_status_history') t
+JOIN pg_class c ON c.oid = t.relid
+LEFT JOIN pg_stat_user_tables s ON s.relid = t.relid
+WHERE t.isleaf
+  AND c.relname ~ '_[0-9]{4}_[0-9]{2}$'
+  AND right(c.relname, 7) < :current_month
+  AND (age(c.relfrozenxid) > :min_age OR coalesce(s.n_dead_tup, 0) + coalesce(s.n_mod_since_analyze, 0) > 0)
+ORDER BY c.relname
+"""
+
+
+class HistoryCompactor:
+    """Maintenance of the history tables after the append-only layout"""
+
+    def __init__(self, engine, batch_size=5000, pause=0.05, freeze_min_age=1_000_000, log=print):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.pause = pause
+        self.freeze_min_age = freeze_min_age
+        self.log = log
+
+    def _has_inline_audit(self, conn):
+        return conn.execute(text(
+            "SELECT count(*) FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = 'order_status_history' "
+            "AND column_name IN ('internal_notes', 'ip_address', 'user_agent')"
+        )).scalar() == len(AUDIT_FIELDS)
+
+    def move_inline_audit(self):
+        """Move audit text stored in the history rows by older versions; returns rows moved"""
+        with self.engine.connect() as conn:
+            if not self._has_inline_audit(conn):
+                return 0
+        moved, after = 0, 0
+        while True:
+            with self.engine.begin() as conn:
+                ids = [row[0] for row in conn.execute(
+                    text(MOVE_INLINE_AUDIT), {'after': after, 'batch_size': self.batch_size})]
+            if not ids:
+                break
+            moved += len(ids)
+            after = max(ids)
+            self.log(f"   {moved:>10} history rows moved their audit text")
+            if self.pause:
+                time.sleep(self.pause)
+        return moved
+
+    def summarize(self):
+        """Summarize BRIN ranges filled since the last run; returns ranges summarized"""
+        total = 0
+        with self.engine.begin() as conn:
+            for index in BRIN_INDEXES:
+                if conn.execute(text("SELECT to_regclass(:index)"), {'index': index}).scalar() is None:
+                    continue
+                total += conn.execute(text(
+                    "SELECT coalesce(sum(brin_summarize_new_values(relid)), 0) "
+                    "FROM pg_partition_tree(CAST(:index AS regclass)) WHERE isleaf"
+                ), {'index': index}).scalar()
+        return int(total)
+
+    def freeze(self):
+        """VACUUM (FREEZE, ANALYZE) closed monthly partitions; returns their names"""
+        with self.engine.connect() as conn:
+            partitioned = conn.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = CAST('order_status_history' AS regclass))"
+            )).scalar()
+            if not partitioned:
+                return []
+            names = [row[0] for row in conn.execute(text(CLOSED_PARTITIONS), {
+                'current_month': datetime.utcnow().strftime('%Y_%m'), 'min_age': self.freeze_min_age
+            })]
+        # VACUUM cannot run inside a transaction block
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for name in names:
+                conn.execute(text(f'VACUUM (FREEZE, ANALYZE) "{name}"'))
+                self.log(f"   🧊 {name} frozen")
+        return names
+
+    def run(self, freeze=True):
+        started = time.monotonic()
+        if self.engine.dialect.name != 'postgresql':
+            self.log("ℹ️  History compaction needs PostgreSQL, nothing to do")
+            return {}
+        self.log("🗜️  Compacting order status history")
+        result = {'moved': self.move_inline_audit(), 'summarized': self.summarize(),
+                  'frozen': self.freeze() if freeze else []}
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("VACUUM (ANALYZE) order_status_audit"))
+        self.log(f"✅ {result['moved']} rows moved to order_status_audit, {result['summarized']} BRIN ranges "
+                 f"summarized, {len(result['frozen'])} partitions frozen in {time.monotonic() - started:.1f}s")
+        if result['moved']:
+            self.log("ℹ️  Nothing writes the inline audit columns any more; once no rows are left, "
+                     "ALTER TABLE order_status_history DROP COLUMN internal_notes, DROP COLUMN ip_address, "
+                     "DROP COLUMN user_agent")
+        logger.info(f"History compaction: {result['moved']} moved, {result['summarized']} ranges, "
+                    f"{len(result['frozen'])} partitions frozen")
+        return result
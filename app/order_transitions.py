@@ -0,0 +1,341 @@
+# app/order_transitions.py
+"""
+Order state transitions.
+
+Every write path that changes an order's status goes through
+``transition()``: the API and admin status updates, driver assignment and
+the test console's simulated flow. It
+
+- checks the change against ``TRANSITIONS``, compiled once into a set of
+  (delivery type, old status, new status) triples
+- takes ``time_in_previous_status`` from ``orders.status_changed_at``, the
+  cached time of the order's last transition, which comes with the order row
+  the caller already loaded, instead of a self-join over the history table
+- fills ``predicted_time_in_status`` from a per-restaurant moving average
+  of observed times, kept in process and seeded with ``DEFAULT_MINUTES``;
+  observations are queued on the session and only applied once it commits,
+  so a rolled-back transition does not skew the average
+- adds the history row to the session next to the order changes, so the
+  order UPDATE and the history INSERT go out in the same flush
+
+``transition_many()`` is the set-based form for consoles that advance many
+orders at once: one SELECT ... FOR UPDATE, one UPDATE ... RETURNING per
+target status and one multi-row history INSERT, with a result per order.
+
+Neither commits: callers commit and invalidate their caches.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, event, select
+from sqlalchemy.orm import Session
+
+from . import db, metrics, order_history
+from .models import Order, OrderStatusHistory
+from .order_history import AUDIT_FIELDS, audit_row
+from .partitions import order_created_range
+
+logger = logging.getLogger(__name__)
+
+# Allowed moves per delivery type. A delivery order can be handed to a
+# driver straight from confirmed; a pickup order is delivered when collected.
+TRANSITIONS = {
+    'delivery': {
+        'pending': ('confirmed', 'cancelled'),
+        'confirmed': ('preparing', 'out_for_delivery', 'cancelled'),
+        'preparing': ('ready', 'cancelled'),
+        'ready': ('out_for_delivery', 'cancelled'),
+        'out_for_delivery': ('delivered',),
+    },
+    'pickup': {
+        'pending': ('confirmed', 'cancelled'),
+        'confirmed': ('preparing', 'cancelled'),
+        'preparing': ('ready', 'cancelled'),
+        'ready': ('delivered', 'cancelled'),
+    },
+}
+
+# Happy path per delivery type, for the simulated flow
+FLOW = {
+    'delivery': ('pending', 'confirmed', 'preparing', 'ready', 'out_for_delivery', 'delivered'),
+    'pickup': ('pending', 'confirmed', 'preparing', 'ready', 'delivered'),
+}
+
+# Minutes an order is expected to spend in a status before anything is observed
+DEFAULT_MINUTES = {'pending': 5, 'confirmed': 5, 'preparing': 15, 'ready': 10, 'out_for_delivery': 30}
+
+# actor_type values order_status_history accepts; other roles act as admin
+ACTOR_TYPES = ('customer', 'driver', 'restaurant', 'admin', 'system')
+
+
+def _compile(table):
+    return frozenset((kind, old, new) for kind, moves in table.items()
+                     for old, targets in moves.items() for new in targets)
+
+
+ALLOWED = _compile(TRANSITIONS)
+
+
+class TransitionError(ValueError):
+    """The order cannot move to the requested status"""
+
+
+def _kind(order):
+    return order.delivery_type if order.delivery_type in TRANSITIONS else 'delivery'
+
+
+def can_transition(order, new_status):
+    return (_kind(order), order.order_status, new_status) in ALLOWED
+
+
+def allowed_statuses(order):
+    return TRANSITIONS[_kind(order)].get(order.order_status, ())
+
+
+def next_status(order):
+    """Next status on the happy path, or None once the order is closed"""
+    flow = FLOW[_kind(order)]
+    if order.order_status not in flow[:-1]:
+        return None
+    return flow[flow.index(order.order_status) + 1]
+
+
+# ============================================
+# TIME-IN-STATUS PREDICTION
+# ============================================
+class StatusTimes:
+    """Exponential moving average of minutes spent per (restaurant, status)"""
+
+    def __init__(self, alpha=0.2, defaults=None):
+        self.alpha = alpha
+        self.defaults = dict(DEFAULT_MINUTES if defaults is None else defaults)
+        self._averages = {}
+        self._lock = threading.Lock()
+
+    def predict(self, restaurant_id, status):
+        average = self._averages.get((restaurant_id, status))
+        if average is None:
+            return self.defaults.get(status)
+        return int(round(average))
+
+    def observe(self, restaurant_id, status, minutes):
+        if minutes is None or status not in self.defaults:
+            return
+        key = (restaurant_id, status)
+        with self._lock:
+            average = self._averages.get(key, self.defaults[status])
+            self._averages[key] = average + self.alpha * (minutes - average)
+
+
+status_times = StatusTimes()
+
+
+def _observe_on_commit(restaurant_id, status, minutes):
+    """Queue an observation for ``status_times``; applied when the session commits"""
+    db.session.info.setdefault('status_observations', []).append((restaurant_id, status, minutes))
+
+
+@event.listens_for(Session, 'after_commit')
+def _observe_after_commit(session):
+    for restaurant_id, status, minutes in session.info.pop('status_observations', ()):
+        status_times.observe(restaurant_id, status, minutes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('status_observations', None)
+
+
+# ============================================
+# TRANSITION
+# ============================================
+def last_transition_at(order):
+    """Cached time of the order's last status change (older rows fall back to created_at)"""
+    return order.status_changed_at or order.created_at
+
+
+def transition(order, new_status, actor_type='system', changed_by=None, driver_id=None,
+               source='web', now=None, **fields):
+    """Move ``order`` to ``new_status`` and add its history row to the session.
+
+    Raises ``TransitionError`` when the move is not allowed. Extra keyword
+    arguments (public_notes, internal_notes, reason_code, ...) go to the
+    history row. Returns the history row.
+    """
+    old_status = order.order_status
+    if not can_transition(order, new_status):
+        raise TransitionError(f"Cannot transition from {old_status} to {new_status}")
+
+    now = now or datetime.utcnow()
+    previous = last_transition_at(order)
+    minutes_in_previous = max(int(round((now - previous).total_seconds() / 60)), 0) if previous else None
+    _observe_on_commit(order.restaurant_id, old_status, minutes_in_previous)
+    predicted = status_times.predict(order.restaurant_id, new_status)
+
+    order.order_status = new_status
+    order.status_changed_at = now
+    order.updated_at = now
+    if driver_id is not None:
+        order.driver_id = driver_id
+    if new_status == 'out_for_delivery':
+        order.estimated_delivery = now + timedelta(minutes=predicted or DEFAULT_MINUTES['out_for_delivery'])
+    elif new_status == 'delivered':
+        order.delivered_at = now
+
+    history = OrderStatusHistory(
+        order_id=order.order_id,
+        order_created_at=order.created_at,
+        old_status=old_status,
+        new_status=new_status,
+        changed_by=changed_by,
+        actor_type=actor_type if actor_type in ACTOR_TYPES else 'admin',
+        driver_id=driver_id,
+        estimated_arrival=order.estimated_delivery if new_status == 'out_for_delivery' else None,
+        source=source,
+        changed_at=now,
+        effective_from=now,
+        time_in_previous_status=minutes_in_previous,
+        predicted_time_in_status=predicted,
+        **fields
+    )
+    db.session.add(history)
+    metrics.orders_transitioned(new_status, source)
+    return history
+
+
+# ============================================
+# BATCH TRANSITIONS
+# ============================================
+# Most orders one batch request may change
+BATCH_LIMIT = 200
+
+
+def _lock_orders(conn, order_ids):
+    """Current state of ``order_ids`` keyed by id, rows locked until commit"""
+    orders = Order.__table__
+    columns = (orders.c.order_id, orders.c.created_at, orders.c.restaurant_id, orders.c.delivery_type,
+               orders.c.order_status, orders.c.status_changed_at)
+
+    def fetch(ids, *criteria):
+        query = select(*columns).where(orders.c.order_id.in_(ids), *criteria)
+        if conn.dialect.name == 'postgresql':
+            query = query.with_for_update()
+        return {row.order_id: row for row in conn.execute(query)}
+
+    rows = fetch(order_ids, Order.created_span(order_ids))
+    missing = [order_id for order_id in order_ids
+               if order_id not in rows and order_created_range(order_id) is not None]
+    if missing:
+        # Ids whose timestamp does not match created_at (see Order.by_id)
+        rows.update(fetch(missing))
+    return rows
+
+
+def transition_many(changes, actor_type='system', changed_by=None, source='web', now=None,
+                    drivers=None, estimates=None):
+    """Apply many transitions in the current transaction, set-based.
+
+    ``changes`` is a list of dicts with ``order_id`` and ``status``, plus
+    optional public_notes, reason_code and internal_notes. ``drivers`` maps
+    order ids to the driver they are handed to and ``estimates`` to an
+    estimated delivery time replacing the predicted one (the dispatcher's
+    multi-drop trips). Returns one
+    result dict per change, in order, with ``success`` and a ``message``
+    for the ones refused.
+    """
+    now = now or datetime.utcnow()
+    drivers = drivers or {}
+    estimates = estimates or {}
+    orders = Order.__table__
+    history = OrderStatusHistory.__table__
+    actor_type = actor_type if actor_type in ACTOR_TYPES else 'admin'
+    conn = db.session.connection()
+
+    rows = _lock_orders(conn, list(dict.fromkeys(change['order_id'] for change in changes)))
+    results, moves, seen = [], {}, set()
+    for change in changes:
+        order_id, new_status = change['order_id'], change.get('status')
+        row = rows.get(order_id)
+        result = {'order_id': order_id, 'old_status': row.order_status if row else None,
+                  'new_status': new_status, 'success': False}
+        results.append(result)
+        if order_id in seen:
+            result['message'] = "Order listed more than once"
+        elif row is None:
+            result['message'] = "Order not found"
+        elif (_kind(row), row.order_status, new_status) not in ALLOWED:
+            result['message'] = f"Cannot transition from {row.order_status} to {new_status}"
+        else:
+            moves.setdefault(new_status, []).append((row, change, result))
+        seen.add(order_id)
+
+    history_rows = []
+    for new_status, batch in moves.items():
+        predicted = {row.order_id: status_times.predict(row.restaurant_id, new_status) for row, _, _ in batch}
+        values = {'order_status': new_status, 'status_changed_at': now, 'updated_at': now}
+        if new_status == 'out_for_delivery':
+            values['estimated_delivery'] = case(
+                {order_id: estimates.get(order_id)
+                 or now + timedelta(minutes=minutes or DEFAULT_MINUTES['out_for_delivery'])
+                 for order_id, minutes in predicted.items()},
+                value=orders.c.order_id)
+        elif new_status == 'delivered':
+            values['delivered_at'] = now
+        assigned = {row.order_id: drivers[row.order_id] for row, _, _ in batch if row.order_id in drivers}
+        if assigned:
+            values['driver_id'] = case(assigned, value=orders.c.order_id, else_=orders.c.driver_id)
+
+        # Rows are locked, the status guard only makes a lost race visible
+        updated = {r.order_id: r.estimated_delivery for r in conn.execute(
+            orders.update().where(
+                orders.c.order_id.in_([row.order_id for row, _, _ in batch]),
+                orders.c.created_at.in_({row.created_at for row, _, _ in batch}),
+                orders.c.order_status.in_({row.order_status for row, _, _ in batch})
+            ).values(**values).returning(orders.c.order_id, orders.c.estimated_delivery)
+        )}
+
+        for row, change, result in batch:
+            if row.order_id not in updated:
+                result['message'] = "Order changed concurrently"
+                continue
+            previous = last_transition_at(row)
+            minutes = max(int(round((now - previous).total_seconds() / 60)), 0) if previous else None
+            _observe_on_commit(row.restaurant_id, row.order_status, minutes)
+            result['success'] = True
+            history_rows.append({
+                'order_id': row.order_id,
+                'order_created_at': row.created_at,
+                'old_status': row.order_status,
+                'new_status': new_status,
+                'changed_by': changed_by,
+                'actor_type': actor_type,
+                'driver_id': assigned.get(row.order_id),
+                'estimated_arrival': updated[row.order_id] if new_status == 'out_for_delivery' else None,
+                'public_notes': change.get('public_notes'),
+                'reason_code': change.get('reason_code'),
+                'source': source,
+                'changed_at': now,
+                'effective_from': now,
+                'time_in_previous_status': minutes,
+                'predicted_time_in_status': predicted[row.order_id],
+            })
+        metrics.orders_transitioned(new_status, source, count=len(updated))
+
+    if history_rows:
+        audit = {change['order_id']: change for change in changes
+                 if any(change.get(field) for field in AUDIT_FIELDS)}
+        statement = history.insert().values(history_rows)
+        if audit:
+            inserted = conn.execute(statement.returning(history.c.history_id, history.c.order_id,
+                                                        history.c.order_created_at))
+            order_history.add_audit(db.session, [
+                audit_row(r.history_id, r.order_id, r.order_created_at, audit[r.order_id])
+                for r in inserted if r.order_id in audit
+            ])
+        else:
+            conn.execute(statement)
+
+    logger.info(f"Batch transition by {actor_type} {changed_by}: "
+                f"{len(history_rows)} of {len(changes)} orders moved")
+    return results
@@ -0,0 +1,544 @@
+# app/partitions.py
+"""
+Monthly range partitions for orders, order_items and order_status_history.
+
+``orders`` is partitioned on ``created_at``; the two child tables carry the
+order's ``created_at`` as ``order_created_at`` and are partitioned on it, so
+an order, its items and its history always sit in the same month and the
+composite foreign key ``(order_id, order_created_at)`` holds.
+
+Partitions are created ahead of time by ``create_order_partitions()`` (see
+db/init.sql). Each worker calls it on its first request and then every
+``ORDER_PARTITION_CHECK_HOURS``, and ``flask ensure-partitions`` does the
+same from cron. A default partition catches anything outside the prepared
+months so an insert never fails.
+
+Postgres only prunes partitions when the query constrains the partition key.
+Order ids embed their creation time (``ORD-YYYYMMDDHHMMSS-XXXXXX``), and
+``order_created_range()`` turns that into a ``created_at`` window. The
+model helpers in models.py (``Order.by_id``, ``Order.on_business_days``,
+``OrderItem.for_order``) add the window to their queries.
+
+``driver_locations`` (app/driver_tracks.py) is partitioned by day instead;
+``create_driver_location_partitions()`` keeps ``TRACK_PARTITIONS_AHEAD``
+days ready and is run alongside the order partitions.
+
+``OrderPartitionMigration`` converts an existing database online. It builds
+the partitioned tables in a side schema, keeps them in sync with triggers,
+copies the existing rows in small batches, and swaps the tables in one short
+transaction (``flask partition-orders``).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Parent table -> partition key column
+PARTITION_KEYS = {
+    'orders': 'created_at',
+    'order_items': 'order_created_at',
+    'order_status_history': 'order_created_at',
+}
+
+# Daily partitioned GPS tracks (see app/driver_tracks.py)
+TRACK_TABLE = 'driver_locations'
+
+_ORDER_ID_TIME = re.compile(r'^[A-Z]+-(\d{8})(\d{6})?-')
+
+# Slack around the id's timestamp: ids use server-local time, created_at is UTC
+ID_TIME_SLACK = timedelta(days=1)
+
+
+def order_created_range(order_id):
+    """``(lower, upper)`` bounds on ``created_at`` implied by the order id, or ``None``"""
+    match = _ORDER_ID_TIME.match(order_id or '')
+    if match is None:
+        return None
+    try:
+        stamp = datetime.strptime(match.group(1) + (match.group(2) or '000000'), '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+    return stamp - ID_TIME_SLACK, stamp + ID_TIME_SLACK
+
+
+# create_order_partitions() as in db/init.sql, for databases created before it
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION create_order_partitions(p_from DATE, p_months INTEGER, p_schema TEXT DEFAULT 'public')
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_table TEXT;
+    v_key TEXT;
+    v_month DATE;
+    v_name TEXT;
+    v_in_default BOOLEAN;
+    v_created INTEGER := 0;
+BEGIN
+    -- Workers run this concurrently
+    PERFORM pg_advisory_xact_lock(hashtext('create_order_partitions'));
+    
+    FOREACH v_table IN ARRAY ARRAY['orders', 'order_items', 'order_status_history']
+    LOOP
+        v_key := CASE v_table WHEN 'orders' THEN 'created_at' ELSE 'order_created_at' END;
+        
+        IF to_regclass(format('%I.%I', p_schema, v_table || '_default')) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I.%I PARTITION OF %I.%I DEFAULT',
+                           p_schema, v_table || '_default', p_schema, v_table);
+            v_created := v_created + 1;
+        END IF;
+        
+        FOR i IN 0 .. p_months - 1
+        LOOP
+            v_month := (date_trunc('month', p_from) + make_interval(months => i))::date;
+            v_name := v_table || '_' || to_char(v_month, 'YYYY_MM');
+            CONTINUE WHEN to_regclass(format('%I.%I', p_schema, v_name)) IS NOT NULL;
+            
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I.%I WHERE %I >= %L AND %I < %L)',
+                           p_schema, v_table || '_default', v_key, v_month, v_key, (v_month + INTERVAL '1 month')::date)
+                INTO v_in_default;
+            IF v_in_default THEN
+                RAISE WARNING '% has rows for % in its default partition, not creating %', v_table, v_month, v_name;
+                CONTINUE;
+            END IF;
+            
+            EXECUTE format('CREATE TABLE %I.%I PARTITION OF %I.%I FOR VALUES FROM (%L) TO (%L)',
+                           p_schema, v_name, p_schema, v_table, v_month, (v_month + INTERVAL '1 month')::date);
+            v_created := v_created + 1;
+        END LOOP;
+    END LOOP;
+    
+    RETURN v_created;
+END;
+$$;
+"""
+
+
+def is_partitioned(conn, table, schema='public'):
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :table AND n.nspname = :schema)"
+    ), {'table': table, 'schema': schema}).scalar()
+
+
+def ensure_partitions(conn, months_ahead=3, schema='public'):
+    """Create this month's and the next ``months_ahead`` months' partitions; returns the number created"""
+    if conn.dialect.name != 'postgresql' or not is_partitioned(conn, 'orders', schema):
+        return 0
+    return conn.execute(text(
+        "SELECT create_order_partitions(date_trunc('month', now() AT TIME ZONE 'UTC')::date, :months, :schema)"
+    ), {'months': months_ahead + 1, 'schema': schema}).scalar()
+
+
+def ensure_track_partitions(conn, days_ahead=7, schema='public'):
+    """Create yesterday's through the next ``days_ahead`` days' track partitions; returns the number created"""
+    if conn.dialect.name != 'postgresql' or not is_partitioned(conn, TRACK_TABLE, schema):
+        return 0
+    return conn.execute(text(
+        "SELECT create_driver_location_partitions((now() AT TIME ZONE 'UTC')::date - 1, :days, :schema)"
+    ), {'days': days_ahead + 2, 'schema': schema}).scalar()
+
+
+def partition_report(conn, schema='public'):
+    """Partitions per table with estimated row counts, oldest first"""
+    rows = conn.execute(text(
+        "SELECT parent.relname, child.relname, child.reltuples::bigint, "
+        "pg_get_expr(child.relpartbound, child.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "JOIN pg_namespace n ON n.oid = parent.relnamespace "
+        "WHERE n.nspname = :schema AND parent.relname = ANY(:tables) "
+        "ORDER BY parent.relname, child.relname"
+    ), {'schema': schema, 'tables': [*PARTITION_KEYS, TRACK_TABLE]}).fetchall()
+    report = {}
+    for parent, child, estimate, bound in rows:
+        report.setdefault(parent, []).append({'partition': child, 'rows': max(estimate, 0), 'bound': bound})
+    return report
+
+
+class PartitionMaintainer:
+    """Flask extension keeping future order and track partitions in place"""
+
+    def __init__(self, app=None, db=None):
+        self.enabled = True
+        self.months_ahead = 3
+        self.days_ahead = 7
+        self.check_hours = 12
+        self.last_run = None
+        self.last_created = 0
+        self.last_error = None
+        self._db = None
+        self._app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('ORDER_PARTITIONS_ENABLED', True)
+        app.config.setdefault('ORDER_PARTITIONS_AHEAD', 3)
+        app.config.setdefault('ORDER_PARTITION_CHECK_HOURS', 12)
+        app.config.setdefault('TRACK_PARTITIONS_AHEAD', 7)
+
+        self.enabled = app.config['ORDER_PARTITIONS_ENABLED']
+        self.months_ahead = app.config['ORDER_PARTITIONS_AHEAD']
+        self.check_hours = app.config['ORDER_PARTITION_CHECK_HOURS']
+        self.days_ahead = app.config['TRACK_PARTITIONS_AHEAD']
+        self._db = db
+        self._app = app
+
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        if self.enabled and uri.startswith('postgres'):
+            app.before_request(self._ensure_thread)
+
+        app.extensions['partition_maintainer'] = self
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='order-partitions', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._app.app_context():
+                self.run_once()
+            time.sleep(self.check_hours * 3600)
+
+    def run_once(self):
+        try:
+            with self._db.engine.begin() as conn:
+                created = ensure_partitions(conn, self.months_ahead)
+                created += ensure_track_partitions(conn, self.days_ahead)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Creating partitions failed: {e}")
+            return 0
+        self.last_run = datetime.utcnow()
+        self.last_created = created
+        self.last_error = None
+        if created:
+            logger.info(f"Created {created} partitions")
+        return created
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'months_ahead': self.months_ahead,
+            'days_ahead': self.days_ahead,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_created': self.last_created,
+            'last_error': self.last_error
+        }
+
+
+# ============================================
+# ONLINE MIGRATION
+# ============================================
+class OrderPartitionMigration:
+    """
+    Move the unpartitioned order tables to partitioned ones while the app runs.
+
+    ``prepare`` installs ``create_order_partitions()``, builds the
+    partitioned copies in the ``order_migration`` schema and installs
+    triggers that mirror every write on the live tables.
+    ``backfill`` copies the existing rows in key order, one short
+    transaction per batch. ``swap`` moves the live tables to
+    ``order_legacy`` and the copies to ``public`` under a brief exclusive
+    lock, then re-points views, sequences and triggers. The legacy tables are
+    kept for rollback until they are dropped by hand.
+    """
+
+    STAGE = 'order_migration'
+    LEGACY = 'order_legacy'
+    # Parents first: children reference orders
+    TABLES = ('orders', 'order_items', 'order_status_history')
+    BATCH_KEYS = {'orders': 'order_id', 'order_items': 'order_item_id', 'order_status_history': 'history_id'}
+
+    def __init__(self, engine, batch_size=5000, pause=0.05, log=print):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.pause = pause
+        self.log = log
+
+    # ----- catalog helpers -----
+
+    def _columns(self, conn, table, schema='public'):
+        """Insertable columns (generated ones excluded), in table order"""
+        return [row[0] for row in conn.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = :schema AND table_name = :table AND is_generated = 'NEVER' "
+            "ORDER BY ordinal_position"
+        ), {'schema': schema, 'table': table})]
+
+    def _indexes(self, conn, table):
+        """Non-unique index definitions of the live table"""
+        return [row[0] for row in conn.execute(text(
+            "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "WHERE i.indrelid = CAST(:table AS regclass) AND NOT i.indisunique"
+        ), {'table': f'public.{table}'})]
+
+    def _foreign_keys(self, conn, table):
+        """Foreign keys of the live table that do not point at orders"""
+        return conn.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f' "
+            "AND confrelid <> CAST('public.orders' AS regclass)"
+        ), {'table': f'public.{table}'}).fetchall()
+
+    def _dependent_views(self, conn):
+        return conn.execute(text(
+            "SELECT DISTINCT v.relname, pg_get_viewdef(v.oid) FROM pg_depend d "
+            "JOIN pg_rewrite r ON r.oid = d.objid "
+            "JOIN pg_class v ON v.oid = r.ev_class "
+            "JOIN pg_namespace n ON n.oid = v.relnamespace "
+            "WHERE d.refobjid IN (CAST('public.orders' AS regclass), CAST('public.order_items' AS regclass), "
+            "CAST('public.order_status_history' AS regclass)) AND v.relkind = 'v' AND n.nspname = 'public'"
+        )).fetchall()
+
+    def _owned_sequences(self, conn, table):
+        return conn.execute(text(
+            "SELECT s.relname, a.attname FROM pg_depend d "
+            "JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+            "JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid "
+            "WHERE d.refobjid = CAST(:table AS regclass) AND d.deptype = 'a'"
+        ), {'table': f'public.{table}'}).fetchall()
+
+    # ----- steps -----
+
+    def prepare(self):
+        with self.engine.begin() as conn:
+            if is_partitioned(conn, 'orders'):
+                raise RuntimeError('orders is already partitioned')
+            if conn.execute(text(f"SELECT to_regclass('{self.STAGE}.orders')")).scalar() is not None:
+                self.log(f"ℹ️  {self.STAGE} already prepared, resuming")
+                return
+
+        # Databases built from an older init.sql lack the partition function
+        with self.engine.begin() as conn:
+            conn.execute(text(CREATE_PARTITION_FUNCTION))
+
+        # Short transactions first: the column add needs a brief exclusive lock
+        for child in ('order_items', 'order_status_history'):
+            with self.engine.begin() as conn:
+                conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+                conn.execute(text(f"ALTER TABLE {child} ADD COLUMN IF NOT EXISTS order_created_at TIMESTAMP"))
+        # Old rows need a partition key; new rows always get one
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE orders SET created_at = COALESCE(updated_at, now() AT TIME ZONE 'UTC') WHERE created_at IS NULL"
+            ))
+
+        stage = self.STAGE
+        with self.engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {stage}"))
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {stage}.orders (LIKE public.orders "
+                "INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+                "PARTITION BY RANGE (created_at)"
+            ))
+            conn.execute(text(f"ALTER TABLE {stage}.orders ALTER COLUMN created_at SET NOT NULL"))
+            conn.execute(text(f"ALTER TABLE {stage}.orders ADD PRIMARY KEY (order_id, created_at)"))
+
+            for child, key in (('order_items', 'order_item_id'), ('order_status_history', 'history_id')):
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {stage}.{child} (LIKE public.{child} "
+                    "INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+                    "PARTITION BY RANGE (order_created_at)"
+                ))
+                conn.execute(text(f"ALTER TABLE {stage}.{child} ALTER COLUMN order_created_at SET NOT NULL"))
+                conn.execute(text(f"ALTER TABLE {stage}.{child} ADD PRIMARY KEY ({key}, order_created_at)"))
+                conn.execute(text(
+                    f"ALTER TABLE {stage}.{child} ADD CONSTRAINT {child}_order_fkey "
+                    f"FOREIGN KEY (order_id, order_created_at) REFERENCES {stage}.orders (order_id, created_at) "
+                    "ON DELETE CASCADE"
+                ))
+                for name, definition in self._foreign_keys(conn, child):
+                    conn.execute(text(f"ALTER TABLE {stage}.{child} ADD CONSTRAINT {name} {definition}"))
+
+            for table in self.TABLES:
+                for definition in self._indexes(conn, table):
+                    definition = definition.replace(f' ON public.{table} ', f' ON {stage}.{table} ')
+                    conn.execute(text(definition.replace(f' ON {table} ', f' ON {stage}.{table} ')))
+
+            # Partitions for every month that has data, plus the months ahead
+            oldest = conn.execute(text("SELECT min(created_at) FROM public.orders")).scalar() or datetime.utcnow()
+            now = datetime.utcnow()
+            months = (now.year - oldest.year) * 12 + now.month - oldest.month + 1 + 3
+            conn.execute(text("SELECT create_order_partitions(:start, :months, :schema)"),
+                         {'start': oldest.date().replace(day=1), 'months': months, 'schema': stage})
+
+            # Orders are mirrored from now on; the children once every order is copied,
+            # so a mirrored item or history row always finds its order
+            self._install_triggers(conn, 'orders')
+        self.log(f"✅ Prepared {self.STAGE} and started mirroring order writes")
+
+    def _install_triggers(self, conn, *tables):
+        stage = self.STAGE
+        for table in tables:
+            columns = self._columns(conn, table)
+            key = PARTITION_KEYS[table]
+            primary = [self.BATCH_KEYS[table], key]
+            values = ', '.join(f'NEW.{column}' for column in columns)
+            updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns if column not in primary)
+            fill = ''
+            if table != 'orders':
+                fill = ("IF NEW.order_created_at IS NULL THEN "
+                        "SELECT created_at INTO NEW.order_created_at FROM public.orders WHERE order_id = NEW.order_id; "
+                        "END IF;")
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION {stage}.mirror_{table}() RETURNS TRIGGER AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        DELETE FROM {stage}.{table} WHERE {primary[0]} = OLD.{primary[0]};
+                        RETURN NULL;
+                    END IF;
+                    {fill}
+                    INSERT INTO {stage}.{table} ({', '.join(columns)}) VALUES ({values})
+                    ON CONFLICT ({', '.join(primary)}) DO UPDATE SET {updates};
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """))
+            conn.execute(text(f"DROP TRIGGER IF EXISTS mirror_{table} ON public.{table}"))
+            conn.execute(text(
+                f"CREATE TRIGGER mirror_{table} AFTER INSERT OR UPDATE OR DELETE ON public.{table} "
+                f"FOR EACH ROW EXECUTE FUNCTION {stage}.mirror_{table}()"
+            ))
+            if table != 'orders':
+                # Fill the key on the live row too, so the mirror and the backfill agree
+                conn.execute(text(f"""
+                    CREATE OR REPLACE FUNCTION {stage}.fill_{table}_order_created_at() RETURNS TRIGGER AS $$
+                    BEGIN
+                        IF NEW.order_created_at IS NULL THEN
+                            SELECT created_at INTO NEW.order_created_at FROM public.orders WHERE order_id = NEW.order_id;
+                        END IF;
+                        RETURN NEW;
+                    END;
+                    $$ LANGUAGE plpgsql
+                """))
+                conn.execute(text(f"DROP TRIGGER IF EXISTS fill_order_created_at ON public.{table}"))
+                conn.execute(text(
+                    f"CREATE TRIGGER fill_order_created_at BEFORE INSERT ON public.{table} "
+                    f"FOR EACH ROW EXECUTE FUNCTION {stage}.fill_{table}_order_created_at()"
+                ))
+
+    def backfill(self):
+        self._backfill_table('orders')
+        with self.engine.begin() as conn:
+            self._install_triggers(conn, 'order_items', 'order_status_history')
+        for table in ('order_items', 'order_status_history'):
+            self._backfill_table(table)
+
+    def _backfill_table(self, table):
+        stage = self.STAGE
+        key = self.BATCH_KEYS[table]
+        with self.engine.connect() as conn:
+            columns = self._columns(conn, table)
+        if table == 'orders':
+            source = 'public.orders t'
+            select = ', '.join(f't.{column}' for column in columns)
+        else:
+            source = f'public.{table} t LEFT JOIN public.orders o ON o.order_id = t.order_id'
+            select = ', '.join('COALESCE(t.order_created_at, o.created_at)' if column == 'order_created_at'
+                               else f't.{column}' for column in columns)
+
+        last, copied, started = None, 0, time.monotonic()
+        while True:
+            with self.engine.begin() as conn:
+                conn.execute(text("SET LOCAL statement_timeout = '60s'"))
+                bound = conn.execute(text(
+                    f"SELECT max({key}) FROM (SELECT {key} FROM public.{table} "
+                    f"WHERE (CAST(:last AS text) IS NULL OR {key} > :last) ORDER BY {key} LIMIT :limit) batch"
+                ), {'last': last, 'limit': self.batch_size}).scalar()
+                if bound is None:
+                    break
+                copied += conn.execute(text(
+                    f"INSERT INTO {stage}.{table} ({', '.join(columns)}) SELECT {select} FROM {source} "
+                    f"WHERE (CAST(:last AS text) IS NULL OR t.{key} > :last) AND t.{key} <= :bound "
+                    "ON CONFLICT DO NOTHING"
+                ), {'last': last, 'bound': bound}).rowcount
+            last = bound
+            if self.pause:
+                time.sleep(self.pause)
+        self.log(f"   {table:<22} {copied:>10} rows copied in {time.monotonic() - started:.1f}s")
+
+    def verify(self):
+        """Row counts of the live tables against the copies"""
+        ok = True
+        with self.engine.connect() as conn:
+            for table in self.TABLES:
+                live = conn.execute(text(f"SELECT count(*) FROM public.{table}")).scalar()
+                copy = conn.execute(text(f"SELECT count(*) FROM {self.STAGE}.{table}")).scalar()
+                ok = ok and live == copy
+                self.log(f"   {table:<22} live={live:<10} partitioned={copy}")
+        return ok
+
+    def swap(self, lock_timeout='5s'):
+        stage, legacy = self.STAGE, self.LEGACY
+        with self.engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {legacy}"))
+            conn.execute(text(
+                "LOCK TABLE public.orders, public.order_items, public.order_status_history IN ACCESS EXCLUSIVE MODE"
+            ))
+            views = self._dependent_views(conn)
+            sequences = {table: self._owned_sequences(conn, table) for table in self.TABLES}
+            for table in self.TABLES:
+                for sequence, _ in sequences[table]:
+                    conn.execute(text(f"ALTER SEQUENCE public.{sequence} OWNED BY NONE"))
+                conn.execute(text(f"DROP TRIGGER IF EXISTS mirror_{table} ON public.{table}"))
+                conn.execute(text(f"DROP TRIGGER IF EXISTS fill_order_created_at ON public.{table}"))
+
+            partitions = conn.execute(text(
+                "SELECT child.relname FROM pg_inherits i "
+                "JOIN pg_class child ON child.oid = i.inhrelid "
+                "JOIN pg_class parent ON parent.oid = i.inhparent "
+                "JOIN pg_namespace n ON n.oid = parent.relnamespace "
+                "WHERE n.nspname = :stage AND child.relkind IN ('r', 'p')"
+            ), {'stage': stage}).scalars().all()
+
+            for table in reversed(self.TABLES):
+                conn.execute(text(f"ALTER TABLE public.{table} SET SCHEMA {legacy}"))
+            for table in self.TABLES:
+                conn.execute(text(f"ALTER TABLE {stage}.{table} SET SCHEMA public"))
+            for partition in partitions:
+                conn.execute(text(f"ALTER TABLE {stage}.{partition} SET SCHEMA public"))
+
+            for table in self.TABLES:
+                for sequence, column in sequences[table]:
+                    conn.execute(text(f"ALTER SEQUENCE public.{sequence} OWNED BY public.{table}.{column}"))
+            conn.execute(text(
+                "CREATE TRIGGER update_orders_updated_at BEFORE UPDATE ON public.orders "
+                "FOR EACH ROW EXECUTE FUNCTION update_updated_at_column()"
+            ))
+            for name, definition in views:
+                conn.execute(text(f"CREATE OR REPLACE VIEW public.{name} AS {definition}"))
+            for table in self.TABLES:
+                conn.execute(text(f"DROP FUNCTION IF EXISTS {stage}.mirror_{table}()"))
+                if table != 'orders':
+                    conn.execute(text(f"DROP FUNCTION IF EXISTS {stage}.fill_{table}_order_created_at()"))
+        self.log(f"✅ Swapped: partitioned tables are live, the old ones are in {legacy}")
+
+    def run(self, swap=False):
+        self.prepare()
+        self.backfill()
+        if not self.verify():
+            self.log("⚠️  Row counts differ, not swapping")
+            return False
+        if swap:
+            self.swap()
+        else:
+            self.log("ℹ️  Copies are in sync; run again with --swap to switch over")
+        return True
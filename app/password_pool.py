@@ -0,0 +1,9 @@
+# app/password_pool.py
+"""
+Bounded password verification for the web app. The implementation is shared
+with the mobile API service and lives in api/shared/password_pool.py, the only
+place that service's image can import it from.
+"""
+from api.shared.password_pool import PasswordVerifier, VerifierSaturated
+
+__all__ = ['PasswordVerifier', 'VerifierSaturated']
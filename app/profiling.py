@@ -0,0 +1,250 @@
+# app/profiling.py
+"""
+Profiling hooks.
+
+Per-request profiler: an admin adds ``X-Profile: 1`` (or ``?_profile=1``) to
+a request and gets a cProfile report of that request instead of its normal
+response. ``X-Profile: sample`` samples the handling thread every
+millisecond instead and returns collapsed stacks, which is closer to
+wall-clock time when the request mostly waits on the database.
+
+Stack sampler: a background thread wakes every ``STACK_SAMPLER_INTERVAL``
+seconds, takes the stack of every thread that is handling a request and
+counts it under the request's endpoint. The counts are kept per worker
+process, in the collapsed format flamegraph tools read
+(``frame;frame;frame count``), and are shown on ``/admin/system/health``.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, g, request
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 64
+
+
+def collapse(frame, max_depth=MAX_DEPTH):
+    """``module:function`` frames from outermost to innermost, ';'-joined"""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def format_collapsed(counts, prefix=None):
+    lines = []
+    for stack, count in counts.most_common():
+        lines.append(f"{prefix};{stack} {count}" if prefix else f"{stack} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+class _ThreadSampler(threading.Thread):
+    """Samples one thread at a fixed interval until stopped (per-request ``sample`` mode)"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='request-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.counts
+
+
+class Profiler:
+    """Flask extension: admin-triggered request profiles and the background stack sampler"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.sampler_enabled = True
+        self.interval = 0.1
+        self.max_stacks = 5000
+        self._active = {}
+        self._stacks = {}
+        self._stack_count = 0
+        self._samples = Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.started_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_ENABLED', True)
+        app.config.setdefault('STACK_SAMPLER_ENABLED', True)
+        app.config.setdefault('STACK_SAMPLER_INTERVAL', 0.1)
+        app.config.setdefault('STACK_SAMPLER_MAX_STACKS', 5000)
+
+        self.enabled = app.config['PROFILER_ENABLED']
+        self.sampler_enabled = app.config['STACK_SAMPLER_ENABLED']
+        self.interval = app.config['STACK_SAMPLER_INTERVAL']
+        self.max_stacks = app.config['STACK_SAMPLER_MAX_STACKS']
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+
+        app.extensions['profiler'] = self
+
+    # ----- per-request profiles -----
+
+    @staticmethod
+    def _requested_mode():
+        mode = request.headers.get('X-Profile') or request.args.get('_profile')
+        if not mode or mode in ('0', 'false'):
+            return None
+        return 'sample' if mode == 'sample' else 'cprofile'
+
+    @staticmethod
+    def _is_admin():
+        from flask_login import current_user
+        if current_user.is_authenticated and current_user.is_admin():
+            return True
+        try:
+            from flask_jwt_extended import verify_jwt_in_request
+            if verify_jwt_in_request(optional=True) is None:
+                return False
+            from .authz import resolve_principal
+            principal = resolve_principal()
+        except Exception:
+            return False
+        return principal is not None and principal.has_role('admin')
+
+    def _start_request(self):
+        if self.sampler_enabled:
+            self._ensure_sampler()
+            self._active[threading.get_ident()] = request.endpoint or 'unmatched'
+
+        if not self.enabled:
+            return
+        mode = self._requested_mode()
+        if mode is None or not self._is_admin():
+            return
+        if mode == 'sample':
+            sampler = _ThreadSampler(threading.get_ident(), 0.001)
+            sampler.start()
+            g._request_profile = ('sample', sampler)
+        else:
+            profile = cProfile.Profile()
+            g._request_profile = ('cprofile', profile)
+            profile.enable()
+
+    def _finish_request(self, response):
+        started = g.pop('_request_profile', None)
+        if started is None:
+            return response
+        mode, profiler = started
+        if mode == 'sample':
+            body = format_collapsed(profiler.stop(), prefix=request.endpoint)
+        else:
+            profiler.disable()
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream=out)
+            stats.sort_stats('cumulative').print_stats(60)
+            body = out.getvalue()
+        logger.info(f"Profiled {request.method} {request.path} ({mode})")
+        profiled = Response(body, mimetype='text/plain')
+        profiled.headers['X-Profiled-Status'] = str(response.status_code)
+        return profiled
+
+    def _teardown_request(self, exc):
+        self._active.pop(threading.get_ident(), None)
+        started = g.pop('_request_profile', None)
+        if started is not None:
+            # The request failed before the response was built
+            if started[0] == 'sample':
+                started[1].stop()
+            else:
+                started[1].disable()
+
+    # ----- background sampler -----
+
+    def _ensure_sampler(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._active = {}
+            self.started_at = time.time()
+            threading.Thread(target=self._run_sampler, name='stack-sampler', daemon=True).start()
+
+    def _run_sampler(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, endpoint in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._record(endpoint, collapse(frame))
+
+    def _record(self, endpoint, stack):
+        with self._lock:
+            stacks = self._stacks.get(endpoint)
+            if stacks is None:
+                stacks = self._stacks[endpoint] = Counter()
+            if stack not in stacks:
+                if self._stack_count >= self.max_stacks:
+                    stack = '[other]'
+                self._stack_count += stack not in stacks
+            stacks[stack] += 1
+            self._samples[endpoint] += 1
+
+    def collapsed(self, endpoint=None):
+        """Flamegraph input for one endpoint, or all of them prefixed with the endpoint"""
+        with self._lock:
+            if endpoint is not None:
+                return format_collapsed(Counter(self._stacks.get(endpoint, {})), prefix=endpoint)
+            return ''.join(format_collapsed(Counter(stacks), prefix=name).rstrip('\n') + '\n'
+                           for name, stacks in self._stacks.items())
+
+    def summary(self, limit=10):
+        """Sample counts per endpoint with each endpoint's hottest innermost frames"""
+        with self._lock:
+            endpoints = []
+            for endpoint, count in self._samples.most_common(limit):
+                leaves = Counter()
+                for stack, hits in self._stacks[endpoint].items():
+                    leaves[stack.rsplit(';', 1)[-1]] += hits
+                endpoints.append({
+                    'endpoint': endpoint,
+                    'samples': count,
+                    'seconds': round(count * self.interval, 1),
+                    'top_frames': [{'frame': frame, 'samples': hits} for frame, hits in leaves.most_common(5)]
+                })
+        return {
+            'enabled': self.sampler_enabled,
+            'pid': os.getpid(),
+            'interval': self.interval,
+            'since': self.started_at,
+            'endpoints': endpoints
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stacks = {}
+            self._stack_count = 0
+            self._samples = Counter()
+            self.started_at = time.time()
@@ -0,0 +1,213 @@
+# app/query_stats.py
+"""
+Per-request SQL instrumentation.
+
+Cursor events on every engine (primary and replica) count the queries a
+request issues, add up their time and group them by fingerprint: the
+statement with literals and IN-lists collapsed, so ``User.query.get`` in a
+loop shows up as one fingerprint repeated N times.
+
+Each statement also gets a trailing ``/* request_id=..., endpoint=... */``
+comment so a slow query in the Postgres log or ``pg_stat_activity`` can be
+matched to the request that sent it.
+
+In development and tests a fingerprint repeated ``QUERY_N_PLUS_ONE_THRESHOLD``
+times in one request is reported as an N+1: logged with the line that
+issued it (``QUERY_N_PLUS_ONE=warn``) or turned into an error
+(``QUERY_N_PLUS_ONE=raise``).
+"""
+import logging
+import os
+import re
+import time
+import traceback
+import uuid
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|%\(\w+\)s))*\s*\)')
+_PARAM = re.compile(r'%\(\w+\)s|%s|\?|:\w+')
+_SPACE = re.compile(r'\s+')
+
+
+class NPlusOneError(Exception):
+    """Raised in ``raise`` mode when a request repeats the same query too often"""
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """Statement shape with literals, parameters and IN-lists collapsed"""
+    shape = _STRING.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('(...)', shape)
+    shape = _PARAM.sub('?', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def _call_site():
+    """Innermost frame in the application code (outside this module)"""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(APP_ROOT) and not frame.filename.endswith('query_stats.py'):
+            return f"{os.path.relpath(frame.filename, os.path.dirname(APP_ROOT))}:{frame.lineno} in {frame.name}"
+    return None
+
+
+class RequestQueries:
+    """Queries issued by one request"""
+
+    __slots__ = ('count', 'total_ms', 'statements', 'sites', 'reported')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = {}
+        self.sites = {}
+        self.reported = set()
+
+    def add(self, shape, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        entry = self.statements.get(shape)
+        if entry is None:
+            self.statements[shape] = [1, elapsed_ms]
+            return 1
+        entry[0] += 1
+        entry[1] += elapsed_ms
+        return entry[0]
+
+    def repeated(self, minimum=2):
+        """(fingerprint, count, total ms) for statements run at least ``minimum`` times"""
+        return sorted(
+            ((shape, count, ms) for shape, (count, ms) in self.statements.items() if count >= minimum),
+            key=lambda item: item[1], reverse=True
+        )
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'db_ms': round(self.total_ms, 2),
+            'repeated': [
+                {'fingerprint': shape[:300], 'count': count, 'ms': round(ms, 2), 'site': self.sites.get(shape)}
+                for shape, count, ms in self.repeated()[:10]
+            ]
+        }
+
+
+class QueryTracker:
+    """Flask extension attaching the cursor events and the request hooks"""
+
+    def __init__(self, app=None, db=None):
+        self.enabled = True
+        self.comments = True
+        self.threshold = 10
+        self.mode = 'off'
+        self.server_timing = False
+        self.counters = {'requests': 0, 'queries': 0, 'n_plus_one': 0}
+        self._engines = set()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        debugging = app.config.get('DEBUG') or app.config.get('TESTING')
+        app.config.setdefault('QUERY_TRACKING_ENABLED', True)
+        app.config.setdefault('QUERY_COMMENTS_ENABLED', True)
+        app.config.setdefault('QUERY_N_PLUS_ONE', 'warn' if debugging else 'off')
+        app.config.setdefault('QUERY_N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('QUERY_SERVER_TIMING', bool(debugging))
+
+        self.enabled = app.config['QUERY_TRACKING_ENABLED']
+        self.comments = app.config['QUERY_COMMENTS_ENABLED']
+        self.mode = app.config['QUERY_N_PLUS_ONE']
+        self.threshold = app.config['QUERY_N_PLUS_ONE_THRESHOLD']
+        self.server_timing = app.config['QUERY_SERVER_TIMING']
+
+        if self.enabled:
+            with app.app_context():
+                for engine in db.engines.values():
+                    self._instrument(engine)
+            app.before_request(self._start_request)
+            app.after_request(self._finish_request)
+
+        app.extensions['query_tracker'] = self
+
+    # ----- cursor events -----
+
+    def _instrument(self, engine):
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_execute, retval=True)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+        if self.comments and has_request_context():
+            request_id = g.get('request_id')
+            if request_id:
+                statement = f"{statement} /* request_id={request_id},endpoint={request.endpoint} */"
+        return statement, parameters
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        queries = g.get('_queries')
+        if queries is None:
+            return
+        started = getattr(context, '_query_started', None)
+        elapsed_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+        # The comment differs per request, fingerprint the statement without it
+        shape = fingerprint(context.statement if context is not None else statement)
+        count = queries.add(shape, elapsed_ms)
+        if self.mode == 'off':
+            return
+        if count == 2:
+            queries.sites[shape] = _call_site()
+        elif count == self.threshold and shape not in queries.reported:
+            queries.reported.add(shape)
+            self._report(queries, shape, count)
+
+    def _report(self, queries, shape, count):
+        self.counters['n_plus_one'] += 1
+        message = (f"N+1 in {request.method} {request.path} ({request.endpoint}): "
+                   f"{count}x {shape[:200]!r} from {queries.sites.get(shape) or 'unknown'}")
+        if self.mode == 'raise':
+            raise NPlusOneError(message)
+        logger.warning(message)
+
+    # ----- request hooks -----
+
+    def _start_request(self):
+        if 'request_id' not in g:
+            g.request_id = str(uuid.uuid4())[:8]
+        g._queries = RequestQueries()
+
+    def _finish_request(self, response):
+        queries = g.pop('_queries', None)
+        if queries is None:
+            return response
+        g.query_stats = queries
+        self.counters['requests'] += 1
+        self.counters['queries'] += queries.count
+        if self.server_timing:
+            response.headers.add('Server-Timing', f'db;dur={queries.total_ms:.2f};desc="{queries.count} queries"')
+        return response
+
+    @staticmethod
+    def current():
+        """Queries of the current request so far, or ``None``"""
+        if not has_request_context():
+            return None
+        return g.get('_queries') or g.get('query_stats')
+
+    def stats(self):
+        return {**self.counters, 'n_plus_one_mode': self.mode, 'threshold': self.threshold}
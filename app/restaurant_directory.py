@@ -0,0 +1,361 @@
+# app/restaurant_directory.py
+"""
+Restaurant directory: the active restaurant list kept in memory, with the
+open/closed state computed from each restaurant's weekly schedule in the
+business timezone (Africa/Algiers, like the database).
+
+Schedules are compiled into a sorted list of open/close transitions covering
+the next few days, so answering "is it open" is a bisect and the listing can
+be cached exactly until the earliest upcoming transition. Committing a change
+to a restaurant, its hours or its holidays invalidates the listing.
+"""
+import bisect
+import logging
+import threading
+from datetime import datetime, date, time, timedelta
+from zoneinfo import ZoneInfo
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = 'Africa/Algiers'
+HORIZON_DAYS = 8
+ALL_DAYS = range(7)
+
+
+def business_timezone():
+    """Timezone the opening hours are expressed in"""
+    name = DEFAULT_TIMEZONE
+    if has_app_context():
+        name = current_app.config.get('BUSINESS_TIMEZONE', DEFAULT_TIMEZONE)
+    return ZoneInfo(name)
+
+
+def _as_time(value):
+    if value is None or isinstance(value, time):
+        return value
+    return time.fromisoformat(value)
+
+
+def _as_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+# ============================================
+# WEEKLY SCHEDULE
+# ============================================
+class WeeklySchedule:
+    """
+    Opening hours per weekday (0 = Monday) plus dated overrides.
+
+    A span whose closing time is not after its opening time runs past
+    midnight (22:00-02:00); equal times mean open around the clock. A dated
+    override replaces the weekly spans that start on that date, an empty
+    override closes the restaurant for the day.
+    """
+
+    def __init__(self, weekly, overrides=None, tz=None):
+        self.weekly = {day: list(spans) for day, spans in weekly.items()}
+        self.overrides = dict(overrides or {})
+        self.tz = tz or business_timezone()
+
+    @classmethod
+    def daily(cls, opens, closes, overrides=None, tz=None):
+        """Same hours every day; no hours at all means always open"""
+        if opens is None or closes is None:
+            opens = closes = time(0)
+        return cls({day: [(opens, closes)] for day in ALL_DAYS}, overrides, tz)
+
+    def spans_on(self, day):
+        """Concrete (open, close) datetimes for the spans starting on ``day``"""
+        spans = self.overrides.get(day)
+        if spans is None:
+            spans = self.weekly.get(day.weekday(), [])
+        for opens, closes in spans:
+            start = datetime.combine(day, opens, tzinfo=self.tz)
+            end_day = day if closes > opens else day + timedelta(days=1)
+            yield start, datetime.combine(end_day, closes, tzinfo=self.tz)
+
+    def intervals(self, start_day, days):
+        """Merged open intervals for spans starting from the day before ``start_day``"""
+        spans = []
+        for offset in range(-1, days + 1):
+            spans.extend(self.spans_on(start_day + timedelta(days=offset)))
+        spans.sort()
+
+        merged = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def compile(self, now, days=HORIZON_DAYS):
+        return CompiledSchedule(self, now, days)
+
+    def is_open_at(self, when=None):
+        when = when or datetime.now(self.tz)
+        return self.compile(when, days=1).is_open_at(when)
+
+
+class CompiledSchedule:
+    """Open/close transitions of a schedule between ``start`` and ``start + days``"""
+
+    def __init__(self, schedule, start, days=HORIZON_DAYS):
+        start = start.astimezone(schedule.tz)
+        self.start = start
+        self.horizon = start + timedelta(days=days)
+        self.initially_open = False
+        self.times = []
+        self.states = []
+
+        for opens, closes in schedule.intervals(start.date(), days):
+            if opens <= start < closes:
+                self.initially_open = True
+            if start < opens < self.horizon:
+                self.times.append(opens)
+                self.states.append(True)
+            if start < closes < self.horizon:
+                self.times.append(closes)
+                self.states.append(False)
+
+    def covers(self, when):
+        return self.start <= when < self.horizon
+
+    def state_at(self, when):
+        """(is_open, next_transition) at ``when``; next is None past the horizon"""
+        idx = bisect.bisect_right(self.times, when)
+        is_open = self.states[idx - 1] if idx else self.initially_open
+        next_transition = self.times[idx] if idx < len(self.times) else None
+        return is_open, next_transition
+
+    def is_open_at(self, when):
+        return self.state_at(when)[0]
+
+
+def build_schedule(opening_time, closing_time, hours=None, holidays=None, tz=None):
+    """
+    Build a schedule from ``restaurant_hours`` rows, falling back to the
+    restaurant's single opening/closing time when it has none.
+
+    ``hours`` is an iterable of (day_of_week, opens_at, closes_at) and
+    ``holidays`` of (holiday_date, opens_at, closes_at); times may be
+    ``time`` objects or ISO strings.
+    """
+    overrides = {}
+    for holiday_date, opens, closes in holidays or ():
+        spans = overrides.setdefault(_as_date(holiday_date), [])
+        if opens is not None and closes is not None:
+            spans.append((_as_time(opens), _as_time(closes)))
+
+    hours = list(hours or ())
+    if not hours:
+        return WeeklySchedule.daily(_as_time(opening_time), _as_time(closing_time), overrides, tz)
+
+    weekly = {}
+    for day_of_week, opens, closes in hours:
+        weekly.setdefault(day_of_week, []).append((_as_time(opens), _as_time(closes)))
+    return WeeklySchedule(weekly, overrides, tz)
+
+
+def schedule_for(restaurant, tz=None):
+    """Schedule of a Restaurant model instance, including chain-wide holidays"""
+    from .models import RestaurantHoliday
+
+    holidays = RestaurantHoliday.query.filter(
+        (RestaurantHoliday.restaurant_id == restaurant.restaurant_id) |
+        (RestaurantHoliday.restaurant_id.is_(None))
+    ).all()
+    return build_schedule(
+        restaurant.opening_time,
+        restaurant.closing_time,
+        hours=[(h.day_of_week, h.opens_at, h.closes_at) for h in restaurant.hours],
+        holidays=[(h.holiday_date, h.opens_at, h.closes_at) for h in holidays],
+        tz=tz
+    )
+
+
+# ============================================
+# DIRECTORY
+# ============================================
+def _entry(restaurant, is_open, next_transition):
+    """Listing entry of a snapshot row"""
+    entry = {k: v for k, v in restaurant.items() if k not in ('hours', 'holidays')}
+    entry['is_open_now'] = is_open
+    entry['next_transition_at'] = next_transition.isoformat() if next_transition else None
+    return entry
+
+
+class RestaurantDirectory:
+    """In-memory listing of active restaurants with their current open state"""
+
+    SNAPSHOT_KEY = 'active'
+
+    def __init__(self, snapshot_ttl=300):
+        self.snapshot_ttl = snapshot_ttl
+        self._snapshots = cache.namespace('restaurant_directory', ttl=snapshot_ttl, stale_ttl=snapshot_ttl)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._compiled = {}
+        self._listing = None
+        self._listed_at = None
+        self._valid_until = None
+
+    # ----- loading -----
+
+    def load_snapshot(self, active=True):
+        """Active (or inactive) restaurants with their hours as plain JSON-safe data"""
+        from .models import Restaurant, RestaurantHours, RestaurantHoliday
+
+        restaurants = Restaurant.query.filter_by(is_active=active).order_by(Restaurant.name).all()
+
+        hours = {}
+        for row in RestaurantHours.query.order_by(RestaurantHours.day_of_week, RestaurantHours.opens_at).all():
+            hours.setdefault(row.restaurant_id, []).append(
+                [row.day_of_week, row.opens_at.isoformat(), row.closes_at.isoformat()]
+            )
+
+        today = datetime.now(business_timezone()).date()
+        holidays = {}
+        upcoming = RestaurantHoliday.query.filter(
+            RestaurantHoliday.holiday_date >= today - timedelta(days=1),
+            RestaurantHoliday.holiday_date <= today + timedelta(days=HORIZON_DAYS + 1)
+        ).all()
+        for row in upcoming:
+            holidays.setdefault(row.restaurant_id, []).append([
+                row.holiday_date.isoformat(),
+                row.opens_at.isoformat() if row.opens_at else None,
+                row.closes_at.isoformat() if row.closes_at else None
+            ])
+
+        return [
+            {
+                "restaurant_id": r.restaurant_id,
+                "name": r.name,
+                "description": r.description,
+                "address": r.address,
+                "phone": r.phone,
+                "email": r.email,
+                "latitude": float(r.latitude) if r.latitude else None,
+                "longitude": float(r.longitude) if r.longitude else None,
+                "delivery_radius": r.delivery_radius,
+                "is_active": r.is_active,
+                "is_open": r.is_open,
+                "opening_time": str(r.opening_time) if r.opening_time else None,
+                "closing_time": str(r.closing_time) if r.closing_time else None,
+                "min_order_amount": float(r.min_order_amount) if r.min_order_amount else 0,
+                "delivery_fee": float(r.delivery_fee) if r.delivery_fee else 0,
+                "estimated_prep_time": r.estimated_prep_time,
+                "rating": float(r.rating) if r.rating else 0,
+                "total_reviews": r.total_reviews,
+                "logo_url": r.logo_url,
+                "banner_url": r.banner_url,
+                "hours": hours.get(r.restaurant_id, []),
+                "holidays": holidays.get(r.restaurant_id, []) + holidays.get(None, [])
+            }
+            for r in restaurants
+        ]
+
+    def invalidate(self):
+        """Reload restaurants and hours on the next lookup (call after edits)"""
+        self._snapshots.invalidate(self.SNAPSHOT_KEY)
+        with self._lock:
+            self._listing = None
+
+    # ----- lookups -----
+
+    def _compile(self, snapshot, now):
+        tz = now.tzinfo
+        self._compiled = {
+            r['restaurant_id']: build_schedule(
+                r['opening_time'], r['closing_time'], r['hours'], r['holidays'], tz
+            ).compile(now)
+            for r in snapshot
+        }
+        self._snapshot = snapshot
+
+    def listing(self, now=None):
+        """
+        Return (restaurants, valid_until).
+
+        Each restaurant carries ``is_open_now`` and ``next_transition_at``;
+        ``valid_until`` is the earliest upcoming transition (capped by the
+        snapshot TTL), so callers can cache the listing until then.
+        """
+        tz = business_timezone()
+        now = (now or datetime.now(tz)).astimezone(tz)
+        snapshot = self._snapshots.get_or_load(self.SNAPSHOT_KEY, self.load_snapshot)
+
+        with self._lock:
+            if (self._listing is not None and snapshot is self._snapshot
+                    and self._listed_at <= now < self._valid_until):
+                return self._listing, self._valid_until
+
+            if snapshot is not self._snapshot or any(not c.covers(now) for c in self._compiled.values()):
+                self._compile(snapshot, now)
+
+            valid_until = now + timedelta(seconds=self.snapshot_ttl)
+            listing = []
+            for r in snapshot:
+                is_open, next_transition = self._compiled[r['restaurant_id']].state_at(now)
+                if not r['is_open']:
+                    # Closed by staff until someone reopens it
+                    is_open, next_transition = False, None
+                if next_transition is not None:
+                    valid_until = min(valid_until, next_transition)
+
+                listing.append(_entry(r, is_open, next_transition))
+
+            self._listing = listing
+            self._listed_at = now
+            self._valid_until = valid_until
+            return listing, valid_until
+
+    def inactive(self):
+        """Deactivated restaurants, uncached, in the listing's shape (never open)"""
+        return [_entry(r, False, None) for r in self.load_snapshot(active=False)]
+
+    def get(self, restaurant_id, now=None):
+        listing, _ = self.listing(now)
+        for entry in listing:
+            if entry['restaurant_id'] == restaurant_id:
+                return entry
+        return None
+
+    def is_open_now(self, restaurant_id, now=None):
+        entry = self.get(restaurant_id, now)
+        return bool(entry and entry['is_open_now'])
+
+
+restaurant_directory = RestaurantDirectory()
+
+
+# ============================================
+# INVALIDATION
+# ============================================
+@event.listens_for(Session, 'before_flush')
+def _collect_restaurant_changes(session, flush_context, instances):
+    from .models import Restaurant, RestaurantHours, RestaurantHoliday
+
+    models = (Restaurant, RestaurantHours, RestaurantHoliday)
+    if any(isinstance(obj, models) for changed in (session.new, session.dirty, session.deleted) for obj in changed):
+        session.info['restaurants_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('restaurants_dirty', False):
+        restaurant_directory.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('restaurants_dirty', None)
@@ -3,11 +3,11 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from app.models import User, Driver
 from app.forms import DriverRegistrationForm
-from app import db
+from app import db, metrics
 from datetime import datetime
 import json
 import traceback
-import psycopg2
+from app.database import pooled_connection, record_write, replica_reads
 
 # Create Blueprint for main routes
 main_bp = Blueprint('main', __name__)
@@ -194,13 +194,7 @@ def simulate_android_order():
 def test_connection():
     """Simple test endpoint"""
     try:
-        conn = psycopg2.connect(
-            host='localhost',
-            database='mega_pizza_db',
-            user='mega_pizza_admin',
-            password='SecurePass123!',
-            port=5432
-        )
+        conn = pooled_connection()
         cur = conn.cursor()
         cur.execute("SELECT 1")
         result = cur.fetchone()
@@ -223,13 +217,7 @@ def test_connection():
 def get_customers():
     """Get all customers"""
     try:
-        conn = psycopg2.connect(
-            host='localhost',
-            database='mega_pizza_db',
-            user='mega_pizza_admin',
-            password='SecurePass123!',
-            port=5432
-        )
+        conn = pooled_connection()
         cur = conn.cursor()
         
         sql = "SELECT customer_id, name, phone_number, email FROM customers ORDER BY customer_id"
@@ -266,13 +254,7 @@ def get_customers():
 def get_restaurants():
     """Get all restaurants"""
     try:
-        conn = psycopg2.connect(
-            host='localhost',
-            database='mega_pizza_db',
-            user='mega_pizza_admin',
-            password='SecurePass123!',
-            port=5432
-        )
+        conn = pooled_connection()
         cur = conn.cursor()
         
         sql = "SELECT restaurant_id, name, address, phone, is_open FROM restaurants WHERE is_active = true ORDER BY restaurant_id"
@@ -315,13 +297,7 @@ def get_addresses():
         return jsonify({'success': False, 'error': 'Customer ID required', 'addresses': []}), 400
     
     try:
-        conn = psycopg2.connect(
-            host='localhost',
-            database='mega_pizza_db',
-            user='mega_pizza_admin',
-            password='SecurePass123!',
-            port=5432
-        )
+        conn = pooled_connection()
         cur = conn.cursor()
         
         sql = "SELECT address_id, street, city, state, postal_code, country, is_default FROM addresses WHERE customer_id = %s ORDER BY is_default DESC, created_at DESC"
@@ -366,13 +342,7 @@ def get_menu_items():
         return jsonify({'success': False, 'error': 'Restaurant ID required', 'items': []}), 400
     
     try:
-        conn = psycopg2.connect(
-            host='localhost',
-            database='mega_pizza_db',
-            user='mega_pizza_admin',
-            password='SecurePass123!',
-            port=5432
-        )
+        conn = pooled_connection()
         cur = conn.cursor()
         
         sql = "SELECT item_id, name, description, price, category, is_available FROM menu_items WHERE restaurant_id = %s ORDER BY category, name"
@@ -411,13 +381,7 @@ def get_menu_items():
 def database_stats():
     """Get database statistics"""
     try:
-        conn = psycopg2.connect(
-            host='localhost',
-            database='mega_pizza_db',
-            user='mega_pizza_admin',
-            password='SecurePass123!',
-            port=5432
-        )
+        conn = pooled_connection()
         cur = conn.cursor()
         
         stats = {}
@@ -688,33 +652,32 @@ def api_test():
     })
 
 @main_bp.route('/api/restaurants')
+@replica_reads
 def api_get_restaurants():
     """Get list of restaurants"""
     try:
-        # Try using SQLAlchemy first
-        with db.engine.connect() as connection:
-            result = connection.execute("""
-                SELECT restaurant_id, name, address, phone, is_open 
-                FROM restaurants 
-                WHERE is_active = true 
-                ORDER BY name
-            """)
-            
-            restaurants = []
-            for row in result:
-                restaurants.append({
-                    "id": row[0],
-                    "name": row[1],
-                    "address": row[2],
-                    "phone": row[3],
-                    "is_open": row[4]
-                })
-            
-            return jsonify({
-                "success": True,
-                "count": len(restaurants),
-                "data": restaurants
-            })
+        from app.api import cache_until
+        from app.restaurant_directory import restaurant_directory
+        
+        listing, valid_until = restaurant_directory.listing()
+        restaurants = [
+            {
+                "id": r["restaurant_id"],
+                "name": r["name"],
+                "address": r["address"],
+                "phone": r["phone"],
+                "is_open": r["is_open_now"],
+                "next_transition_at": r["next_transition_at"]
+            }
+            for r in listing
+        ]
+        
+        response = jsonify({
+            "success": True,
+            "count": len(restaurants),
+            "data": restaurants
+        })
+        return cache_until(response, valid_until)
             
     except Exception as e:
         # Return mock data if database fails
@@ -759,18 +722,11 @@ def api_create_order():
         db_success = False
         db_message = ""
         db_details = {}
+        conn = None
         
         try:
-            # Use raw connection with psycopg2 to avoid SQLAlchemy parameter issues
-            import psycopg2
-            
-            conn = psycopg2.connect(
-                host='localhost',
-                database='mega_pizza_db',
-                user='mega_pizza_admin',
-                password='SecurePass123!',
-                port=5432
-            )
+            # Raw psycopg2 connection from the shared pool (close() returns it)
+            conn = pooled_connection()
             cur = conn.cursor()
             
             db_details['attempt'] = {
@@ -814,7 +770,8 @@ def api_create_order():
                         order_id, customer_id, restaurant_id, 
                         order_status, subtotal, tax, delivery_fee, total_amount,
                         payment_method, payment_status, created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW() AT TIME ZONE 'UTC')
+                    RETURNING created_at
                 """
                 
                 cur.execute(
@@ -832,6 +789,8 @@ def api_create_order():
                         'pending'
                     )
                 )
+                # Items live in the order's partition
+                order_created_at = cur.fetchone()[0]
                 
                 # Insert order items if provided
                 items = data.get('items', [])
@@ -841,14 +800,15 @@ def api_create_order():
                         
                         insert_item_sql = """
                             INSERT INTO order_items (
-                                order_id, item_id, quantity, unit_price, created_at
-                            ) VALUES (%s, %s, %s, %s, NOW())
+                                order_id, order_created_at, item_id, quantity, unit_price, created_at
+                            ) VALUES (%s, %s, %s, %s, %s, NOW() AT TIME ZONE 'UTC')
                         """
                         
                         cur.execute(
                             insert_item_sql,
                             (
                                 order_id,
+                                order_created_at,
                                 item.get('item_id', 'ITEM-001'),
                                 item.get('quantity', 1),
                                 item_price
@@ -856,6 +816,8 @@ def api_create_order():
                         )
                 
                 conn.commit()
+                record_write()
+                metrics.order_created('web')
                 db_success = True
                 db_message += "Order saved successfully!"
                 
@@ -877,6 +839,10 @@ def api_create_order():
             import traceback
             db_details['error_details'] = traceback.format_exc()
             
+            # Roll back and hand the connection back to the pool
+            if conn is not None:
+                conn.close()
+            
             # Try alternative approach if the first fails
             try:
                 # Try using SQLAlchemy text() with parameters
@@ -0,0 +1,284 @@
+# app/slow_queries.py
+"""
+Slow-query recorder.
+
+Every statement slower than ``SLOW_QUERY_MS`` is recorded with its
+(redacted) parameters, duration, endpoint and request id in a per-worker
+ring buffer, and aggregated by fingerprint for the top-N table on
+``/admin/system/health``.
+
+A sampled share of slow SELECTs (``SLOW_QUERY_EXPLAIN_SAMPLE``, at most once
+per fingerprint every ``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds) is re-run as
+``EXPLAIN (ANALYZE, BUFFERS)`` by a background thread on its own connection,
+inside a transaction that is rolled back, so the request that hit the slow
+query never waits for it. The plan is taken with the real values; the
+stored parameters and the string literals in the stored plan are redacted
+down to identifiers and known enum values.
+"""
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from .query_stats import fingerprint
+
+logger = logging.getLogger(__name__)
+
+SENSITIVE_KEYS = re.compile(r'pass|token|secret|hash|email|phone|card|session', re.IGNORECASE)
+# Identifiers (ORD-..., REST-002) are safe to keep
+SAFE_STRING = re.compile(r'^[A-Z]{2,6}-[A-Za-z0-9-]{1,40}$')
+# ...and so are the enum values the schema uses (statuses, roles, types);
+# any other lowercase word may be a name or a password
+SAFE_VALUES = frozenset((
+    'pending', 'confirmed', 'preparing', 'ready', 'out_for_delivery', 'delivered', 'cancelled',
+    'paid', 'failed', 'refunded',
+    'delivery', 'pickup',
+    'admin', 'manager', 'employee', 'driver', 'user', 'customer', 'restaurant', 'system',
+    'car', 'motorcycle', 'bicycle', 'scooter',
+    'access', 'refresh',
+))
+# Quoted literals in EXPLAIN output, which is taken with the real values
+PLAN_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+
+
+def _safe_string(value):
+    return value in SAFE_VALUES or bool(SAFE_STRING.match(value))
+
+
+def redact_value(key, value):
+    if value is None or isinstance(value, (bool, int, float, Decimal, date, datetime)):
+        return value if not (key and SENSITIVE_KEYS.search(str(key))) else '[redacted]'
+    if isinstance(value, str):
+        if key and SENSITIVE_KEYS.search(str(key)):
+            return '[redacted]'
+        return value if _safe_string(value) else f'[str:{len(value)}]'
+    if isinstance(value, (list, tuple)):
+        return [redact_value(key, item) for item in value[:20]]
+    return f'[{type(value).__name__}]'
+
+
+def redact(parameters):
+    """Copy of the statement parameters that is safe to show to admins"""
+    if isinstance(parameters, dict):
+        return {key: redact_value(key, value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: the first row is enough to see the shape
+            return [redact(parameters[0]), f'... {len(parameters)} rows']
+        return [redact_value(None, value) for value in parameters]
+    return parameters
+
+
+def redact_plan(plan):
+    """EXPLAIN text with the string literals that are not safe to keep replaced"""
+    def literal(match):
+        value = match.group(1).replace("''", "'")
+        # Arrays ('{pending,ready}') are kept when every element is
+        items = value[1:-1].split(',') if value.startswith('{') and value.endswith('}') else [value]
+        return match.group(0) if all(_safe_string(item.strip('"')) for item in items) else f"'[str:{len(value)}]'"
+    return PLAN_LITERAL.sub(literal, plan)
+
+
+def _explainable(statement):
+    head = statement.lstrip()[:6].upper()
+    return head == 'SELECT' and 'FOR UPDATE' not in statement.upper()
+
+
+class SlowQueryLog:
+    """Flask extension recording slow statements and sampling their plans"""
+
+    def __init__(self, app=None, db=None):
+        self.threshold_ms = 200
+        self.explain_sample = 0.1
+        self.explain_interval = 300
+        self.explain_timeout_ms = 10000
+        self.max_fingerprints = 500
+        self.records = deque(maxlen=200)
+        self._by_fingerprint = {}
+        self._explained_at = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=10)
+        self._pid = None
+        self._engines = set()
+        self._counter = None
+        self.counters = {'recorded': 0, 'explained': 0, 'explain_errors': 0, 'explain_skipped': 0}
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SLOW_QUERY_MS', 200)
+        app.config.setdefault('SLOW_QUERY_BUFFER', 200)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN_SAMPLE', 0.1)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 10000)
+
+        self.threshold_ms = app.config['SLOW_QUERY_MS']
+        self.records = deque(maxlen=app.config['SLOW_QUERY_BUFFER'])
+        self.explain_sample = app.config['SLOW_QUERY_EXPLAIN_SAMPLE']
+        self.explain_interval = app.config['SLOW_QUERY_EXPLAIN_INTERVAL']
+        self.explain_timeout_ms = app.config['SLOW_QUERY_EXPLAIN_TIMEOUT_MS']
+
+        if self.threshold_ms:
+            with app.app_context():
+                for engine in db.engines.values():
+                    self._instrument(engine)
+
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            self._counter = metrics.registry.counter(
+                'db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS', ('endpoint',))
+
+        app.extensions['slow_query_log'] = self
+
+    def _instrument(self, engine):
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    # ----- recording -----
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_slow_query_started', None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+        # Without the request-id comment added by the query tracker
+        self.record(conn.engine, context.statement, parameters, elapsed_ms, executemany)
+
+    def record(self, engine, statement, parameters, elapsed_ms, executemany=False):
+        in_request = has_request_context()
+        shape = fingerprint(statement)
+        entry = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'ms': round(elapsed_ms, 1),
+            'statement': statement[:4000],
+            'parameters': redact(parameters),
+            'fingerprint': shape,
+            'endpoint': request.endpoint if in_request else None,
+            'request_id': g.get('request_id') if in_request else None,
+            'path': request.path if in_request else None,
+            'database': engine.url.database,
+            'plan': None
+        }
+
+        with self._lock:
+            self.records.append(entry)
+            aggregate = self._by_fingerprint.get(shape)
+            if aggregate is None:
+                if len(self._by_fingerprint) >= self.max_fingerprints:
+                    smallest = min(self._by_fingerprint, key=lambda key: self._by_fingerprint[key]['total_ms'])
+                    del self._by_fingerprint[smallest]
+                aggregate = self._by_fingerprint[shape] = {
+                    'fingerprint': shape, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'endpoints': set(), 'last': None, 'plan': None
+                }
+            aggregate['count'] += 1
+            aggregate['total_ms'] += elapsed_ms
+            aggregate['max_ms'] = max(aggregate['max_ms'], elapsed_ms)
+            if entry['endpoint']:
+                aggregate['endpoints'].add(entry['endpoint'])
+            aggregate['last'] = entry
+        self.counters['recorded'] += 1
+        if self._counter is not None:
+            self._counter.inc(entry['endpoint'] or 'background')
+
+        logger.warning(f"Slow query ({elapsed_ms:.0f}ms) in {entry['endpoint'] or 'background'} "
+                       f"[{entry['request_id']}]: {shape[:200]}")
+
+        if not executemany and self._should_explain(engine, shape, statement):
+            try:
+                self._queue.put_nowait((engine, statement, parameters, entry, shape))
+                self._ensure_thread()
+            except queue.Full:
+                self.counters['explain_skipped'] += 1
+
+    def _should_explain(self, engine, shape, statement):
+        if not self.explain_sample or engine.dialect.name != 'postgresql' or not _explainable(statement):
+            return False
+        if random.random() >= self.explain_sample:
+            return False
+        now = time.time()
+        with self._lock:
+            if now - self._explained_at.get(shape, 0) < self.explain_interval:
+                return False
+            self._explained_at[shape] = now
+        return True
+
+    # ----- plans -----
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='slow-query-explain', daemon=True).start()
+
+    def _run(self):
+        while True:
+            engine, statement, parameters, entry, shape = self._queue.get()
+            try:
+                plan = self.explain(engine, statement, parameters)
+            except Exception as e:
+                self.counters['explain_errors'] += 1
+                logger.warning(f"EXPLAIN for slow query failed: {e}")
+                continue
+            self.counters['explained'] += 1
+            with self._lock:
+                entry['plan'] = plan
+                aggregate = self._by_fingerprint.get(shape)
+                if aggregate is not None:
+                    aggregate['plan'] = plan
+
+    def explain(self, engine, statement, parameters):
+        """``EXPLAIN (ANALYZE, BUFFERS)`` on a connection of its own, rolled back afterwards"""
+        with engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                rows = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                return redact_plan('\n'.join(row[0] for row in rows))
+            finally:
+                trans.rollback()
+
+    # ----- reporting -----
+
+    def top(self, limit=10):
+        """Fingerprints by total time spent above the threshold"""
+        with self._lock:
+            rows = sorted(self._by_fingerprint.values(), key=lambda row: row['total_ms'], reverse=True)[:limit]
+            return [{
+                'fingerprint': row['fingerprint'][:500],
+                'count': row['count'],
+                'total_ms': round(row['total_ms'], 1),
+                'avg_ms': round(row['total_ms'] / row['count'], 1),
+                'max_ms': round(row['max_ms'], 1),
+                'endpoints': sorted(row['endpoints']),
+                'last': row['last'],
+                'plan': row['plan']
+            } for row in rows]
+
+    def recent(self, limit=50):
+        with self._lock:
+            return list(self.records)[-limit:][::-1]
+
+    def stats(self):
+        return {**self.counters, 'threshold_ms': self.threshold_ms, 'buffered': len(self.records)}
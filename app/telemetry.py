@@ -0,0 +1,13 @@
+# app/telemetry.py
+"""
+Prometheus metrics for the web app. The implementation is shared with the
+mobile API service and lives in api/shared/telemetry.py, the only place that
+service's image can import it from.
+"""
+from api.shared.telemetry import (
+    CONTENT_TYPE, LATENCY_BUCKETS, Counter, Gauge, Histogram, Metrics, MetricsRegistry,
+    cache_collector, cache_hit_ratio, exposition, hdr_buckets, merge, pool_collector
+)
+
+__all__ = ['CONTENT_TYPE', 'LATENCY_BUCKETS', 'Counter', 'Gauge', 'Histogram', 'Metrics', 'MetricsRegistry',
+           'cache_collector', 'cache_hit_ratio', 'exposition', 'hdr_buckets', 'merge', 'pool_collector']
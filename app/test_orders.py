@@ -2,6 +2,7 @@
 from flask import Blueprint, render_template, jsonify, request, flash, redirect, url_for
 from flask_login import login_required, current_user
 from .models import User, Restaurant, Customer, Order, OrderItem, MenuItem, Address, Driver, db
+from .order_transitions import transition, next_status
 from datetime import datetime, timedelta
 import random
 import string
@@ -581,32 +582,13 @@ def simulate_order_flow(order_id):
     try:
         order = Order.query.get_or_404(order_id)
         
-        # Define order flow
-        status_flow = {
-            'pending': 'confirmed',
-            'confirmed': 'preparing',
-            'preparing': 'ready',
-            'ready': 'out_for_delivery' if order.delivery_type == 'delivery' else 'ready_for_pickup',
-            'out_for_delivery': 'delivered',
-            'ready_for_pickup': 'delivered'
-        }
-        
         current_status = order.order_status
+        new_status = next_status(order)
         
-        if current_status in status_flow:
-            new_status = status_flow[current_status]
-            order.order_status = new_status
-            
-            # Update timestamps
-            now = datetime.utcnow()
-            if new_status == 'confirmed':
-                order.confirmed_at = now
-            elif new_status == 'preparing':
-                order.preparing_at = now
-            elif new_status == 'ready':
-                order.ready_at = now
-            elif new_status == 'delivered':
-                order.delivered_at = now
+        if new_status:
+            transition(order, new_status, actor_type='system', changed_by=current_user.user_id,
+                       source='auto_system', public_notes='Simulated order flow')
+            if new_status == 'delivered':
                 order.payment_status = 'paid'
             
             db.session.commit()
@@ -0,0 +1,97 @@
+# bench_dispatch.py
+"""
+Dispatch solver benchmark: one simulated dispatch round of 1,000 ready
+orders and 300 available drivers, no database needed.
+
+Orders come from 60 restaurants spread over the city, drivers are scattered
+around them with random ratings and 0-2 orders already carried. Each round
+builds the cost matrix and solves it through app.dispatch.assign (optimal
+for this size, see DISPATCH_OPTIMAL_MAX), and for comparison with the
+greedy solver alone, and reports per round:
+
+  - cost matrix and solve time (mean and p95)
+  - orders assigned and mean pickup distance
+  - how much more pickup distance the greedy assignment costs
+
+    python bench_dispatch.py [orders] [drivers] [rounds]
+
+Exits 1 when a full round (matrix + solve) takes 100 ms or more at p95.
+"""
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.dispatch import assign, cost_matrix, haversine_matrix, solve_greedy, INFEASIBLE
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+DRIVERS = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+ROUNDS = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+RESTAURANTS = 60
+BUDGET_MS = 100
+CENTER = (36.7538, 3.0588)  # Algiers
+MAX_PICKUP_KM = 10.0
+
+
+def simulate(rng):
+    """Drivers and orders of one round, as Dispatcher.run_once hands them to cost_matrix"""
+    restaurants = np.column_stack([rng.normal(CENTER[0], 0.05, RESTAURANTS),
+                                   rng.normal(CENTER[1], 0.07, RESTAURANTS)])
+    # Busy restaurants produce most orders
+    picked = rng.choice(RESTAURANTS, ORDERS, p=rng.dirichlet(np.ones(RESTAURANTS) * 0.7))
+    near = restaurants[rng.choice(RESTAURANTS, DRIVERS)]
+    orders = {'lat': restaurants[picked, 0], 'lng': restaurants[picked, 1],
+              'waiting': rng.exponential(4, ORDERS)}
+    drivers = {'lat': near[:, 0] + rng.normal(0, 0.02, DRIVERS), 'lng': near[:, 1] + rng.normal(0, 0.025, DRIVERS),
+               'rating': rng.uniform(3.5, 5, DRIVERS), 'load': rng.choice(3, DRIVERS, p=(0.7, 0.2, 0.1))}
+    return drivers, orders
+
+
+def pickup_km(drivers, orders, rows, cols):
+    distance = haversine_matrix(drivers['lat'][rows], drivers['lng'][rows], orders['lat'][cols], orders['lng'][cols])
+    return float(np.diagonal(distance).sum())
+
+
+def main():
+    rng = np.random.default_rng(47)
+    matrix_ms, solve_ms, round_ms, assigned, extra = [], [], [], [], []
+    method = None
+
+    # Timings only compare on the same hardware; say which
+    print(f"🛵 {ROUNDS} dispatch rounds of {ORDERS:,} orders x {DRIVERS:,} drivers "
+          f"({platform.processor() or platform.machine()}, {os.cpu_count()} CPUs, NumPy {np.__version__})...")
+    for _ in range(ROUNDS):
+        drivers, orders = simulate(rng)
+        started = time.perf_counter()
+        cost = cost_matrix(drivers, orders, max_pickup_km=MAX_PICKUP_KM)
+        built = time.perf_counter()
+        rows, cols, method = assign(cost)
+        done = time.perf_counter()
+        matrix_ms.append((built - started) * 1000)
+        solve_ms.append((done - built) * 1000)
+        round_ms.append((done - started) * 1000)
+        assigned.append(len(rows))
+
+        greedy_rows, greedy_cols = solve_greedy(cost)
+        feasible = cost[greedy_rows, greedy_cols] < INFEASIBLE
+        extra.append(pickup_km(drivers, orders, greedy_rows[feasible], greedy_cols[feasible])
+                     / max(pickup_km(drivers, orders, rows, cols), 1e-9) - 1)
+
+    p95 = float(np.percentile(round_ms, 95))
+    print(f"\n   {'step':<16} {'mean':>10} {'p95':>10}")
+    for label, samples in (('cost matrix', matrix_ms), (f'solve ({method})', solve_ms), ('round', round_ms)):
+        print(f"   {label:<16} {np.mean(samples):>8.1f}ms {np.percentile(samples, 95):>8.1f}ms")
+    print(f"\n   assigned {np.mean(assigned):.0f} of {min(ORDERS, DRIVERS)} possible per round, "
+          f"greedy pickups {np.mean(extra) * 100:+.1f}% km")
+
+    ok = p95 < BUDGET_MS
+    print(f"\n{'✅' if ok else '❌'} p95 round {p95:.1f}ms (budget {BUDGET_MS}ms)")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
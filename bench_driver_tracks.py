@@ -0,0 +1,115 @@
+# bench_driver_tracks.py
+"""
+Driver track compression benchmark: simulated shifts of GPS pings through
+app.driver_tracks, no database needed.
+
+Each driver pings every 3 seconds for an hour with 4 m of GPS noise, driving
+at city speeds with stops at lights and handovers. Pings go through
+TrackRecorder exactly as LocationIngestor feeds it, and the report covers:
+
+  - fixes kept by Douglas-Peucker at TRACK_TOLERANCE_M
+  - bytes per received fix against one row per ping (~60 bytes of tuple
+    header, columns and index entry)
+  - the worst gap between a received ping and the decoded track at the same
+    time, which the tolerance bounds
+  - segments written and compression throughput
+
+    python bench_driver_tracks.py [drivers] [tolerance_m]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.driver_tracks import TrackRecorder, decode_track
+
+DRIVERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+TOLERANCE_M = float(sys.argv[2]) if len(sys.argv) > 2 else 8.0
+PING_SECONDS = 3
+SHIFT_SECONDS = 3600
+ROW_BYTES = 60
+METRES_PER_DEGREE = 111_320.0
+
+
+def shift(rng, driver_id, start):
+    """An hour of one driver's pings: legs at varying speed and heading, stops in between"""
+    lat, lng = 36.7538 + rng.normal(0, 0.03), 3.0588 + rng.normal(0, 0.04)
+    heading, speed, stop = rng.uniform(0, 2 * np.pi), 0.0, 0
+    pings = []
+    for n in range(SHIFT_SECONDS // PING_SECONDS):
+        if stop:
+            stop -= 1
+            speed = 0.0
+        else:
+            if rng.random() < 0.02:
+                stop = int(rng.integers(5, 40))  # light or handover
+            if rng.random() < 0.05:
+                heading += rng.normal(0, np.pi / 4)  # turn
+            speed = float(np.clip(speed + rng.normal(1, 1.5), 0, 14))  # m/s
+        lat += speed * PING_SECONDS * np.sin(heading) / METRES_PER_DEGREE
+        lng += speed * PING_SECONDS * np.cos(heading) / (METRES_PER_DEGREE * np.cos(np.radians(lat)))
+        pings.append({
+            'driver_id': driver_id,
+            'latitude': lat + rng.normal(0, 4) / METRES_PER_DEGREE,
+            'longitude': lng + rng.normal(0, 4) / METRES_PER_DEGREE,
+            'recorded_at': start + timedelta(seconds=n * PING_SECONDS),
+        })
+    return pings
+
+
+def worst_gap_m(pings, fixes):
+    """Largest distance between a ping and the decoded track interpolated at its time"""
+    start = fixes[0][0]
+    seconds = [(fix[0] - start).total_seconds() for fix in fixes]
+    at = [(ping['recorded_at'] - start).total_seconds() for ping in pings]
+    lat = np.interp(at, seconds, [fix[1] for fix in fixes])
+    lng = np.interp(at, seconds, [fix[2] for fix in fixes])
+    dy = (lat - [ping['latitude'] for ping in pings]) * METRES_PER_DEGREE
+    dx = (lng - [ping['longitude'] for ping in pings]) * METRES_PER_DEGREE * np.cos(np.radians(lat))
+    return float(np.hypot(dx, dy).max())
+
+
+def main():
+    rng = np.random.default_rng(50)
+    start = datetime(2026, 1, 9, 18, 0)
+    shifts = [shift(rng, driver_id, start) for driver_id in range(1, DRIVERS + 1)]
+    recorder = TrackRecorder(tolerance_m=TOLERANCE_M)
+
+    print(f"📍 {DRIVERS:,} drivers, {SHIFT_SECONDS // 60} min of pings every {PING_SECONDS}s, "
+          f"{TOLERANCE_M:g} m tolerance...")
+    segments, elapsed = [], 0.0
+    # Feed a flush interval at a time, as the ingestor does
+    for offset in range(0, SHIFT_SECONDS, PING_SECONDS):
+        now = start + timedelta(seconds=offset)
+        step = offset // PING_SECONDS
+        recorder.add([pings[step] for pings in shifts])
+        if step % 3 == 2:
+            began = time.perf_counter()
+            segments.extend(recorder.cut(now=now))
+            elapsed += time.perf_counter() - began
+    began = time.perf_counter()
+    segments.extend(recorder.cut(force=True))
+    elapsed += time.perf_counter() - began
+    recorder.count(segments)
+
+    stored = sum(len(row['deltas']) + 40 for row, _ in segments)  # + fixed columns and index entry
+    gaps = [worst_gap_m(pings, decode_track(SimpleNamespace(**row))) for row, pings in segments if row['points'] > 1]
+    received = recorder.points_in
+
+    print(f"\n   {'fixes received':<24} {received:>12,}")
+    print(f"   {'fixes kept':<24} {recorder.points_kept:>12,} ({recorder.points_kept / received * 100:.1f}%)")
+    print(f"   {'segments':<24} {len(segments):>12,}")
+    print(f"   {'bytes per received fix':<24} {stored / received:>12.2f} (one row per ping ~{ROW_BYTES})")
+    print(f"   {'storage vs rows':<24} {ROW_BYTES * received / stored:>11.1f}x smaller")
+    print(f"   {'worst gap to pings':<24} {max(gaps):>10.1f} m (p95 {np.percentile(gaps, 95):.1f} m per segment)")
+    print(f"   {'compression':<24} {received / elapsed:>12,.0f} fixes/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# bench_login_burst.py
+"""
+Login burst benchmark: order-path latency with and without a concurrent
+storm of /api/auth/login requests.
+
+Start the app (e.g. gunicorn with a few threads) and run:
+
+    python bench_login_burst.py [base_url] [logins] [concurrency] [order_id]
+
+Logins beyond the verification pool's capacity are expected to come back as
+429; the point is that order requests keep their baseline latency.
+"""
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else 'http://localhost:5000'
+LOGINS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+ORDER_ID = sys.argv[4] if len(sys.argv) > 4 else None
+PROBES = 100
+
+USERNAME = 'admin'
+PASSWORD = 'Admin@123'
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def login():
+    response = requests.post(f"{BASE_URL}/api/auth/login",
+                             json={'username': USERNAME, 'password': PASSWORD}, timeout=30)
+    return response
+
+
+def probe_orders(session, headers, order_id, count, stop=None):
+    """Time order-path requests (order detail, or the order form's data if no order)"""
+    url = f"{BASE_URL}/api/orders/{order_id}" if order_id else f"{BASE_URL}/api/restaurants"
+    timings = []
+    for _ in range(count):
+        if stop is not None and stop.is_set():
+            break
+        start = time.perf_counter()
+        session.get(url, headers=headers, timeout=30)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    print(f"   {label:<18} n={len(timings):<4} p50={percentile(timings, 50):7.1f}ms "
+          f"p95={percentile(timings, 95):7.1f}ms p99={percentile(timings, 99):7.1f}ms")
+
+
+def main():
+    print(f"🔐 Login burst benchmark against {BASE_URL}")
+
+    response = login()
+    if response.status_code != 200:
+        print(f"❌ Login failed: {response.status_code} {response.text[:200]}")
+        sys.exit(1)
+    token = response.json()['data']['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    session = requests.Session()
+    order_id = ORDER_ID
+
+    # Baseline
+    baseline = probe_orders(session, headers, order_id, PROBES)
+
+    # Same probes while logins hammer the server
+    statuses = {}
+    status_lock = threading.Lock()
+
+    def one_login(_):
+        try:
+            code = login().status_code
+        except requests.RequestException:
+            code = 'error'
+        with status_lock:
+            statuses[code] = statuses.get(code, 0) + 1
+
+    burst_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        futures = [pool.submit(one_login, i) for i in range(LOGINS)]
+        during = probe_orders(session, headers, order_id, PROBES)
+        for future in futures:
+            future.result()
+    burst_seconds = time.perf_counter() - burst_start
+
+    print(f"\n📊 Order path ({'order detail' if order_id else 'restaurant list'})")
+    report('baseline', baseline)
+    report('during burst', during)
+
+    print(f"\n🔑 {LOGINS} logins x{CONCURRENCY} in {burst_seconds:.1f}s")
+    for code, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        print(f"   {code}: {count}")
+
+    slowdown = percentile(during, 95) / max(percentile(baseline, 95), 0.001)
+    print(f"\np95 slowdown during burst: {slowdown:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
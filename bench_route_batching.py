@@ -0,0 +1,145 @@
+# bench_route_batching.py
+"""
+Offline evaluation of multi-drop route batching: how many driver-minutes
+app.route_batching would have saved on past deliveries.
+
+Replays delivered orders of the last days: orders are cut into dispatch
+rounds by the time they became ready (DISPATCH_INTERVAL seconds per round),
+each round is batched with the ROUTE_BATCH_* settings, and the trips are
+compared with one trip per order:
+
+  - driver-minutes per trip: a pickup leg (PICKUP_MINUTES, the typical time
+    for a driver to reach the restaurant), the drive through the drops and
+    the handovers
+  - orders delivered in multi-drop trips, and the minutes batching added to
+    their delivery (mean and worst, bounded by ROUTE_BATCH_MAX_DELAY)
+
+    DATABASE_URL=postgresql://... python bench_route_batching.py [days]
+    python bench_route_batching.py --simulate [orders]
+
+--simulate replays a synthetic evening instead (orders from 60 restaurants
+over three hours, drops within 4 km), no database needed.
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.route_batching import DEFAULT_DROP_MINUTES, batch_orders, direct_minutes
+
+SIMULATE = '--simulate' in sys.argv
+ARGS = [arg for arg in sys.argv[1:] if arg.isdigit()]
+DAYS = int(ARGS[0]) if ARGS and not SIMULATE else 7
+SIMULATED_ORDERS = int(ARGS[0]) if ARGS and SIMULATE else 3000
+PICKUP_MINUTES = 8.0
+
+REPLAY = """
+SELECT o.order_id, o.restaurant_id, r.latitude, r.longitude,
+       a.latitude AS drop_latitude, a.longitude AS drop_longitude, h.changed_at AS ready_at
+FROM orders o
+JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+JOIN addresses a ON a.address_id = o.address_id
+JOIN order_status_history h ON h.order_id = o.order_id AND h.order_created_at = o.created_at
+                           AND h.new_status = 'ready'
+WHERE o.delivery_type = 'delivery' AND o.order_status = 'delivered'
+  AND o.created_at >= :since
+  AND r.latitude IS NOT NULL AND a.latitude IS NOT NULL
+ORDER BY h.changed_at
+"""
+
+
+def replayed_orders(days):
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        with db.engine.connect() as conn:
+            rows = conn.execute(text(REPLAY), {'since': datetime.utcnow() - timedelta(days=days)}).all()
+        settings = {key: app.config[key] for key in app.config if key.startswith(('ROUTE_', 'DISPATCH_INTERVAL'))}
+    return [{
+        'order_id': row.order_id,
+        'restaurant_id': row.restaurant_id,
+        'pickup': (float(row.latitude), float(row.longitude)),
+        'drop': (float(row.drop_latitude), float(row.drop_longitude)),
+        'ready_at': row.ready_at,
+    } for row in rows], settings
+
+
+def simulated_orders(count):
+    rng = np.random.default_rng(48)
+    restaurants = np.column_stack([rng.normal(36.7538, 0.05, 60), rng.normal(3.0588, 0.07, 60)])
+    popularity = rng.dirichlet(np.ones(60) * 0.7)
+    start = datetime(2026, 1, 9, 18, 0)
+    orders = []
+    for n, seconds in enumerate(np.sort(rng.uniform(0, 3 * 3600, count))):
+        restaurant = rng.choice(60, p=popularity)
+        angle, km = rng.uniform(0, 2 * np.pi), rng.uniform(0.3, 4)
+        pickup = tuple(restaurants[restaurant])
+        orders.append({
+            'order_id': f'SIM-{n:06d}',
+            'restaurant_id': f'REST-{restaurant:03d}',
+            'pickup': pickup,
+            'drop': (pickup[0] + km / 111 * np.sin(angle), pickup[1] + km / 89 * np.cos(angle)),
+            'ready_at': start + timedelta(seconds=float(seconds)),
+        })
+    return orders, {}
+
+
+def rounds(orders, interval):
+    """Orders grouped by the dispatch round that would have picked them up"""
+    grouped = {}
+    for order in orders:
+        grouped.setdefault(int(order['ready_at'].timestamp() // interval), []).append(order)
+    for key in sorted(grouped):
+        closes = datetime.fromtimestamp((key + 1) * interval)
+        yield [{**order, 'waiting': (closes - order['ready_at']).total_seconds() / 60} for order in grouped[key]]
+
+
+def main():
+    orders, settings = simulated_orders(SIMULATED_ORDERS) if SIMULATE else replayed_orders(DAYS)
+    if not orders:
+        print(f"❌ No delivered orders with restaurant and address coordinates in the last {DAYS} days")
+        return 1
+    interval = settings.get('DISPATCH_INTERVAL', 15)
+    batching = {
+        'max_orders': settings.get('ROUTE_BATCH_MAX_ORDERS', 3),
+        'max_delay': settings.get('ROUTE_BATCH_MAX_DELAY', 10.0),
+        'radius_km': settings.get('ROUTE_BATCH_RADIUS_KM', 2.0),
+        'speed_kmh': settings.get('ROUTE_SPEED_KMH', 25.0),
+    }
+
+    single_minutes = batched_minutes = 0.0
+    trips = batched_orders = 0
+    added = []
+    for batch in rounds(orders, interval):
+        for trip in batch_orders(batch, **batching):
+            trips += 1
+            batched_minutes += PICKUP_MINUTES + trip['minutes']
+            single_minutes += trip['saved'] + trip['minutes'] + PICKUP_MINUTES * len(trip['orders'])
+            if len(trip['orders']) > 1:
+                batched_orders += len(trip['orders'])
+                added.extend(arrival - direct_minutes(trip['pickup'], order['drop'], batching['speed_kmh'])
+                             for order, arrival in zip(trip['orders'], trip['arrivals']))
+
+    source = 'simulated' if SIMULATE else f'last {DAYS} days'
+    print(f"🗺️  {len(orders):,} delivered orders ({source}), {interval}s dispatch rounds, "
+          f"up to {batching['max_orders']} drops within {batching['radius_km']} km, "
+          f"{batching['max_delay']} min max delay\n")
+    print(f"   {'one trip per order':<26} {len(orders):>8,} trips {single_minutes:>12,.0f} driver-minutes")
+    print(f"   {'batched':<26} {trips:>8,} trips {batched_minutes:>12,.0f} driver-minutes")
+    saved = single_minutes - batched_minutes
+    print(f"\n   saved {saved:,.0f} driver-minutes ({saved / single_minutes * 100:.1f}%), "
+          f"{saved / len(orders):.1f} per order")
+    print(f"   {batched_orders:,} orders ({batched_orders / len(orders) * 100:.1f}%) went in multi-drop trips")
+    if added:
+        print(f"   delivery delay from batching: {np.mean(added):.1f} min mean, {np.max(added):.1f} min worst "
+              f"(handover {DEFAULT_DROP_MINUTES:g} min per earlier drop included)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# check_active_order_plans.py
+"""
+Planner regression check for the partial "active orders" indexes.
+
+Inside a transaction that is rolled back at the end, loads a realistic
+shape into orders (mostly delivered/cancelled history, a thin slice of open
+orders), ANALYZEs it and EXPLAINs the queries that must use
+idx_orders_active, idx_orders_active_restaurant or idx_orders_active_driver:
+the Order.active() / Order.active_orders() helpers, /api/health's counter,
+the raw dashboard counters in routes.py and the active_orders view.
+
+    DATABASE_URL=postgresql://... python check_active_order_plans.py [rows] [-v]
+
+Exits 1 when a query does not use the index it should (run it after
+touching the indexes, the helpers or the queries that filter on status).
+Counts and scans over the whole open slice may use any of the three: each
+holds only open orders, and the planner picks the smallest.
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from app import create_app, db
+from app.models import Order
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 200_000
+ACTIVE_INDEXES = ('idx_orders_active', 'idx_orders_active_restaurant', 'idx_orders_active_driver')
+ANY_ACTIVE = set(ACTIVE_INDEXES)
+
+FILL = """
+INSERT INTO orders (order_id, customer_id, restaurant_id, driver_id, order_status, delivery_type,
+                    subtotal, total_amount, created_at)
+SELECT 'PLAN-' || n, :customer_id, :restaurant_id, :driver_id,
+       CASE WHEN n % 500 = 0
+            THEN (ARRAY['pending', 'confirmed', 'preparing', 'ready', 'out_for_delivery'])[n % 5 + 1]
+            ELSE (ARRAY['delivered', 'delivered', 'delivered', 'cancelled'])[n % 4 + 1] END,
+       'delivery', 20, 22,
+       (CURRENT_TIMESTAMP AT TIME ZONE 'UTC') - (n % 20) * INTERVAL '1 day' - (n % 1440) * INTERVAL '1 minute'
+FROM generate_series(1, :rows) AS n
+"""
+
+
+def sql(query):
+    return str(query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def count_sql(query):
+    return sql(query.with_entities(db.func.count()))
+
+
+def index_names(conn):
+    """Index name in plans (partition indexes included) -> active index it belongs to"""
+    names = {}
+    for parent in ACTIVE_INDEXES:
+        for (child,) in conn.execute(text(
+            "SELECT relid::regclass::text FROM pg_partition_tree(CAST(:index AS regclass))"
+        ), {'index': parent}):
+            names[child.split('.')[-1]] = parent
+    return names
+
+
+def main():
+    app = create_app()
+    failures = 0
+    with app.app_context():
+        with db.engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                restaurant_id = conn.execute(text("SELECT restaurant_id FROM restaurants LIMIT 1")).scalar()
+                customer_id = conn.execute(text("SELECT customer_id FROM customers LIMIT 1")).scalar()
+                driver_id = conn.execute(text("SELECT driver_id FROM drivers LIMIT 1")).scalar()
+                if not (restaurant_id and customer_id and driver_id):
+                    print("❌ Needs at least one restaurant, customer and driver (db/init.sql sample data)")
+                    return 1
+
+                print(f"📦 Loading {ROWS:,} orders (1 in 500 open) and analyzing...")
+                conn.execute(text(FILL), {
+                    'rows': ROWS, 'customer_id': customer_id, 'restaurant_id': restaurant_id, 'driver_id': driver_id
+                })
+                conn.execute(text("ANALYZE orders"))
+                names = index_names(conn)
+
+                checks = [
+                    ("Order.active() count (/api/health)", count_sql(Order.query.filter(Order.active())),
+                     ANY_ACTIVE),
+                    ("pending count (dashboard)", count_sql(Order.query.filter(Order.active('pending'))),
+                     ANY_ACTIVE),
+                    ("in-progress list", sql(Order.active_orders('confirmed', 'preparing', 'ready', 'out_for_delivery')),
+                     {'idx_orders_active'}),
+                    ("restaurant board", sql(Order.active_orders(restaurant_id=restaurant_id)),
+                     {'idx_orders_active_restaurant'}),
+                    ("driver's open orders", sql(Order.active_orders(driver_id=driver_id)),
+                     {'idx_orders_active_driver'}),
+                    ("raw counter (routes.py)",
+                     "SELECT COUNT(*) FROM orders WHERE order_status NOT IN ('delivered', 'cancelled')",
+                     ANY_ACTIVE),
+                    ("active_orders view", "SELECT * FROM active_orders", ANY_ACTIVE),
+                ]
+
+                for label, statement, expected in checks:
+                    plan = '\n'.join(row[0] for row in conn.exec_driver_sql(f"EXPLAIN {statement}"))
+                    used = {names[word] for word in plan.replace('(', ' ').split() if word in names}
+                    ok = bool(expected & used)
+                    failures += not ok
+                    print(f"   {'✅' if ok else '❌'} {label:<38} {', '.join(sorted(used)) or 'no active index'}")
+                    if not ok or '-v' in sys.argv:
+                        print('      ' + plan.replace('\n', '\n      '))
+            finally:
+                trans.rollback()
+
+    print(f"\n{'✅ All plans use the active-order indexes' if not failures else f'❌ {failures} plan(s) regressed'}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# check_admin_queries.py
+"""
+Count SQL queries per admin page view, with and without the identity cache.
+
+Runs against the database configured by DATABASE_URL (needs the admin user
+from db/init.sql):
+
+    python check_admin_queries.py [username] [password]
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+
+PAGES = [
+    '/admin/dashboard',
+    '/admin/orders',
+    '/admin/drivers',
+    '/admin/menu-items',
+    '/admin/customers',
+]
+VIEWS_PER_PAGE = 5
+
+
+def measure(app, client, identity_cache):
+    app.config['IDENTITY_CACHE_ENABLED'] = identity_cache
+    cache.clear()
+
+    counts = {}
+    for page in PAGES:
+        # First view warms the caches, the average is over the following ones
+        client.get(page)
+        total = 0
+        for _ in range(VIEWS_PER_PAGE):
+            counter['queries'] = 0
+            response = client.get(page)
+            if response.status_code != 200:
+                print(f"   {page} returned {response.status_code}")
+            total += counter['queries']
+        counts[page] = total / VIEWS_PER_PAGE
+    return counts
+
+
+counter = {'queries': 0}
+
+if __name__ == '__main__':
+    username = sys.argv[1] if len(sys.argv) > 1 else 'admin'
+    password = sys.argv[2] if len(sys.argv) > 2 else 'Admin@123'
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            counter['queries'] += 1
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    if response.status_code not in (200, 302):
+        print(f"❌ Login failed ({response.status_code})")
+        sys.exit(1)
+
+    print("📊 Queries per admin page view")
+    before = measure(app, client, identity_cache=False)
+    after = measure(app, client, identity_cache=True)
+
+    print(f"{'page':<25}{'before':>10}{'after':>10}")
+    for page in PAGES:
+        print(f"{page:<25}{before[page]:>10.1f}{after[page]:>10.1f}")
@@ -42,4 +42,33 @@ config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
     'default': DevelopmentConfig
+}
+
+# ============================================
+# DATABASE POOL (per service, read by app/database.py)
+# ============================================
+class PoolConfig:
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))          # seconds to wait for a connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))        # seconds
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 15000))
+    DB_POOL_PREFILL = int(os.environ.get('DB_POOL_PREFILL', 2))           # connections opened on worker start
+
+class WebPoolConfig(PoolConfig):
+    # Admin pages run the heavier reports
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+
+class ApiPoolConfig(PoolConfig):
+    # Mobile API: many short queries, fail fast instead of queueing
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 3))
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+    DB_POOL_PREFILL = int(os.environ.get('DB_POOL_PREFILL', 5))
+
+pool_config = {
+    'web': WebPoolConfig,
+    'api': ApiPoolConfig,
+    'default': PoolConfig
 }
\ No newline at end of file
@@ -56,6 +56,29 @@ CREATE TABLE IF NOT EXISTS restaurants (
 CREATE TRIGGER update_restaurants_updated_at BEFORE UPDATE ON restaurants
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Weekly opening hours (0 = Monday). A span whose closes_at is not after
+-- opens_at runs past midnight; restaurants without rows fall back to
+-- opening_time/closing_time every day.
+CREATE TABLE IF NOT EXISTS restaurant_hours (
+    hours_id SERIAL PRIMARY KEY,
+    restaurant_id VARCHAR(20) NOT NULL REFERENCES restaurants(restaurant_id) ON DELETE CASCADE,
+    day_of_week SMALLINT NOT NULL CHECK (day_of_week BETWEEN 0 AND 6),
+    opens_at TIME NOT NULL,
+    closes_at TIME NOT NULL,
+    UNIQUE (restaurant_id, day_of_week, opens_at)
+);
+
+-- Dated overrides of the weekly hours. NULL restaurant_id applies to every
+-- restaurant; NULL opens_at/closes_at means closed for the day.
+CREATE TABLE IF NOT EXISTS restaurant_holidays (
+    holiday_id SERIAL PRIMARY KEY,
+    restaurant_id VARCHAR(20) REFERENCES restaurants(restaurant_id) ON DELETE CASCADE,
+    holiday_date DATE NOT NULL,
+    name VARCHAR(100),
+    opens_at TIME,
+    closes_at TIME
+);
+
 -- ============================================
 -- CREATE USERS TABLE (Authentication)
 -- ============================================
@@ -117,6 +140,84 @@ CREATE TABLE IF NOT EXISTS drivers (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Latest GPS fix per driver, kept out of the drivers row. Written as batched
+-- upserts every few seconds (see app/location_ingest.py): no foreign key, no
+-- trigger and no index besides the key, and free space left in each page so
+-- the updates stay HOT.
+CREATE TABLE IF NOT EXISTS driver_positions (
+    driver_id INTEGER PRIMARY KEY,
+    latitude NUMERIC(9, 6) NOT NULL,
+    longitude NUMERIC(9, 6) NOT NULL,
+    accuracy REAL, -- metres
+    speed REAL, -- km/h
+    heading SMALLINT, -- degrees
+    recorded_at TIMESTAMP NOT NULL, -- device time of the fix
+    received_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+) WITH (fillfactor = 50, autovacuum_vacuum_scale_factor = 0.02);
+
+-- Driver GPS tracks, partitioned by day on the segment's first fix. A row is
+-- up to a few minutes of one driver's track, simplified and delta-encoded
+-- (see app/driver_tracks.py); old days are downsampled, then dropped by
+-- `flask compact-tracks`. Partitions come from create_driver_location_partitions.
+CREATE TABLE IF NOT EXISTS driver_locations (
+    driver_id INTEGER NOT NULL,
+    started_at TIMESTAMP NOT NULL, -- first fix
+    ended_at TIMESTAMP NOT NULL, -- last fix
+    points SMALLINT NOT NULL, -- fixes stored
+    raw_points SMALLINT NOT NULL, -- fixes received
+    start_lat INTEGER NOT NULL, -- microdegrees
+    start_lng INTEGER NOT NULL,
+    deltas BYTEA NOT NULL, -- zigzag varint (ms, lat, lng) deltas of the following fixes
+    resolution SMALLINT NOT NULL DEFAULT 0, -- seconds per fix once downsampled, 0 as ingested
+    PRIMARY KEY (driver_id, started_at)
+) PARTITION BY RANGE (started_at);
+
+-- Daily partitions of driver_locations for p_days days from p_from, plus a
+-- default partition (app/partitions.py runs this ahead of time)
+CREATE OR REPLACE FUNCTION create_driver_location_partitions(p_from DATE, p_days INTEGER, p_schema TEXT DEFAULT 'public')
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_day DATE;
+    v_name TEXT;
+    v_in_default BOOLEAN;
+    v_created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('create_driver_location_partitions'));
+    
+    IF to_regclass(format('%I.driver_locations_default', p_schema)) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I.driver_locations_default PARTITION OF %I.driver_locations DEFAULT',
+                       p_schema, p_schema);
+        v_created := v_created + 1;
+    END IF;
+    
+    FOR i IN 0 .. p_days - 1
+    LOOP
+        v_day := p_from + i;
+        v_name := 'driver_locations_' || to_char(v_day, 'YYYY_MM_DD');
+        CONTINUE WHEN to_regclass(format('%I.%I', p_schema, v_name)) IS NOT NULL;
+        
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I.driver_locations_default WHERE started_at >= %L AND started_at < %L)',
+                       p_schema, v_day, v_day + 1)
+            INTO v_in_default;
+        IF v_in_default THEN
+            RAISE WARNING 'driver_locations has rows for % in its default partition, not creating %', v_day, v_name;
+            CONTINUE;
+        END IF;
+        
+        EXECUTE format('CREATE TABLE %I.%I PARTITION OF %I.driver_locations FOR VALUES FROM (%L) TO (%L)',
+                       p_schema, v_name, p_schema, v_day, v_day + 1);
+        v_created := v_created + 1;
+    END LOOP;
+    
+    RETURN v_created;
+END;
+$$;
+
+-- Yesterday through a week ahead
+SELECT create_driver_location_partitions((CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date - 1, 9);
+
 -- ============================================
 -- CREATE CUSTOMERS TABLE (References users)
 -- ============================================
@@ -165,8 +266,11 @@ CREATE TABLE IF NOT EXISTS addresses (
 -- ============================================
 -- CREATE ORDERS TABLE (References multiple tables)
 -- ============================================
+-- Orders, order_items and order_status_history are partitioned by month
+-- on the order's created_at (see app/partitions.py). Primary keys and the
+-- items/history foreign keys include it, as partitioning requires.
 CREATE TABLE IF NOT EXISTS orders (
-    order_id VARCHAR(30) PRIMARY KEY,
+    order_id VARCHAR(30) NOT NULL,
     customer_id VARCHAR(20) REFERENCES customers(customer_id),
     restaurant_id VARCHAR(20) REFERENCES restaurants(restaurant_id),
     address_id INTEGER REFERENCES addresses(address_id),
@@ -186,44 +290,69 @@ CREATE TABLE IF NOT EXISTS orders (
     driver_id INTEGER REFERENCES drivers(driver_id),
     driver_rating INTEGER CHECK (driver_rating >= 1 AND driver_rating <= 5),
     
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Order timestamps are naive UTC (the database itself runs in Africa/Algiers)
+    created_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
     estimated_delivery TIMESTAMP,
     delivered_at TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status_changed_at TIMESTAMP DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'), -- last transition (app/order_transitions.py)
+    
+    PRIMARY KEY (order_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Restaurant-local day of the order, for "today" counts and daily reports
+-- (see app/business_days.py). Adding it to an existing table rewrites it.
+ALTER TABLE orders ALTER COLUMN created_at SET DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC');
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS business_date DATE
+    GENERATED ALWAYS AS (((created_at AT TIME ZONE 'UTC') AT TIME ZONE 'Africa/Algiers')::date) STORED;
+
+-- Time of the order's last status change, so a transition can fill
+-- time_in_previous_status without reading the history. NULL on older rows,
+-- which fall back to created_at.
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP;
+ALTER TABLE orders ALTER COLUMN status_changed_at SET DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC');
 
 -- ============================================
 -- CREATE ORDER ITEMS TABLE (References orders & menu_items)
 -- ============================================
 CREATE TABLE IF NOT EXISTS order_items (
-    order_item_id SERIAL PRIMARY KEY,
-    order_id VARCHAR(30) REFERENCES orders(order_id) ON DELETE CASCADE,
+    order_item_id SERIAL,
+    order_id VARCHAR(30) NOT NULL,
+    order_created_at TIMESTAMP NOT NULL, -- the order's created_at (partition key)
     item_id VARCHAR(20) REFERENCES menu_items(item_id),
     quantity INTEGER NOT NULL CHECK (quantity > 0),
     unit_price DECIMAL(10, 2) NOT NULL CHECK (unit_price >= 0),
     customizations JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    
+    PRIMARY KEY (order_item_id, order_created_at),
+    FOREIGN KEY (order_id, order_created_at) REFERENCES orders(order_id, created_at) ON DELETE CASCADE
+) PARTITION BY RANGE (order_created_at);
 
 -- ============================================
 -- CREATE ORDER STATUS HISTORY TABLE
 -- ============================================
+-- Append-only: a status change inserts a row, nothing updates it. Only the
+-- columns timelines and reports read live here; staff notes, IP and user
+-- agent go to order_status_audit (see app/order_history.py).
 CREATE TABLE IF NOT EXISTS order_status_history (
-    history_id SERIAL PRIMARY KEY,
-    order_id VARCHAR(30) REFERENCES orders(order_id) ON DELETE CASCADE,
+    history_id SERIAL,
+    order_id VARCHAR(30) NOT NULL,
+    order_created_at TIMESTAMP NOT NULL, -- the order's created_at (partition key)
     
     -- Status Information
     old_status VARCHAR(20),
     new_status VARCHAR(20) NOT NULL,
     
-    -- Actor Information
-    changed_by INTEGER REFERENCES users(user_id) ON DELETE SET NULL,
+    -- Actor Information (no foreign keys: deleting a user or driver must not
+    -- update the log)
+    changed_by INTEGER,
     actor_type VARCHAR(20) DEFAULT 'system' CHECK (
         actor_type IN ('customer', 'driver', 'restaurant', 'admin', 'system')
     ),
     
     -- Delivery Specific (if applicable)
-    driver_id INTEGER REFERENCES drivers(driver_id) ON DELETE SET NULL,
+    driver_id INTEGER,
     location_lat DECIMAL(10, 8),
     location_lng DECIMAL(11, 8),
     estimated_arrival TIMESTAMP,
@@ -234,7 +363,6 @@ CREATE TABLE IF NOT EXISTS order_status_history (
     
     -- Notes & Details
     public_notes TEXT, -- Visible to customer
-    internal_notes TEXT, -- Staff only
     reason_code VARCHAR(50), -- Predefined codes: 'customer_request', 'restaurant_delay', etc.
     
     -- Timestamps
@@ -243,8 +371,6 @@ CREATE TABLE IF NOT EXISTS order_status_history (
     effective_until TIMESTAMP,
     
     -- Technical Audit
-    ip_address INET,
-    user_agent TEXT,
     source VARCHAR(50) DEFAULT 'web', -- 'mobile_app', 'api', 'admin_panel', 'auto_system'
     
     -- Performance Metrics
@@ -254,16 +380,160 @@ CREATE TABLE IF NOT EXISTS order_status_history (
     -- Indexes for performance
     CONSTRAINT valid_status_transition CHECK (
         old_status IS DISTINCT FROM new_status
-    )
+    ),
+    
+    PRIMARY KEY (history_id, order_created_at),
+    FOREIGN KEY (order_id, order_created_at) REFERENCES orders(order_id, created_at) ON DELETE CASCADE
+) PARTITION BY RANGE (order_created_at);
+
+-- Databases created before partitioning: the app writes the key column from
+-- now on, `flask partition-orders` backfills it and converts the tables
+ALTER TABLE order_items ADD COLUMN IF NOT EXISTS order_created_at TIMESTAMP;
+ALTER TABLE order_status_history ADD COLUMN IF NOT EXISTS order_created_at TIMESTAMP;
+
+-- Databases created before the append-only layout keep their inline audit
+-- columns until `flask compact-history` has moved them to order_status_audit
+ALTER TABLE order_status_history DROP CONSTRAINT IF EXISTS order_status_history_changed_by_fkey;
+ALTER TABLE order_status_history DROP CONSTRAINT IF EXISTS order_status_history_driver_id_fkey;
+
+-- ============================================
+-- ORDER STATUS AUDIT (side table of order_status_history)
+-- ============================================
+-- Wide, rarely read audit text of a status change. Written in batches after
+-- the history row commits; append-only like the log, with no foreign keys
+-- and one BRIN index, so a row costs a heap insert and nothing else.
+CREATE TABLE IF NOT EXISTS order_status_audit (
+    history_id INTEGER NOT NULL,
+    order_id VARCHAR(30) NOT NULL,
+    order_created_at TIMESTAMP,
+    internal_notes TEXT, -- Staff only
+    ip_address INET,
+    user_agent TEXT,
+    recorded_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_status_audit_brin ON order_status_audit USING brin (history_id, order_created_at);
+
+-- ============================================
+-- ORDER PARTITIONS
+-- ============================================
+-- Monthly partitions of the three order tables for p_months months from
+-- p_from, plus a default partition each. The app calls this ahead of time
+-- (app/partitions.py, `flask ensure-partitions`). A month whose rows already
+-- landed in a default partition is skipped with a warning: move those rows
+-- out first, since the new partition would overlap them. `flask
+-- partition-orders` installs the same function (CREATE_PARTITION_FUNCTION in
+-- app/partitions.py) on databases created before it; change both together.
+CREATE OR REPLACE FUNCTION create_order_partitions(p_from DATE, p_months INTEGER, p_schema TEXT DEFAULT 'public')
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_table TEXT;
+    v_key TEXT;
+    v_month DATE;
+    v_name TEXT;
+    v_in_default BOOLEAN;
+    v_created INTEGER := 0;
+BEGIN
+    -- Workers run this concurrently
+    PERFORM pg_advisory_xact_lock(hashtext('create_order_partitions'));
+    
+    FOREACH v_table IN ARRAY ARRAY['orders', 'order_items', 'order_status_history']
+    LOOP
+        v_key := CASE v_table WHEN 'orders' THEN 'created_at' ELSE 'order_created_at' END;
+        
+        IF to_regclass(format('%I.%I', p_schema, v_table || '_default')) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I.%I PARTITION OF %I.%I DEFAULT',
+                           p_schema, v_table || '_default', p_schema, v_table);
+            v_created := v_created + 1;
+        END IF;
+        
+        FOR i IN 0 .. p_months - 1
+        LOOP
+            v_month := (date_trunc('month', p_from) + make_interval(months => i))::date;
+            v_name := v_table || '_' || to_char(v_month, 'YYYY_MM');
+            CONTINUE WHEN to_regclass(format('%I.%I', p_schema, v_name)) IS NOT NULL;
+            
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I.%I WHERE %I >= %L AND %I < %L)',
+                           p_schema, v_table || '_default', v_key, v_month, v_key, (v_month + INTERVAL '1 month')::date)
+                INTO v_in_default;
+            IF v_in_default THEN
+                RAISE WARNING '% has rows for % in its default partition, not creating %', v_table, v_month, v_name;
+                CONTINUE;
+            END IF;
+            
+            EXECUTE format('CREATE TABLE %I.%I PARTITION OF %I.%I FOR VALUES FROM (%L) TO (%L)',
+                           p_schema, v_name, p_schema, v_table, v_month, (v_month + INTERVAL '1 month')::date);
+            v_created := v_created + 1;
+        END LOOP;
+    END LOOP;
+    
+    RETURN v_created;
+END;
+$$;
+
+-- Last month through three months ahead (no-op on unpartitioned tables)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'orders'::regclass) THEN
+        PERFORM create_order_partitions(
+            (date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') - INTERVAL '1 month')::date, 5);
+    END IF;
+END $$;
+
+-- ============================================
+-- ORDER ARCHIVE
+-- ============================================
+-- Delivered and cancelled orders past ORDER_ARCHIVE_DAYS, moved here with
+-- their items and history by `flask archive-orders` (see app/archive.py).
+-- Same columns as the live tables (business_date is a plain copy), no
+-- foreign keys, and only the indexes lookups and reports need.
+CREATE TABLE IF NOT EXISTS orders_archive (
+    LIKE orders,
+    archived_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    PRIMARY KEY (order_id)
+);
+
+-- Archives created before orders.status_changed_at
+ALTER TABLE orders_archive ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS order_items_archive (
+    LIKE order_items,
+    archived_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    PRIMARY KEY (order_item_id)
 );
 
--- Create indexes for common queries
-CREATE INDEX IF NOT EXISTS idx_order_status_history_order ON order_status_history(order_id);
-CREATE INDEX IF NOT EXISTS idx_order_status_history_changed_at ON order_status_history(changed_at DESC);
-CREATE INDEX IF NOT EXISTS idx_order_status_history_new_status ON order_status_history(new_status);
-CREATE INDEX IF NOT EXISTS idx_order_status_history_actor ON order_status_history(changed_by);
-CREATE INDEX IF NOT EXISTS idx_order_status_history_driver ON order_status_history(driver_id);
-CREATE INDEX IF NOT EXISTS idx_order_status_history_notified ON order_status_history(customer_notified) WHERE customer_notified = FALSE;
+CREATE TABLE IF NOT EXISTS order_status_history_archive (
+    LIKE order_status_history,
+    archived_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    PRIMARY KEY (history_id)
+);
+
+CREATE TABLE IF NOT EXISTS order_status_audit_archive (
+    LIKE order_status_audit,
+    archived_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    PRIMARY KEY (history_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_archive_customer ON orders_archive(customer_id);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_restaurant_business_date ON orders_archive(restaurant_id, business_date) INCLUDE (order_status, total_amount);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_business_date ON orders_archive(business_date) INCLUDE (created_at, order_status, total_amount);
+CREATE INDEX IF NOT EXISTS idx_order_items_archive_order ON order_items_archive(order_id);
+CREATE INDEX IF NOT EXISTS idx_order_history_archive_order ON order_status_history_archive(order_id);
+
+-- History indexes: the order timeline (track_order, order detail) and a
+-- BRIN on changed_at for time-range scans, which is tiny because rows
+-- arrive in changed_at order. A status change writes the heap, the primary
+-- key and one B-tree, where it used to write seven B-trees.
+CREATE INDEX IF NOT EXISTS idx_order_status_history_timeline ON order_status_history(order_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_order_status_history_changed_at_brin ON order_status_history USING brin (changed_at) WITH (pages_per_range = 32);
+DROP INDEX IF EXISTS idx_order_status_history_order;
+DROP INDEX IF EXISTS idx_order_status_history_changed_at;
+DROP INDEX IF EXISTS idx_order_status_history_new_status;
+DROP INDEX IF EXISTS idx_order_status_history_actor;
+DROP INDEX IF EXISTS idx_order_status_history_driver;
+DROP INDEX IF EXISTS idx_order_status_history_notified;
 
 -- ============================================
 -- CREATE AUTHENTICATION TABLES
@@ -272,21 +542,30 @@ CREATE INDEX IF NOT EXISTS idx_order_status_history_notified ON order_status_his
 CREATE TABLE IF NOT EXISTS login_attempts (
     attempt_id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(user_id),
+    username VARCHAR(50),
     ip_address INET,
     user_agent TEXT,
     success BOOLEAN,
     attempted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+-- Databases created before login throttling
+ALTER TABLE login_attempts ADD COLUMN IF NOT EXISTS username VARCHAR(50);
 
+-- One row per issued JWT (session_id = jti); token holds a SHA-256 digest
 CREATE TABLE IF NOT EXISTS user_sessions (
     session_id VARCHAR(128) PRIMARY KEY,
     user_id INTEGER REFERENCES users(user_id),
+    token_type VARCHAR(10) DEFAULT 'access',
     token TEXT NOT NULL,
     ip_address INET,
     user_agent TEXT,
     expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+-- Databases created before the session registry
+ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS token_type VARCHAR(10) DEFAULT 'access';
+ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMP;
 
 CREATE TABLE IF NOT EXISTS password_reset_tokens (
     token_id SERIAL PRIMARY KEY,
@@ -300,29 +579,30 @@ CREATE TABLE IF NOT EXISTS password_reset_tokens (
 -- ============================================
 -- CREATE INDEXES
 -- ============================================
+-- UNIQUE columns already have an index; `flask index-advisor` reports
+-- unused, duplicate and missing indexes on a running database and writes
+-- the CONCURRENTLY migration to fix them.
 
 -- Users indexes
-CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
-CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
 CREATE INDEX IF NOT EXISTS idx_users_restaurant ON users(restaurant_id);
 
 -- Drivers indexes
-CREATE INDEX IF NOT EXISTS idx_drivers_user ON drivers(user_id);
 CREATE INDEX IF NOT EXISTS idx_drivers_available ON drivers(is_available) WHERE is_available = true;
 CREATE INDEX IF NOT EXISTS idx_drivers_on_shift ON drivers(is_on_shift) WHERE is_on_shift = true;
 CREATE INDEX IF NOT EXISTS idx_drivers_rating ON drivers(rating DESC);
 CREATE INDEX IF NOT EXISTS idx_drivers_vehicle ON drivers(vehicle_type);
 
 -- Customers indexes
-CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone_number);
-CREATE INDEX IF NOT EXISTS idx_customers_email ON customers(email);
 CREATE INDEX IF NOT EXISTS idx_customers_user ON customers(user_id);
 
 -- Addresses indexes
 CREATE INDEX IF NOT EXISTS idx_addresses_customer ON addresses(customer_id);
 CREATE INDEX IF NOT EXISTS idx_addresses_location ON addresses(latitude, longitude);
 
+-- Restaurant hours indexes
+CREATE INDEX IF NOT EXISTS idx_restaurant_holidays_date ON restaurant_holidays(holiday_date);
+
 -- Menu items indexes
 CREATE INDEX IF NOT EXISTS idx_menu_items_restaurant ON menu_items(restaurant_id);
 CREATE INDEX IF NOT EXISTS idx_menu_items_category ON menu_items(category);
@@ -331,12 +611,26 @@ CREATE INDEX IF NOT EXISTS idx_menu_items_available ON menu_items(is_available)
 
 -- Orders indexes
 CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id);
-CREATE INDEX IF NOT EXISTS idx_orders_restaurant ON orders(restaurant_id);
-CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(order_status);
+-- Status and restaurant lists, newest first (the leading column alone is served too)
+CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(order_status, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_restaurant_created ON orders(restaurant_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at);
 CREATE INDEX IF NOT EXISTS idx_orders_driver ON orders(driver_id);
 CREATE INDEX IF NOT EXISTS idx_orders_delivery_type ON orders(delivery_type);
 CREATE INDEX IF NOT EXISTS idx_orders_payment_status ON orders(payment_status);
+-- Index-only "today" counts and daily totals, overall and per restaurant
+CREATE INDEX IF NOT EXISTS idx_orders_business_date ON orders(business_date) INCLUDE (created_at, order_status, total_amount);
+CREATE INDEX IF NOT EXISTS idx_orders_restaurant_business_date ON orders(restaurant_id, business_date) INCLUDE (created_at, order_status, total_amount);
+-- Open orders only (a small, hot slice): boards, counters and the active_orders
+-- view. Queries must spell the predicate the same way (Order.active() in
+-- app/models.py) for the planner to pick these. Plain counts of the open slice
+-- go to whichever is smallest; status lists, boards and driver lists to their own.
+CREATE INDEX IF NOT EXISTS idx_orders_active ON orders(order_status, created_at)
+    INCLUDE (restaurant_id, driver_id, total_amount) WHERE order_status NOT IN ('delivered', 'cancelled');
+CREATE INDEX IF NOT EXISTS idx_orders_active_restaurant ON orders(restaurant_id, created_at)
+    INCLUDE (order_status) WHERE order_status NOT IN ('delivered', 'cancelled');
+CREATE INDEX IF NOT EXISTS idx_orders_active_driver ON orders(driver_id, created_at)
+    INCLUDE (order_status) WHERE order_status NOT IN ('delivered', 'cancelled');
 
 -- Order items indexes
 CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
@@ -345,15 +639,12 @@ CREATE INDEX IF NOT EXISTS idx_order_items_item ON order_items(item_id);
 -- Authentication indexes
 CREATE INDEX IF NOT EXISTS idx_login_attempts_user ON login_attempts(user_id);
 CREATE INDEX IF NOT EXISTS idx_login_attempts_time ON login_attempts(attempted_at);
+CREATE INDEX IF NOT EXISTS idx_login_attempts_ip_time ON login_attempts(ip_address, attempted_at);
 CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions(expires_at);
-CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens(token);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_revoked ON user_sessions(expires_at) WHERE revoked_at IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires ON password_reset_tokens(expires_at);
 
--- Order status history indexes
-CREATE INDEX IF NOT EXISTS idx_order_history_order ON order_status_history(order_id);
-CREATE INDEX IF NOT EXISTS idx_order_history_changed_at ON order_status_history(changed_at);
-
 -- ============================================
 -- CREATE TRIGGERS
 -- ============================================
@@ -585,74 +876,82 @@ VALUES
     ('PAS-003', 'REST-005', 'Lasagna', 'Layered pasta with meat sauce', 13.99, 'Pasta', true)
 ON CONFLICT (item_id) DO NOTHING;
 
--- Create sample orders
+-- Create sample orders. created_at is part of the primary key and relative to
+-- now, so ON CONFLICT cannot catch a re-run; skip orders that already exist.
 INSERT INTO orders (
     order_id, customer_id, restaurant_id, address_id, order_status, 
     delivery_type, subtotal, tax, delivery_fee, total_amount, 
     payment_method, payment_status, created_at
 ) 
-VALUES 
-    (
-        'ORD-001-' || EXTRACT(YEAR FROM CURRENT_DATE), 
-        'CUST-001', 
-        'REST-002', 
-        1, 
-        'delivered',
-        'delivery', 
-        27.98, 
-        2.23, 
-        2.99, 
-        33.20,
-        'credit_card', 
-        'paid', 
-        CURRENT_TIMESTAMP - INTERVAL '2 hours'
-    ),
-    (
-        'ORD-002-' || EXTRACT(YEAR FROM CURRENT_DATE), 
-        'CUST-002', 
-        'REST-001', 
-        3, 
-        'out_for_delivery',
-        'delivery', 
-        21.98, 
-        1.76, 
-        2.99, 
-        26.73,
-        'cash', 
-        'paid', 
-        CURRENT_TIMESTAMP - INTERVAL '1 hour'
-    ),
-    (
-        'ORD-003-' || EXTRACT(YEAR FROM CURRENT_DATE), 
-        'CUST-003', 
-        'REST-003', 
-        4, 
-        'preparing',
-        'pickup', 
-        11.97, 
-        0.96, 
-        0.00, 
-        12.93,
-        'credit_card', 
-        'paid', 
-        CURRENT_TIMESTAMP - INTERVAL '30 minutes'
-    ),
-    (
-        'ORD-004-' || EXTRACT(YEAR FROM CURRENT_DATE), 
-        'CUST-004', 
-        'REST-004', 
-        5, 
-        'pending',
-        'delivery', 
-        19.98, 
-        1.60, 
-        2.99, 
-        24.57,
-        'cash', 
-        'pending', 
-        CURRENT_TIMESTAMP
-    )
-ON CONFLICT (order_id) DO NOTHING;
+SELECT v.*
+FROM (
+    VALUES 
+        (
+            'ORD-001-' || EXTRACT(YEAR FROM CURRENT_DATE), 
+            'CUST-001', 
+            'REST-002', 
+            1, 
+            'delivered',
+            'delivery', 
+            27.98, 
+            2.23, 
+            2.99, 
+            33.20,
+            'credit_card', 
+            'paid', 
+            CURRENT_TIMESTAMP - INTERVAL '2 hours'
+        ),
+        (
+            'ORD-002-' || EXTRACT(YEAR FROM CURRENT_DATE), 
+            'CUST-002', 
+            'REST-001', 
+            3, 
+            'out_for_delivery',
+            'delivery', 
+            21.98, 
+            1.76, 
+            2.99, 
+            26.73,
+            'cash', 
+            'paid', 
+            CURRENT_TIMESTAMP - INTERVAL '1 hour'
+        ),
+        (
+            'ORD-003-' || EXTRACT(YEAR FROM CURRENT_DATE), 
+            'CUST-003', 
+            'REST-003', 
+            4, 
+            'preparing',
+            'pickup', 
+            11.97, 
+            0.96, 
+            0.00, 
+            12.93,
+            'credit_card', 
+            'paid', 
+            CURRENT_TIMESTAMP - INTERVAL '30 minutes'
+        ),
+        (
+            'ORD-004-' || EXTRACT(YEAR FROM CURRENT_DATE), 
+            'CUST-004', 
+            'REST-004', 
+            5, 
+            'pending',
+            'delivery', 
+            19.98, 
+            1.60, 
+            2.99, 
+            24.57,
+            'cash', 
+            'pending', 
+            CURRENT_TIMESTAMP
+        )
+) AS v(
+    order_id, customer_id, restaurant_id, address_id, order_status,
+    delivery_type, subtotal, tax, delivery_fee, total_amount,
+    payment_method, payment_status, created_at
+)
+WHERE NOT EXISTS (SELECT 1 FROM orders o WHERE o.order_id = v.order_id);
 
 -- Assign drivers to orders
 UPDATE orders SET driver_id = (SELECT driver_id FROM drivers WHERE user_id = (SELECT user_id FROM users WHERE username = 'driver1')) 
@@ -662,15 +961,22 @@ UPDATE orders SET driver_id = (SELECT driver_id FROM drivers WHERE user_id = (SE
 WHERE order_id LIKE 'ORD-002%';
 
 -- Create order items
-INSERT INTO order_items (order_id, item_id, quantity, unit_price) 
-VALUES 
-    ((SELECT order_id FROM orders WHERE order_id LIKE 'ORD-001%'), 'PIZ-001', 1, 12.99),
-    ((SELECT order_id FROM orders WHERE order_id LIKE 'ORD-001%'), 'PIZ-002', 1, 14.99),
-    ((SELECT order_id FROM orders WHERE order_id LIKE 'ORD-002%'), 'BUR-001', 2, 9.99),
-    ((SELECT order_id FROM orders WHERE order_id LIKE 'ORD-002%'), 'BUR-004', 1, 13.99),
-    ((SELECT order_id FROM orders WHERE order_id LIKE 'ORD-003%'), 'TAC-001', 3, 3.99),
-    ((SELECT order_id FROM orders WHERE order_id LIKE 'ORD-004%'), 'SUS-001', 2, 8.99)
-ON CONFLICT DO NOTHING;
+INSERT INTO order_items (order_id, order_created_at, item_id, quantity, unit_price) 
+SELECT o.order_id, o.created_at, v.item_id, v.quantity, v.unit_price
+FROM (
+    VALUES 
+        ('ORD-001%', 'PIZ-001', 1, 12.99),
+        ('ORD-001%', 'PIZ-002', 1, 14.99),
+        ('ORD-002%', 'BUR-001', 2, 9.99),
+        ('ORD-002%', 'BUR-004', 1, 13.99),
+        ('ORD-003%', 'TAC-001', 3, 3.99),
+        ('ORD-004%', 'SUS-001', 2, 8.99)
+) AS v(order_pattern, item_id, quantity, unit_price)
+JOIN orders o ON o.order_id LIKE v.order_pattern
+WHERE NOT EXISTS (
+    SELECT 1 FROM order_items oi
+    WHERE oi.order_id = o.order_id AND oi.order_created_at = o.created_at AND oi.item_id = v.item_id
+);
 
 -- ============================================
 -- CREATE VIEWS
@@ -722,7 +1028,8 @@ SELECT
     d.vehicle_model,
     d.license_plate,
     d.rating,
-    d.current_location,
+    -- GPS pings land in driver_positions; drivers.current_location is no longer written
+    COALESCE(p.latitude || ',' || p.longitude, d.current_location)::VARCHAR(100) AS current_location,
     d.total_deliveries,
     d.completed_deliveries,
     d.avg_delivery_time,
@@ -732,6 +1039,7 @@ SELECT
     u.last_login
 FROM drivers d
 JOIN users u ON d.user_id = u.user_id
+LEFT JOIN driver_positions p ON p.driver_id = d.driver_id
 WHERE d.is_available = true 
     AND u.is_active = true
     AND (d.is_on_shift = true OR d.shift_start IS NULL)
@@ -759,6 +1067,16 @@ GROUP BY d.driver_id, u.username, u.email, d.rating, d.total_deliveries, d.compl
          d.failed_deliveries, d.total_earnings, d.avg_delivery_time
 ORDER BY d.rating DESC, success_rate DESC;
 
+-- Live and archived orders, for reports (filters are pushed into both sides)
+CREATE OR REPLACE VIEW all_orders AS
+SELECT order_id, customer_id, restaurant_id, driver_id, order_status, payment_status,
+       total_amount, created_at, delivered_at, business_date, FALSE AS archived
+FROM orders
+UNION ALL
+SELECT order_id, customer_id, restaurant_id, driver_id, order_status, payment_status,
+       total_amount, created_at, delivered_at, business_date, TRUE AS archived
+FROM orders_archive;
+
 -- View for restaurant sales summary
 CREATE OR REPLACE VIEW restaurant_sales AS
 SELECT 
@@ -771,7 +1089,7 @@ SELECT
     MIN(o.created_at) as first_order_date,
     MAX(o.created_at) as last_order_date
 FROM restaurants r
-LEFT JOIN orders o ON r.restaurant_id = o.restaurant_id
+LEFT JOIN all_orders o ON r.restaurant_id = o.restaurant_id
 WHERE o.order_status NOT IN ('cancelled')
    OR o.order_id IS NULL
 GROUP BY r.restaurant_id, r.name
@@ -791,7 +1109,7 @@ SELECT
     MAX(o.created_at) as last_order,
     STRING_AGG(DISTINCT r.name, ', ') as restaurants_ordered_from
 FROM customers c
-LEFT JOIN orders o ON c.customer_id = o.customer_id
+LEFT JOIN all_orders o ON c.customer_id = o.customer_id
 LEFT JOIN restaurants r ON o.restaurant_id = r.restaurant_id
 GROUP BY c.customer_id, c.name, c.phone_number, c.email
 ORDER BY total_spent DESC NULLS LAST;
@@ -810,9 +1128,10 @@ AS $$
 DECLARE
     v_available_driver_id INTEGER;
     v_order_status VARCHAR(20);
+    v_created_at TIMESTAMP;
 BEGIN
     -- Check if order exists and is ready for delivery
-    SELECT order_status INTO v_order_status
+    SELECT order_status, created_at INTO v_order_status, v_created_at
     FROM orders 
     WHERE order_id = p_order_id;
     
@@ -832,7 +1151,7 @@ BEGIN
             SET driver_id = p_driver_id, 
                 order_status = 'out_for_delivery',
                 updated_at = CURRENT_TIMESTAMP
-            WHERE order_id = p_order_id;
+            WHERE order_id = p_order_id AND created_at = v_created_at;
             
             -- Mark driver as busy
             UPDATE drivers 
@@ -841,8 +1160,8 @@ BEGIN
             WHERE driver_id = p_driver_id;
             
             -- Log status change
-            INSERT INTO order_status_history (order_id, old_status, new_status)
-            VALUES (p_order_id, v_order_status, 'out_for_delivery');
+            INSERT INTO order_status_history (order_id, order_created_at, old_status, new_status)
+            VALUES (p_order_id, v_created_at, v_order_status, 'out_for_delivery');
             
             RAISE NOTICE 'Order % assigned to driver %', p_order_id, p_driver_id;
         ELSE
@@ -861,7 +1180,7 @@ BEGIN
             SET driver_id = v_available_driver_id, 
                 order_status = 'out_for_delivery',
                 updated_at = CURRENT_TIMESTAMP
-            WHERE order_id = p_order_id;
+            WHERE order_id = p_order_id AND created_at = v_created_at;
             
             -- Mark driver as busy
             UPDATE drivers 
@@ -870,8 +1189,8 @@ BEGIN
             WHERE driver_id = v_available_driver_id;
             
             -- Log status change
-            INSERT INTO order_status_history (order_id, old_status, new_status)
-            VALUES (p_order_id, v_order_status, 'out_for_delivery');
+            INSERT INTO order_status_history (order_id, order_created_at, old_status, new_status)
+            VALUES (p_order_id, v_created_at, v_order_status, 'out_for_delivery');
             
             RAISE NOTICE 'Order % automatically assigned to driver %', p_order_id, v_available_driver_id;
         ELSE
@@ -893,9 +1212,11 @@ DECLARE
     v_order_total DECIMAL(10, 2);
     v_order_status VARCHAR(20);
     v_delivery_time INTEGER;
+    v_created_at TIMESTAMP;
 BEGIN
     -- Get driver, order total, and status
-    SELECT driver_id, total_amount, order_status INTO v_driver_id, v_order_total, v_order_status
+    SELECT driver_id, total_amount, order_status, created_at
+    INTO v_driver_id, v_order_total, v_order_status, v_created_at
     FROM orders 
     WHERE order_id = p_order_id;
     
@@ -910,7 +1231,7 @@ BEGIN
     -- Calculate delivery time in minutes
     SELECT EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - created_at))/60 INTO v_delivery_time
     FROM orders 
-    WHERE order_id = p_order_id;
+    WHERE order_id = p_order_id AND created_at = v_created_at;
     
     -- Update order status
     UPDATE orders 
@@ -918,7 +1239,7 @@ BEGIN
         delivered_at = CURRENT_TIMESTAMP,
         updated_at = CURRENT_TIMESTAMP,
         driver_rating = p_driver_rating
-    WHERE order_id = p_order_id;
+    WHERE order_id = p_order_id AND created_at = v_created_at;
     
     -- Update driver stats
     UPDATE drivers 
@@ -940,8 +1261,8 @@ BEGIN
     WHERE driver_id = v_driver_id;
     
     -- Log status change
-    INSERT INTO order_status_history (order_id, old_status, new_status)
-    VALUES (p_order_id, v_order_status, 'delivered');
+    INSERT INTO order_status_history (order_id, order_created_at, old_status, new_status)
+    VALUES (p_order_id, v_created_at, v_order_status, 'delivered');
     
     RAISE NOTICE 'Delivery completed for order % by driver %. Delivery time: % minutes', 
                  p_order_id, v_driver_id, ROUND(v_delivery_time, 2);
@@ -992,6 +1313,7 @@ DECLARE
     v_item_id VARCHAR(20);
     v_quantity INTEGER;
     v_unit_price DECIMAL(10, 2);
+    v_created_at TIMESTAMP := CURRENT_TIMESTAMP AT TIME ZONE 'UTC';
 BEGIN
     -- Calculate subtotal from items
     FOR v_item IN SELECT * FROM jsonb_array_elements(p_items)
@@ -1034,7 +1356,7 @@ BEGIN
         p_order_id, p_customer_id, p_restaurant_id, p_address_id,
         'pending', p_delivery_type, p_special_instructions,
         v_subtotal, v_tax, v_delivery_fee, v_total,
-        p_payment_method, 'pending', CURRENT_TIMESTAMP
+        p_payment_method, 'pending', v_created_at
     );
     
     -- Add order items
@@ -1048,13 +1370,13 @@ BEGIN
         FROM menu_items 
         WHERE item_id = v_item_id;
         
-        INSERT INTO order_items (order_id, item_id, quantity, unit_price)
-        VALUES (p_order_id, v_item_id, v_quantity, v_unit_price);
+        INSERT INTO order_items (order_id, order_created_at, item_id, quantity, unit_price)
+        VALUES (p_order_id, v_created_at, v_item_id, v_quantity, v_unit_price);
     END LOOP;
     
     -- Log status change
-    INSERT INTO order_status_history (order_id, old_status, new_status)
-    VALUES (p_order_id, NULL, 'pending');
+    INSERT INTO order_status_history (order_id, order_created_at, old_status, new_status)
+    VALUES (p_order_id, v_created_at, NULL, 'pending');
     
     RAISE NOTICE 'Order % created successfully. Total: $%', p_order_id, v_total;
 END;
@@ -1,3 +1,5 @@
+import click
+
 from app import create_app, db
 from app.models import User
 
@@ -31,5 +33,112 @@ def init_db():
         else:
             print("✅ Admin user exists in database")
 
+@app.cli.command("index-advisor")
+@click.option("--workload", type=click.Path(exists=True), help="Captured fingerprints (saved /admin/system/health?format=json).")
+@click.option("--output", type=click.Path(), help="Write the CREATE/DROP INDEX migration to this file.")
+@click.option("--drop-unused", is_flag=True,
+              help="Drop unused indexes in the migration (only after the statistics cover a full workload cycle).")
+@click.option("--min-rows", default=10000, help="Ignore missing indexes on tables smaller than this.")
+@click.option("--schema", default="public")
+def index_advisor(workload, output, drop_unused, min_rows, schema):
+    """Report unused, duplicate and missing indexes from the live workload."""
+    from app.database import REPLICA_BIND
+    from app.index_advisor import IndexAdvisor, load_fingerprints
+    with app.app_context():
+        advisor = IndexAdvisor([db.engine, db.engines.get(REPLICA_BIND)], schema=schema, min_rows=min_rows)
+        advisor.collect(load_fingerprints(workload) if workload else ())
+        advisor.report()
+        if output:
+            with open(output, 'w') as handle:
+                handle.write(advisor.migration(drop_unused=drop_unused))
+            print(f"\n✅ Migration written to {output} (run it with psql, outside a transaction)")
+
+@app.cli.command("purge-sessions")
+def purge_sessions():
+    """Delete expired JWT sessions in batches."""
+    from app import session_registry
+    with app.app_context():
+        deleted = session_registry.purge_expired()
+        print(f"✅ Purged {deleted} expired sessions")
+
+@app.cli.command("ensure-partitions")
+@click.option("--months", default=None, type=int, help="Months ahead to create (default ORDER_PARTITIONS_AHEAD).")
+def ensure_order_partitions(months):
+    """Create the upcoming monthly order partitions."""
+    from app.partitions import ensure_partitions, partition_report
+    with app.app_context():
+        with db.engine.begin() as conn:
+            created = ensure_partitions(conn, months or app.config['ORDER_PARTITIONS_AHEAD'])
+            report = partition_report(conn)
+        print(f"✅ Created {created} partitions")
+        for table, partitions in report.items():
+            print(f"   {table}")
+            for row in partitions:
+                print(f"      {row['partition']:<36} {row['bound']:<64} ~{row['rows']:,} rows")
+
+@app.cli.command("partition-orders")
+@click.option("--batch-size", default=5000, help="Rows copied per transaction.")
+@click.option("--pause", default=0.05, help="Seconds to sleep between batches.")
+@click.option("--swap", is_flag=True, help="Swap the partitioned tables in once the copy is verified.")
+def partition_orders(batch_size, pause, swap):
+    """Migrate the order tables to monthly partitions online."""
+    from app.partitions import OrderPartitionMigration
+    with app.app_context():
+        OrderPartitionMigration(db.engine, batch_size=batch_size, pause=pause).run(swap=swap)
+
+@app.cli.command("archive-orders")
+@click.option("--days", default=None, type=int, help="Retention in days (default ORDER_ARCHIVE_DAYS).")
+@click.option("--batch-size", default=1000, help="Orders moved per transaction.")
+@click.option("--pause", default=0.05, help="Seconds to sleep between batches.")
+@click.option("--limit", default=None, type=int, help="Stop after about this many orders.")
+def archive_orders(days, batch_size, pause, limit):
+    """Move closed orders past the retention window to the archive tables."""
+    from app.archive import OrderArchiver
+    with app.app_context():
+        archiver = OrderArchiver(db.engine, retention_days=days or app.config['ORDER_ARCHIVE_DAYS'],
+                                 batch_size=batch_size, pause=pause)
+        archiver.run(limit=limit)
+
+@app.cli.command("compact-history")
+@click.option("--batch-size", default=5000, help="History rows per transaction when moving inline audit text.")
+@click.option("--pause", default=0.05, help="Seconds to sleep between batches.")
+@click.option("--no-freeze", is_flag=True, help="Skip VACUUM FREEZE of closed monthly partitions.")
+def compact_history(batch_size, pause, no_freeze):
+    """Move inline audit text aside, summarize BRIN ranges, freeze closed history partitions."""
+    from app.order_history import HistoryCompactor
+    with app.app_context():
+        HistoryCompactor(db.engine, batch_size=batch_size, pause=pause).run(freeze=not no_freeze)
+
+@app.cli.command("compact-tracks")
+@click.option("--raw-days", default=None, type=int, help="Days kept at full resolution (default TRACK_RAW_DAYS).")
+@click.option("--keep-days", default=None, type=int, help="Days of tracks kept at all (default TRACK_RETENTION_DAYS).")
+@click.option("--resolution", default=None, type=int, help="Seconds per fix once downsampled (default TRACK_DOWNSAMPLE_SECONDS).")
+@click.option("--batch-size", default=2000, help="Segments rewritten per transaction.")
+@click.option("--pause", default=0.05, help="Seconds to sleep between batches.")
+def compact_tracks(raw_days, keep_days, resolution, batch_size, pause):
+    """Downsample old driver tracks and drop expired day partitions."""
+    from app.driver_tracks import TrackRetention
+    with app.app_context():
+        TrackRetention(db.engine, raw_days=raw_days or app.config['TRACK_RAW_DAYS'],
+                       keep_days=keep_days or app.config['TRACK_RETENTION_DAYS'],
+                       resolution=resolution or app.config['TRACK_DOWNSAMPLE_SECONDS'],
+                       batch_size=batch_size, pause=pause).run()
+
+@app.cli.command("dispatch")
+@click.option("--once", is_flag=True, help="Run a single round and exit.")
+@click.option("--interval", default=None, type=int, help="Seconds between rounds (default DISPATCH_INTERVAL).")
+def dispatch(once, interval):
+    """Assign ready orders to available drivers in batched rounds."""
+    import time
+    from app import dispatcher
+    with app.app_context():
+        while True:
+            summary = dispatcher.run_once()
+            print(f"🛵 {summary['assigned']} assigned of {summary['orders']} ready orders, "
+                  f"{summary['drivers']} drivers ({summary['method']}, {summary['solve_ms']}ms solve)")
+            if once:
+                break
+            time.sleep(interval or app.config['DISPATCH_INTERVAL'])
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
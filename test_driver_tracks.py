@@ -0,0 +1,73 @@
+# test_driver_tracks.py
+"""Track compression and retention (app/driver_tracks.py), no database needed"""
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.driver_tracks import TrackRetention, decode_track, encode_track
+
+START = datetime(2026, 1, 5, 12, 0, 0)
+
+
+def track(seconds=300, step=3):
+    return [(START + timedelta(seconds=i), 36.75 + i * 1e-5, 3.05 - i * 2e-5) for i in range(0, seconds, step)]
+
+
+class PartitionConnection:
+    """Answers downsample_partition's SELECT like psycopg2 does: bytea as a memoryview"""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.updates = []
+
+    def execute(self, statement, params=None):
+        if str(statement).startswith('SELECT'):
+            pending = [row for row in self.segments if row['resolution'] == 0]
+            return SimpleNamespace(all=lambda: [
+                SimpleNamespace(**{**row, 'deltas': memoryview(row['deltas']).cast('c')}) for row in pending])
+        for update in params:
+            for row in self.segments:
+                if row['driver_id'] == update['driver_id'] and row['started_at'] == update['old_started_at']:
+                    row.update({key: update[key] for key in ('points', 'start_lat', 'start_lng', 'deltas', 'resolution')})
+                    self.updates.append(update)
+
+
+class PartitionEngine:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @contextmanager
+    def begin(self):
+        yield self.connection
+
+
+def test_decode_round_trip():
+    points = track()
+    row = SimpleNamespace(**encode_track(points))
+    decoded = decode_track(row)
+    assert [fix[0] for fix in decoded] == [point[0] for point in points]
+    assert all(abs(fix[1] - point[1]) < 1e-6 and abs(fix[2] - point[2]) < 1e-6
+               for fix, point in zip(decoded, points))
+
+
+def test_decode_accepts_memoryview():
+    row = encode_track(track())
+    as_read = SimpleNamespace(**{**row, 'deltas': memoryview(row['deltas']).cast('c')})
+    assert decode_track(as_read) == decode_track(SimpleNamespace(**row))
+
+
+def test_downsample_partition():
+    points = track()
+    connection = PartitionConnection([{'driver_id': 7, **encode_track(points), 'resolution': 0}])
+    retention = TrackRetention(PartitionEngine(connection), resolution=30, pause=0, log=lambda message: None)
+
+    assert retention.downsample_partition('driver_locations_2026_01_05') == 1
+    segment = connection.segments[0]
+    assert segment['resolution'] == 30
+    fixes = decode_track(SimpleNamespace(**segment))
+    assert segment['points'] == len(fixes) == 11  # one fix per 30 s bucket, plus the last
+    assert fixes[0][0] == points[0][0] and fixes[-1][0] == points[-1][0]